@@ -7,12 +7,26 @@
 from __future__ import division
 
 from datetime import datetime, timedelta
-from collections import OrderedDict
-from itertools import product
+from collections import OrderedDict, deque
+from itertools import product, chain
+from time import time
+import os
+import hashlib
+import tempfile
 import multiprocessing
 import pymongo
+import numpy as np
 
 from ctaBase import *
+from ctaStopOrder import StopOrderBook, LimitOrderBook
+from ctaBarService import BarService
+from ctaDataLoader import ColumnarData, loadColumnarData, openMemmapArray, getPeakMemory
+from ctaHistoryCache import HistoryCache
+from ctaTickFile import iterTickFileBlock, TICK_FILE_BLOCK_SIZE
+from ctaProfiler import BacktestingProfiler
+from ctaResultStore import BacktestResultStore
+from ctaDailyResult import DailySettlement, TRADING_DAYS_PER_YEAR
+from ctaOptimizer import SEARCH_GRID, SEARCH_RANDOM, SEARCH_GENETIC, SEARCH_HALVING, createSearcher
 from ctaSetting import *
 
 import csv
@@ -22,6 +36,12 @@ from vtGateway import VtOrderData, VtTradeData
 from vtFunction import loadMongoSetting
 
 
+# 启用性能分析时计时的回测引擎方法
+PROFILE_METHOD_LIST = ['runBacktesting', 'loadHistoryData', 'precomputeIndicator', 'replayData',
+                       'newBar', 'newTick', 'crossLimitOrder', 'crossStopOrder', 'writeCtaLog',
+                       'calculateBacktestingResult', 'calculateDailyResult']
+
+
 ########################################################################
 class BacktestingEngine(object):
     """
@@ -44,6 +64,7 @@ class BacktestingEngine(object):
         # key为stopOrderID，value为stopOrder对象
         self.stopOrderDict = {}  # 停止单撤销后不会从本字典中删除
         self.workingStopOrderDict = {}  # 停止单撤销后会从本字典中删除
+        self.stopOrderBook = StopOrderBook()  # 按价格排列的等待中停止单
 
         # 引擎类型为回测
         self.engineType = ENGINETYPE_BACKTESTING
@@ -67,6 +88,16 @@ class BacktestingEngine(object):
         self.initData = []  # 初始化用的数据
         # self.backtestingData = []   # 回测用的数据
 
+        self.columnar = False  # 是否使用列式数据载入
+        self.dataCacheDir = ''  # 本地历史数据缓存目录，为空则不缓存
+        self.historyData = None  # 列式载入的全部历史数据（包括初始化数据），多次回测时重复使用
+        self.historyStartDate = None  # historyData覆盖的开始时间，None表示不限
+        self.historyEndDate = None  # historyData覆盖的结束时间，None表示不限
+        self.backtestingData = None  # 列式载入的回测数据，ColumnarData对象
+        self.dataFileList = []  # 回测数据文件列表，不为空时从文件流式读取数据
+        self.dataStream = None  # 从文件读取的回测数据流，逐条生成数据对象
+        self.replayList = None  # 预计算指标时读入内存的回测数据列表（非列式载入时）
+
         self.dbName = ''  # 回测数据库名
         self.symbol = ''  # 回测集合名
 
@@ -75,7 +106,8 @@ class BacktestingEngine(object):
         self.strategyStartDate = None  # 策略启动日期（即前面的数据用于初始化），datetime对象
 
         self.limitOrderDict = OrderedDict()  # 限价单字典
-        self.workingLimitOrderDict = OrderedDict()  # 活动限价单字典，用于进行撮合用
+        self.workingLimitOrderDict = OrderedDict()  # 活动限价单字典
+        self.limitOrderBook = LimitOrderBook()  # 按价格排列的活动限价单，用于进行撮合用
         self.limitOrderCount = 0  # 限价单编号
 
         self.tradeCount = 0  # 成交编号
@@ -85,6 +117,17 @@ class BacktestingEngine(object):
 
         self.writeTrade = False
 
+        self.resultStore = None  # 回测结果缓存，BacktestResultStore对象
+
+        self.dailyMode = False  # 是否进行逐日盯市结算
+        self.dailySettlement = None  # 逐日结算对象，每次回测时创建
+        self.fingerprintDict = {}  # 回测数据指纹的缓存，key为(数据库, 合约, 模式, 开始时间, 结束时间)，载入数据时清空
+
+        self.profiler = None  # 性能分析对象，BacktestingProfiler对象
+        self.barEndLabel = True  # K线模式的回测数据的时间是否为K线结束时间
+        self.precompute = False  # K线模式中是否由策略预先计算全部K线的指标
+        self.barService = BarService()  # K线合成和指标计算，每次初始化策略时创建
+
         # 当前最新数据，用于模拟成交用
         self.tick = None
         self.bar = None
@@ -108,24 +151,138 @@ class BacktestingEngine(object):
         if endDate:
             self.dataEndDate = datetime.strptime(endDate, '%Y%m%d')
             # 若不修改时间则会导致不包含dataEndDate当天数据
-            self.dataEndDate.replace(hour=23, minute=59)
+            self.dataEndDate = self.dataEndDate.replace(hour=23, minute=59, second=59)
+        else:
+            self.dataEndDate = None
 
             # ----------------------------------------------------------------------
 
     def setBacktestingMode(self, mode):
         """设置回测模式"""
         self.mode = mode
+        self.historyData = None
+        self.fingerprintDict.clear()
 
     # ----------------------------------------------------------------------
     def setDatabase(self, dbName, symbol):
         """设置历史数据所用的数据库"""
         self.dbName = dbName
         self.symbol = symbol
+        self.historyData = None
+        self.fingerprintDict.clear()
+
+    # ----------------------------------------------------------------------
+    def setColumnar(self, columnar=True, cacheDir=''):
+        """
+        设置是否使用列式数据载入（批量载入为NumPy结构化数组后回放）
+        cacheDir不为空时使用该目录下的本地历史数据缓存（内存映射文件），
+        之后相同时间段的回测以及并行优化的工作进程都直接从缓存读取
+        """
+        self.columnar = columnar
+        self.dataCacheDir = cacheDir
+        self.historyData = None
+        self.fingerprintDict.clear()
+
+    # ----------------------------------------------------------------------
+    def setDataFile(self, fileList):
+        """
+        设置回测数据文件（单个文件名或者按时间排列的文件名列表），支持二进制Tick文件
+        和CSV文件（可以gzip压缩），回测时按块读取，不再访问数据库，为空时取消设置
+        """
+        if isinstance(fileList, basestring):
+            fileList = [fileList]
+        self.dataFileList = list(fileList or [])
+
+    # ----------------------------------------------------------------------
+    def setDailyMode(self, dailyMode=True):
+        """设置是否在回测时进行逐日盯市结算，结果通过calculateDailyResult获取"""
+        self.dailyMode = dailyMode
+
+    # ----------------------------------------------------------------------
+    def setBarEndLabel(self, endLabel=True):
+        """设置K线模式的回测数据的时间是否为K线结束时间（如9:01表示9:00-9:01），用于订阅K线的合成"""
+        self.barEndLabel = endLabel
+        self.barService.setEndLabel(endLabel)
+
+    # ----------------------------------------------------------------------
+    def setPrecomputeMode(self, precompute=True):
+        """
+        设置K线模式中是否预计算指标：回放数据之前把全部K线的数组传给策略的onPrecompute，
+        策略一次性算出指标数组，onBar中直接读取当前K线的数值（策略需要实现onPrecompute）
+        """
+        self.precompute = precompute
+
+    # ----------------------------------------------------------------------
+    def setProfileMode(self, profile=True, profileStrategy=False):
+        """
+        设置是否分析回测性能：统计载入数据、回放、撮合、策略回调、日志和计算结果
+        各阶段的耗时，profileStrategy为True时在策略回调期间启用cProfile，
+        结果通过showProfileResult显示
+        """
+        if self.profiler:
+            self.profiler.unwrap()
+            self.profiler = None
+
+        if not profile:
+            return
+
+        self.profiler = BacktestingProfiler(profileStrategy)
+        for name in PROFILE_METHOD_LIST:
+            self.profiler.wrap(self, name)
+
+    # ----------------------------------------------------------------------
+    def showProfileResult(self, statsFile='', count=30):
+        """
+        显示各阶段的耗时统计，数据读取和解码的耗时为replayData减去newBar/newTick，
+        statsFile不为空时把策略回调的cProfile结果保存到该文件
+        """
+        if not self.profiler:
+            self.output(u'未启用性能分析')
+            return
+
+        timerDict = self.profiler.timerDict
+        extraList = []
+        if 'replayData' in timerDict:
+            elapsed = timerDict['replayData'].total
+            for name in ['newBar', 'newTick']:
+                if name in timerDict:
+                    elapsed -= timerDict[name].total
+            extraList.append((u'数据读取和解码', elapsed))
+
+        self.output(u'回测性能分析（占比相对于runBacktesting，策略回调包括其中的日志）')
+        self.profiler.printReport(self.output, 'runBacktesting', extraList)
+
+        if self.profiler.profile:
+            self.profiler.printStats(count=count)
+            if statsFile:
+                self.profiler.dumpStats(statsFile)
+                self.output(u'策略回调的cProfile结果已保存：%s' % statsFile)
+
+    # ----------------------------------------------------------------------
+    def setHistoryData(self, data, startDate=None, endDate=None):
+        """
+        直接设置列式历史数据（ColumnarData，需包括初始化数据），startDate和endDate为
+        数据覆盖的时间范围（datetime，None表示不限），回测区间在该范围内时不再载入数据，
+        用于并行优化的工作进程使用主进程载入的数据
+        """
+        self.columnar = True
+        self.historyData = data
+        self.fingerprintDict.clear()
+        self.historyStartDate = startDate
+        self.historyEndDate = endDate
 
     # ----------------------------------------------------------------------
     def loadHistoryData(self):
         """载入历史数据"""
-        host, port = loadMongoSetting()
+        if self.dataFileList:
+            self.loadFileHistoryData()
+            return
+
+        if self.columnar:
+            self.loadColumnarHistoryData()
+            return
+
+        host, port, logging = loadMongoSetting()
 
         self.dbClient = pymongo.MongoClient(host, port)
         collection = self.dbClient[self.dbName][self.symbol]
@@ -162,6 +319,115 @@ class BacktestingEngine(object):
 
         self.output(u'载入完成，数据量：%s' % (initCursor.count() + self.dbCursor.count()))
 
+    # ----------------------------------------------------------------------
+    def loadFileHistoryData(self):
+        """
+        从数据文件按块读取历史数据，初始化数据全部读取，回测数据作为数据流在回放时
+        逐块读取，内存占用和文件大小无关
+        """
+        if self.mode == self.BAR_MODE:
+            dataClass = CtaBarData
+        else:
+            dataClass = CtaTickData
+
+        self.output(u'开始从文件载入数据，文件数量：%s' % len(self.dataFileList))
+        blockIter = iterTickFileBlock(self.dataFileList, dataClass,
+                                      self.dataStartDate, self.dataEndDate)
+
+        self.initData = []
+        self.dataStream = iter([])
+        for data in blockIter:
+            initData, backtestingData = data.split(self.strategyStartDate)
+            self.initData.extend(initData.toList())
+
+            # 第一块回测数据之后的文件内容在回放时再读取
+            if len(backtestingData):
+                self.dataStream = chain(backtestingData.iterData(TICK_FILE_BLOCK_SIZE),
+                                        chain.from_iterable(data.iterData(TICK_FILE_BLOCK_SIZE)
+                                                            for data in blockIter))
+                break
+
+        self.output(u'初始化数据载入完成，数据量：%s' % len(self.initData))
+
+    # ----------------------------------------------------------------------
+    def loadColumnarHistoryData(self):
+        """以列式方式载入历史数据，初始化数据和回测数据通过一次查询载入后再按时间拆分"""
+        data = self.getHistoryData()
+
+        initData, self.backtestingData = data.split(self.strategyStartDate)
+        self.initData = initData.toList()
+
+    # ----------------------------------------------------------------------
+    def readFileHistoryData(self, dataClass):
+        """从数据文件一次性读取回测区间（包括初始化数据）的列式历史数据，用于并行优化的工作进程"""
+        self.output(u'开始从文件载入数据，文件数量：%s' % len(self.dataFileList))
+        blockList = list(iterTickFileBlock(self.dataFileList, dataClass,
+                                           self.dataStartDate, self.dataEndDate))
+        if not blockList:
+            return ColumnarData(dataClass)
+
+        data = blockList[0].copyInfo(ColumnarData(dataClass, np.concatenate([block.array for block in blockList])))
+        self.output(u'载入完成，数据量：%s' % len(data))
+        return data
+
+    # ----------------------------------------------------------------------
+    def getHistoryData(self):
+        """
+        获取回测区间的列式历史数据，已载入的数据覆盖回测区间时直接从中截取（如参数优化、
+        逐次减半搜索的短区间回测），否则重新载入，修改回测模式或者数据库后也会重新载入
+        """
+        if self.historyData is None or not self.isHistoryCovered():
+            self.historyData = self.queryHistoryData()
+            self.fingerprintDict.clear()
+            self.historyStartDate = self.dataStartDate
+            self.historyEndDate = self.dataEndDate
+
+        return self.historyData.slice(self.dataStartDate, self.dataEndDate)
+
+    # ----------------------------------------------------------------------
+    def isHistoryCovered(self):
+        """检查已载入的历史数据是否覆盖当前的回测区间"""
+        if self.historyStartDate and self.dataStartDate < self.historyStartDate:
+            return False
+        if self.historyEndDate and (not self.dataEndDate or self.dataEndDate > self.historyEndDate):
+            return False
+        return True
+
+    # ----------------------------------------------------------------------
+    def queryHistoryData(self):
+        """从本地缓存或者数据库载入回测区间的列式历史数据"""
+
+        if self.mode == self.BAR_MODE:
+            dataClass = CtaBarData
+        else:
+            dataClass = CtaTickData
+
+        start = datetime.now()
+        if self.dataCacheDir:
+            self.output(u'开始从本地缓存载入数据：%s' % self.dataCacheDir)
+            cache = HistoryCache(self.dataCacheDir)
+            data = cache.loadData(self.dbName, self.symbol, dataClass,
+                                  self.dataStartDate, self.dataEndDate)
+        else:
+            self.output(u'开始载入数据')
+
+            host, port, logging = loadMongoSetting()
+            self.dbClient = pymongo.MongoClient(host, port)
+            collection = self.dbClient[self.dbName][self.symbol]
+
+            flt = {'datetime': {'$gte': self.dataStartDate}}
+            if self.dataEndDate:
+                flt['datetime']['$lte'] = self.dataEndDate
+            data = loadColumnarData(collection, flt, dataClass)
+            data.sort()
+
+        if data is None:
+            self.output(u'本地缓存和数据库都不可用')
+            data = ColumnarData(dataClass)
+
+        self.output(u'载入完成，数据量：%s，耗时：%s' % (len(data), datetime.now() - start))
+        return data
+
     # ----------------------------------------------------------------------
     def runBacktesting(self):
         """运行回测"""
@@ -178,6 +444,12 @@ class BacktestingEngine(object):
 
         self.output(u'开始回测')
 
+        if self.profiler:
+            self.profiler.wrapStrategy(self.strategy)
+
+        if self.precompute and self.mode == self.BAR_MODE:
+            self.precomputeIndicator(dataClass)
+
         self.strategy.inited = True
         self.strategy.onInit()
         self.output(u'策略初始化完成')
@@ -188,29 +460,112 @@ class BacktestingEngine(object):
 
         self.output(u'开始回放数据')
 
-        for d in self.dbCursor:
-            data = dataClass()
-            data.__dict__ = d
-            func(data)
+        if self.dailyMode:
+            self.dailySettlement = DailySettlement(self.size, self.rate, self.slippage,
+                                                   self.estimateDayCount())
+
+        self.replayData(func, dataClass)
+
+        if self.dailySettlement:
+            self.dailySettlement.finish()
 
         self.output(u'数据回放结束')
 
+        if self.profiler:
+            self.profiler.unwrap(self.strategy)
+
+    # ----------------------------------------------------------------------
+    def precomputeIndicator(self, dataClass):
+        """由策略一次性计算全部K线（初始化数据和回测数据）的指标"""
+        start = time()
+        self.strategy.precomputeDict = None
+        d = self.strategy.onPrecompute(self.getPrecomputeArray(dataClass))
+        if d:
+            self.strategy.precomputeDict = d
+            self.output(u'指标预计算完成，耗时：%.3f秒' % (time() - start))
+
+    # ----------------------------------------------------------------------
+    def getPrecomputeArray(self, dataClass):
+        """
+        获取全部K线的开高低收和成交量数组，列式载入时直接从数组中读取，
+        否则先把回测数据全部读入replayList，回放时使用读入的数据
+        """
+        nameList = ['open', 'high', 'low', 'close', 'volume']
+
+        if self.columnar and not self.dataFileList:
+            array = self.getHistoryData().array
+            return dict([(name, np.array(array[name], dtype=float)) for name in nameList])
+
+        if self.dataFileList:
+            self.replayList = list(self.dataStream)
+            self.dataStream = None
+        else:
+            self.replayList = []
+            for d in self.dbCursor:
+                data = dataClass()
+                data.__dict__ = d
+                self.replayList.append(data)
+
+        barList = self.initData + self.replayList
+        return dict([(name, np.array([getattr(bar, name) for bar in barList], dtype=float))
+                     for name in nameList])
+
+    # ----------------------------------------------------------------------
+    def replayData(self, func, dataClass):
+        """逐条读取回测数据并推送给func（newBar或者newTick）"""
+        if self.replayList is not None:
+            for data in self.replayList:
+                func(data)
+            self.replayList = None
+        elif self.dataFileList:
+            for data in self.dataStream:
+                func(data)
+            self.dataStream = None
+        elif self.columnar:
+            for data in self.backtestingData.iterData():
+                func(data)
+        else:
+            for d in self.dbCursor:
+                data = dataClass()
+                data.__dict__ = d
+                func(data)
+
+    # ----------------------------------------------------------------------
+    def estimateDayCount(self):
+        """估计回测的交易日数量，用于逐日结算预先分配数组"""
+        if self.columnar and not self.dataFileList:
+            dateArray = self.backtestingData.array['datetime'].astype('M8[D]')
+            return max(len(np.unique(dateArray)), 1)
+
+        endDate = self.dataEndDate or datetime.now()
+        return max((endDate - self.strategyStartDate).days + 1, 1)
+
     # ----------------------------------------------------------------------
     def newBar(self, bar):
         """新的K线"""
         self.bar = bar
         self.dt = bar.datetime
+        if self.dailySettlement:
+            self.dailySettlement.updatePrice(bar.datetime, bar.close)
         self.crossLimitOrder()  # 先撮合限价单
         self.crossStopOrder()  # 再撮合停止单
-        self.strategy.onBar(bar)  # 推送K线到策略中
+
+        # 推送K线到策略中，订阅了K线的策略和实盘一样只通过K线合成接收
+        if self.barService.isSubscribed(self.strategy):
+            self.barService.updateBar(self.strategy.vtSymbol, bar)
+        else:
+            self.strategy.onBar(bar)
 
     # ----------------------------------------------------------------------
     def newTick(self, tick):
         """新的Tick"""
         self.tick = tick
         self.dt = tick.datetime
+        if self.dailySettlement:
+            self.dailySettlement.updatePrice(tick.datetime, tick.lastPrice)
         self.crossLimitOrder()
         self.crossStopOrder()
+        self.barService.updateTick(self.strategy.vtSymbol, tick)
         self.strategy.onTick(tick)
 
     # ----------------------------------------------------------------------
@@ -219,6 +574,7 @@ class BacktestingEngine(object):
         初始化策略
         setting是策略的参数设置，如果使用类中写好的默认设置则可以不传该参数
         """
+        self.barService = BarService(endLabel=self.barEndLabel)
         self.strategy = strategyClass(self, setting)
         self.strategy.name = self.strategy.className
 
@@ -254,6 +610,7 @@ class BacktestingEngine(object):
             # 保存到限价单字典中
         self.workingLimitOrderDict[orderID] = order
         self.limitOrderDict[orderID] = order
+        self.limitOrderBook.addOrder(order)
 
         return orderID
 
@@ -265,6 +622,7 @@ class BacktestingEngine(object):
             order.status = STATUS_CANCELLED
             order.cancelTime = str(self.dt)
             del self.workingLimitOrderDict[vtOrderID]
+            self.limitOrderBook.cancelOrder(order)
 
     # ----------------------------------------------------------------------
     def sendStopOrder(self, vtSymbol, orderType, price, volume, strategy):
@@ -296,6 +654,7 @@ class BacktestingEngine(object):
             # 保存stopOrder对象到字典中
         self.stopOrderDict[stopOrderID] = so
         self.workingStopOrderDict[stopOrderID] = so
+        self.stopOrderBook.addStopOrder(so)
 
         return stopOrderID
 
@@ -307,10 +666,14 @@ class BacktestingEngine(object):
             so = self.workingStopOrderDict[stopOrderID]
             so.status = STOPORDER_CANCELLED
             del self.workingStopOrderDict[stopOrderID]
+            self.stopOrderBook.cancelStopOrder(so)
 
     # ----------------------------------------------------------------------
     def crossLimitOrder(self):
         """基于最新数据撮合限价单"""
+        if not self.workingLimitOrderDict:
+            return
+
         # 先确定会撮合成交的价格
         if self.mode == self.BAR_MODE:
             buyCrossPrice = self.bar.low  # 若买入方向限价单价格高于该价格，则会成交
@@ -323,55 +686,59 @@ class BacktestingEngine(object):
             buyBestCrossPrice = self.tick.askPrice1
             sellBestCrossPrice = self.tick.bidPrice1
 
-        # 遍历限价单字典中的所有限价单
-        for orderID, order in self.workingLimitOrderDict.items():
-            # 判断是否会成交
-            buyCross = order.direction == DIRECTION_LONG and order.price >= buyCrossPrice
-            sellCross = order.direction == DIRECTION_SHORT and order.price <= sellCrossPrice
-
-            # 如果发生了成交
-            if buyCross or sellCross:
-                # 推送成交数据
-                self.tradeCount += 1  # 成交编号自增1
-                tradeID = str(self.tradeCount)
-                trade = VtTradeData()
-                trade.vtSymbol = order.vtSymbol
-                trade.tradeID = tradeID
-                trade.vtTradeID = tradeID
-                trade.orderID = order.orderID
-                trade.vtOrderID = order.orderID
-                trade.direction = order.direction
-                trade.offset = order.offset
-
-                # 以买入为例：
-                # 1. 假设当根K线的OHLC分别为：100, 125, 90, 110
-                # 2. 假设在上一根K线结束(也是当前K线开始)的时刻，策略发出的委托为限价105
-                # 3. 则在实际中的成交价会是100而不是105，因为委托发出时市场的最优价格是100
-                if buyCross:
-                    trade.price = min(order.price, buyBestCrossPrice)
-                    self.strategy.pos += order.totalVolume
-                else:
-                    trade.price = max(order.price, sellBestCrossPrice)
-                    self.strategy.pos -= order.totalVolume
-
-                trade.volume = order.totalVolume
-                trade.tradeTime = str(self.dt)
-                trade.dt = self.dt
-                self.strategy.onTrade(trade)
-
-                self.tradeDict[tradeID] = trade
-
-                # 推送委托数据
-                order.tradedVolume = order.totalVolume
-                order.status = STATUS_ALLTRADED
-                self.strategy.onOrder(order)
-
-                # 从字典中删除该限价单
-                del self.workingLimitOrderDict[orderID]
+        # 从限价单簿中取出会成交的限价单（按发单顺序），不会成交的限价单不需要遍历，
+        # 回调中新发出的限价单在下一次行情时才撮合
+        for order in self.limitOrderBook.popCrossed(buyCrossPrice, sellCrossPrice):
+            # 策略在之前成交的回调中可能已经撤销了该限价单
+            if order.status != STATUS_NOTTRADED:
+                continue
+
+            # 从字典中删除该限价单
+            del self.workingLimitOrderDict[order.orderID]
+
+            # 推送成交数据
+            self.tradeCount += 1  # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = VtTradeData()
+            trade.vtSymbol = order.vtSymbol
+            trade.tradeID = tradeID
+            trade.vtTradeID = tradeID
+            trade.orderID = order.orderID
+            trade.vtOrderID = order.orderID
+            trade.direction = order.direction
+            trade.offset = order.offset
+
+            # 以买入为例：
+            # 1. 假设当根K线的OHLC分别为：100, 125, 90, 110
+            # 2. 假设在上一根K线结束(也是当前K线开始)的时刻，策略发出的委托为限价105
+            # 3. 则在实际中的成交价会是100而不是105，因为委托发出时市场的最优价格是100
+            if order.direction == DIRECTION_LONG:
+                trade.price = min(order.price, buyBestCrossPrice)
+                self.strategy.pos += order.totalVolume
+            else:
+                trade.price = max(order.price, sellBestCrossPrice)
+                self.strategy.pos -= order.totalVolume
+
+            trade.volume = order.totalVolume
+            trade.tradeTime = str(self.dt)
+            trade.dt = self.dt
+            self.strategy.onTrade(trade)
+
+            self.tradeDict[tradeID] = trade
+            if self.dailySettlement:
+                self.dailySettlement.addTrade(trade.direction, trade.price, trade.volume)
+
+            # 推送委托数据
+            order.tradedVolume = order.totalVolume
+            order.status = STATUS_ALLTRADED
+            self.strategy.onOrder(order)
 
     # ----------------------------------------------------------------------
     def crossStopOrder(self):
         """基于最新数据撮合停止单"""
+        if not self.workingStopOrderDict:
+            return
+
         # 先确定会撮合成交的价格，这里和限价单规则相反
         if self.mode == self.BAR_MODE:
             buyCrossPrice = self.bar.high  # 若买入方向停止单价格低于该价格，则会成交
@@ -382,64 +749,67 @@ class BacktestingEngine(object):
             sellCrossPrice = self.tick.lastPrice
             bestCrossPrice = self.tick.lastPrice
 
-        # 遍历停止单字典中的所有停止单
-        for stopOrderID, so in self.workingStopOrderDict.items():
-            # 判断是否会成交
-            buyCross = so.direction == DIRECTION_LONG and so.price <= buyCrossPrice
-            sellCross = so.direction == DIRECTION_SHORT and so.price >= sellCrossPrice
-
-            # 如果发生了成交
-            if buyCross or sellCross:
-                # 推送成交数据
-                self.tradeCount += 1  # 成交编号自增1
-                tradeID = str(self.tradeCount)
-                trade = VtTradeData()
-                trade.vtSymbol = so.vtSymbol
-                trade.tradeID = tradeID
-                trade.vtTradeID = tradeID
-
-                if buyCross:
-                    self.strategy.pos += so.volume
-                    trade.price = max(bestCrossPrice, so.price)
-                else:
-                    self.strategy.pos -= so.volume
-                    trade.price = min(bestCrossPrice, so.price)
-
-                self.limitOrderCount += 1
-                orderID = str(self.limitOrderCount)
-                trade.orderID = orderID
-                trade.vtOrderID = orderID
-
-                trade.direction = so.direction
-                trade.offset = so.offset
-                trade.volume = so.volume
-                trade.tradeTime = str(self.dt)
-                trade.dt = self.dt
-                self.strategy.onTrade(trade)
-
-                self.tradeDict[tradeID] = trade
-
-                # 推送委托数据
-                so.status = STOPORDER_TRIGGERED
-
-                order = VtOrderData()
-                order.vtSymbol = so.vtSymbol
-                order.symbol = so.vtSymbol
-                order.orderID = orderID
-                order.vtOrderID = orderID
-                order.direction = so.direction
-                order.offset = so.offset
-                order.price = so.price
-                order.totalVolume = so.volume
-                order.tradedVolume = so.volume
-                order.status = STATUS_ALLTRADED
-                order.orderTime = trade.tradeTime
-                self.strategy.onOrder(order)
-
-                self.limitOrderDict[orderID] = order
-
-                # 从字典中删除该限价单
-                del self.workingStopOrderDict[stopOrderID]
+        # 从停止单簿中取出被触发的停止单
+        for so in self.stopOrderBook.popTriggered(buyCrossPrice, sellCrossPrice):
+            # 策略在之前停止单的回调中可能已经撤销了该停止单
+            if so.status != STOPORDER_WAITING:
+                continue
+
+            stopOrderID = so.stopOrderID
+            buyCross = so.direction == DIRECTION_LONG
+
+            # 推送成交数据
+            self.tradeCount += 1  # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = VtTradeData()
+            trade.vtSymbol = so.vtSymbol
+            trade.tradeID = tradeID
+            trade.vtTradeID = tradeID
+
+            if buyCross:
+                self.strategy.pos += so.volume
+                trade.price = max(bestCrossPrice, so.price)
+            else:
+                self.strategy.pos -= so.volume
+                trade.price = min(bestCrossPrice, so.price)
+
+            self.limitOrderCount += 1
+            orderID = str(self.limitOrderCount)
+            trade.orderID = orderID
+            trade.vtOrderID = orderID
+
+            trade.direction = so.direction
+            trade.offset = so.offset
+            trade.volume = so.volume
+            trade.tradeTime = str(self.dt)
+            trade.dt = self.dt
+            self.strategy.onTrade(trade)
+
+            self.tradeDict[tradeID] = trade
+            if self.dailySettlement:
+                self.dailySettlement.addTrade(trade.direction, trade.price, trade.volume)
+
+            # 推送委托数据
+            so.status = STOPORDER_TRIGGERED
+
+            order = VtOrderData()
+            order.vtSymbol = so.vtSymbol
+            order.symbol = so.vtSymbol
+            order.orderID = orderID
+            order.vtOrderID = orderID
+            order.direction = so.direction
+            order.offset = so.offset
+            order.price = so.price
+            order.totalVolume = so.volume
+            order.tradedVolume = so.volume
+            order.status = STATUS_ALLTRADED
+            order.orderTime = trade.tradeTime
+            self.strategy.onOrder(order)
+
+            self.limitOrderDict[orderID] = order
+
+            # 从字典中删除该限价单
+            del self.workingStopOrderDict[stopOrderID]
 
                 # ----------------------------------------------------------------------
 
@@ -457,6 +827,16 @@ class BacktestingEngine(object):
         """直接返回初始化数据列表中的Tick"""
         return self.initData
 
+    # ----------------------------------------------------------------------
+    def subscribeBar(self, strategy, vtSymbol, period, func, indicatorList):
+        """订阅合约K线，返回BarFeed对象"""
+        return self.barService.subscribe(strategy, vtSymbol, period, func, indicatorList)
+
+    # ----------------------------------------------------------------------
+    def updateHistoryBar(self, strategy, vtSymbol, barList):
+        """用初始化数据预热策略订阅的K线和指标（Tick模式下初始化数据为Tick）"""
+        self.barService.warmUp(strategy, vtSymbol, barList, self.mode != self.BAR_MODE)
+
     # ----------------------------------------------------------------------
     def writeCtaLog(self, content):
         """记录日志"""
@@ -487,178 +867,37 @@ class BacktestingEngine(object):
         self.output(u'计算回测结果')
 
         # 首先基于回测后的成交记录，计算每笔交易的盈亏
-        resultList = []  # 交易结果列表
-
-        longTrade = []  # 未平仓的多头交易
-        shortTrade = []  # 未平仓的空头交易
-
-        for trade in self.tradeDict.values():
-            # 多头交易
-            if trade.direction == DIRECTION_LONG:
-                # 如果尚无空头交易
-                if not shortTrade:
-                    longTrade.append(trade)
-                # 当前多头交易为平空
-                else:
-                    while True:
-                        entryTrade = shortTrade[0]
-                        exitTrade = trade
-
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt,
-                                               exitTrade.price, exitTrade.dt,
-                                               -closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            shortTrade.pop(0)
-
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not shortTrade:
-                                longTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass
-
-            # 空头交易
-            else:
-                # 如果尚无多头交易
-                if not longTrade:
-                    shortTrade.append(trade)
-                # 当前空头交易为平多
-                else:
-                    while True:
-                        entryTrade = longTrade[0]
-                        exitTrade = trade
-
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt,
-                                               exitTrade.price, exitTrade.dt,
-                                               closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            longTrade.pop(0)
-
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not longTrade:
-                                shortTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass
-
-                                # 检查是否有交易
+        resultList = self.matchTrades()
+
+        # 检查是否有交易
         if not resultList:
             self.output(u'无交易结果')
             return {}
 
         # 然后基于每笔交易的结果，我们可以计算具体的盈亏曲线和最大回撤等
-        capital = 0  # 资金
-        maxCapital = 0  # 资金最高净值
-        drawdown = 0  # 回撤
-
-        totalResult = 0  # 总成交数量
-        totalTurnover = 0  # 总成交金额（合约面值）
-        totalCommission = 0  # 总手续费
-        totalSlippage = 0  # 总滑点
-
-        timeList = []  # 时间序列
-        pnlList = []  # 每笔盈亏序列
-        capitalList = []  # 盈亏汇总的时间序列
-        drawdownList = []  # 回撤的时间序列
-
-        winningResult = 0  # 盈利次数
-        losingResult = 0  # 亏损次数
-        totalWinning = 0  # 总盈利金额
-        totalLosing = 0  # 总亏损金额
-
-        for result in resultList:
-            capital += result.pnl
-            maxCapital = max(capital, maxCapital)
-            drawdown = capital - maxCapital
-
-            pnlList.append(result.pnl)
-            timeList.append(result.exitDt)  # 交易的时间戳使用平仓时间
-            capitalList.append(capital)
-            drawdownList.append(drawdown)
-
-            totalResult += 1
-            totalTurnover += result.turnover
-            totalCommission += result.commission
-            totalSlippage += result.slippage
-
-            if result.pnl >= 0:
-                winningResult += 1
-                totalWinning += result.pnl
-            else:
-                losingResult += 1
-                totalLosing += result.pnl
-
-        # 计算盈亏相关数据
-        winningRate = winningResult / totalResult * 100  # 胜率
-
-        averageWinning = 0  # 这里把数据都初始化为0
-        averageLosing = 0
-        profitLossRatio = 0
-
-        if winningResult:
-            averageWinning = totalWinning / winningResult  # 平均每笔盈利
-        if losingResult:
-            averageLosing = totalLosing / losingResult  # 平均每笔亏损
-        if averageLosing:
-            profitLossRatio = -averageWinning / averageLosing  # 盈亏比
-
-        # 返回回测结果
-        d = {}
-        d['capital'] = capital
-        d['maxCapital'] = maxCapital
-        d['drawdown'] = drawdown
-        d['totalResult'] = totalResult
-        d['totalTurnover'] = totalTurnover
-        d['totalCommission'] = totalCommission
-        d['totalSlippage'] = totalSlippage
-        d['timeList'] = timeList
-        d['pnlList'] = pnlList
-        d['capitalList'] = capitalList
-        d['drawdownList'] = drawdownList
-        d['winningRate'] = winningRate
-        d['averageWinning'] = averageWinning
-        d['averageLosing'] = averageLosing
-        d['profitLossRatio'] = profitLossRatio
+        d = calculateTradingStatistics(resultList)
 
         if (self.writeTrade):
             self.output_csv(resultList)
 
         return d
 
+    # ----------------------------------------------------------------------
+    def matchTrades(self):
+        """按先开先平的顺序把成交记录配对为开平仓交易，返回TradingResult列表"""
+        return matchTrades(self.tradeDict.values(), self.rate, self.slippage, self.size)
+
+    # ----------------------------------------------------------------------
+    def calculateDailyResult(self):
+        """
+        获取逐日盯市结算的结果（需要先调用setDailyMode），包括每日的持仓盈亏、交易盈亏、
+        手续费、滑点、净盈亏、资金和回撤数组，以及夏普比率、最大回撤等统计指标
+        """
+        if not self.dailySettlement:
+            self.output(u'未启用逐日结算')
+            return {}
+        return self.dailySettlement.getResult()
+
     # ----------------------------------------------------------------------
     def showBacktestingResult(self):
         """显示回测结果"""
@@ -681,6 +920,9 @@ class BacktestingEngine(object):
         self.output(u'平均每笔盈利\t%s' % formatNumber(d['averageWinning']))
         self.output(u'平均每笔亏损\t%s' % formatNumber(d['averageLosing']))
         self.output(u'盈亏比：\t%s' % formatNumber(d['profitLossRatio']))
+        self.output(u'盈利因子：\t%s' % formatNumber(d['profitFactor']))
+        self.output(u'夏普比率：\t%s' % formatNumber(d['sharpeRatio']))
+        self.output(u'最长回撤天数：\t%s' % formatNumber(d['maxDrawdownDuration']))
 
         # 绘图
         import matplotlib.pyplot as plt
@@ -723,27 +965,28 @@ class BacktestingEngine(object):
     def runOptimization(self, strategyClass, optimizationSetting):
         """优化参数"""
         # 获取优化设置
-        settingList = optimizationSetting.generateSetting()
         targetName = optimizationSetting.optimizeTarget
 
         # 检查参数设置问题
-        if not settingList or not targetName:
+        if not optimizationSetting.paramDict or not targetName:
             self.output(u'优化设置有问题，请检查')
 
-        # 遍历优化
-        resultList = []
-        for setting in settingList:
-            self.clearBacktestingResult()
-            self.output('-' * 30)
-            self.output('setting: %s' % str(setting))
-            self.initStrategy(strategyClass, setting)
-            self.runBacktesting()
-            d = self.calculateBacktestingResult()
-            try:
-                targetValue = d[targetName]
-            except KeyError:
-                targetValue = 0
-            resultList.append(([str(setting)], targetValue))
+        # 逐个运行回测，endDate不为None时只回测到该日期（逐次减半的短区间评估）
+        originalEndDate = self.endDate
+
+        def evaluate(settingList, endDate=None):
+            self.setEndDate(endDate or originalEndDate)
+            valueList = []
+            for setting in settingList:
+                self.output('-' * 30)
+                self.output('setting: %s' % str(setting))
+                valueList.append(self.evaluateSetting(strategyClass, setting, targetName))
+            return valueList
+
+        searcher = createSearcher(optimizationSetting, evaluate, 1, self.output,
+                                  self.strategyStartDate, self.getDataEndDate())
+        resultList = [([str(setting)], targetValue) for setting, targetValue in searcher.search()]
+        self.setEndDate(originalEndDate)
 
         # 显示结果
         resultList.sort(reverse=True, key=lambda result: result[1])
@@ -753,6 +996,90 @@ class BacktestingEngine(object):
             self.output(u'%s: %s' % (result[0], result[1]))
         return result
 
+    # ----------------------------------------------------------------------
+    def evaluateSetting(self, strategyClass, setting, targetName):
+        """清空之前的结果后运行一组参数的回测，返回优化目标值（无交易时为0）"""
+        d = self.getBacktestingResult(strategyClass, setting)
+        try:
+            return d[targetName]
+        except KeyError:
+            return 0
+
+    # ----------------------------------------------------------------------
+    def getBacktestingResult(self, strategyClass, setting):
+        """
+        运行一组参数的回测并返回calculateBacktestingResult的结果，
+        设置了结果缓存时优先使用之前相同策略代码、参数、设置和数据的结果
+        """
+        if self.resultStore:
+            key = self.resultStore.makeKey(strategyClass, setting, self.getEngineSetting(),
+                                           self.getDataFingerprint())
+            d = self.resultStore.get(strategyClass, key)
+            if d is not None:
+                return d
+
+        self.clearBacktestingResult()
+        self.initStrategy(strategyClass, setting)
+        self.runBacktesting()
+        d = self.calculateBacktestingResult()
+
+        if self.resultStore:
+            self.resultStore.put(strategyClass, key, d)
+        return d
+
+    # ----------------------------------------------------------------------
+    def setResultStore(self, store):
+        """设置回测结果缓存（BacktestResultStore对象，None表示不使用缓存）"""
+        self.resultStore = store
+
+    # ----------------------------------------------------------------------
+    def getEngineSetting(self):
+        """获取影响回测结果的引擎设置，用于生成结果缓存的key"""
+        d = {}
+        d['mode'] = self.mode
+        d['slippage'] = self.slippage
+        d['rate'] = self.rate
+        d['size'] = self.size
+        d['barEndLabel'] = self.barEndLabel
+        d['strategyStartDate'] = str(self.strategyStartDate)
+        return d
+
+    # ----------------------------------------------------------------------
+    def getDataFingerprint(self):
+        """
+        计算回测数据的指纹，使用数据文件时包括各文件的大小和修改时间，否则为回测区间数据
+        内容的哈希（每个区间只计算一次），逐条载入模式也通过列式查询载入数据计算哈希，
+        数据库中的数据新增、修改或者删除后指纹随之变化
+        """
+        fingerprint = '%s|%s|%s|%s' % (self.dbName, self.symbol, self.dataStartDate, self.dataEndDate)
+        if self.dataFileList:
+            for fileName in self.dataFileList:
+                fingerprint += '|%s|%s|%s' % (fileName, os.path.getsize(fileName), os.path.getmtime(fileName))
+            return fingerprint
+
+        data = self.getHistoryData()
+        key = (self.dbName, self.symbol, self.mode, self.dataStartDate, self.dataEndDate)
+        try:
+            return self.fingerprintDict[key]
+        except KeyError:
+            h = hashlib.sha1(fingerprint)
+            h.update(data.array.dtype.str + repr(data.array.dtype.names))
+            if len(data):
+                h.update(np.ascontiguousarray(data.array).data)
+            self.fingerprintDict[key] = h.hexdigest()
+            return self.fingerprintDict[key]
+
+    # ----------------------------------------------------------------------
+    def getDataEndDate(self):
+        """获取回测数据的结束时间，未设置结束日期时为已载入数据的最后时间或者当前时间"""
+        if self.dataEndDate:
+            return self.dataEndDate
+
+        data = self.historyData
+        if data is not None and len(data):
+            return data.array['datetime'][-1].tolist()
+        return datetime.now()
+
     # ----------------------------------------------------------------------
     def clearBacktestingResult(self):
         """清空之前回测的结果"""
@@ -760,46 +1087,144 @@ class BacktestingEngine(object):
         self.limitOrderCount = 0
         self.limitOrderDict.clear()
         self.workingLimitOrderDict.clear()
+        self.limitOrderBook.clear()
 
         # 清空停止单相关
         self.stopOrderCount = 0
         self.stopOrderDict.clear()
         self.workingStopOrderDict.clear()
+        self.stopOrderBook.clear()
 
         # 清空成交相关
         self.tradeCount = 0
         self.tradeDict.clear()
 
+        # 清空逐日结算、日志和最新数据
+        self.dailySettlement = None
+        del self.logList[:]
+        self.tick = None
+        self.bar = None
+        self.dt = None
+
+    # ----------------------------------------------------------------------
+    def prepareWorkerData(self):
+        """
+        载入历史数据并生成工作进程初始化函数initOptimizeWorker的参数，返回(参数字典, 临时文件名)，
+        使用本地缓存时工作进程直接映射缓存文件，否则（包括使用数据文件时）先把数据写入临时文件
+        （用完后需要删除）
+        """
+        if self.mode == self.BAR_MODE:
+            dataClass = CtaBarData
+        else:
+            dataClass = CtaTickData
+
+        if self.dataFileList:
+            data = self.readFileHistoryData(dataClass)
+        else:
+            data = self.getHistoryData()
+
+        dataFile = ''
+        if self.dataFileList or not self.dataCacheDir:
+            dataFile = os.path.join(tempfile.gettempdir(), 'ctaOptimize%s.dat' % os.getpid())
+            data.array.tofile(dataFile)
+
+        d = {}
+        d['mode'] = self.mode
+        d['startDate'] = self.startDate
+        d['initDays'] = self.initDays
+        d['endDate'] = self.endDate
+        d['slippage'] = self.slippage
+        d['rate'] = self.rate
+        d['size'] = self.size
+        d['dbName'] = self.dbName
+        d['symbol'] = self.symbol
+        d['precompute'] = self.precompute
+        d['barEndLabel'] = self.barEndLabel
+        d['dailyMode'] = self.dailyMode
+        d['cacheDir'] = self.dataCacheDir
+        d['dataFile'] = dataFile
+        d['dataClass'] = dataClass
+        d['count'] = len(data)
+        d['vtSymbol'] = data.vtSymbol
+        d['exchange'] = data.exchange
+        d['dataSymbol'] = data.symbol
+
+        d['resultStoreDir'] = ''
+        if self.resultStore:
+            d['resultStoreDir'] = self.resultStore.storeDir
+            d['resultStoreMaxCount'] = self.resultStore.maxCount
+
+        return d, dataFile
+
     # ----------------------------------------------------------------------
     def runParallelOptimization(self, strategyClass, optimizationSetting):
         """并行优化参数"""
         # 获取优化设置
-        settingList = optimizationSetting.generateSetting()
         targetName = optimizationSetting.optimizeTarget
 
         # 检查参数设置问题
-        if not settingList or not targetName:
+        if not optimizationSetting.paramDict or not targetName:
             self.output(u'优化设置有问题，请检查')
 
-        # 多进程优化，启动一个对应CPU核心数量的进程池
-        pool = multiprocessing.Pool(multiprocessing.cpu_count())
-        l = []
-        for setting in settingList:
-            l.append(pool.apply_async(optimize, (strategyClass, setting,
-                                                 targetName, self.mode,
-                                                 self.startDate, self.initDays, self.endDate,
-                                                 self.slippage, self.rate, self.size,
-                                                 self.dbName, self.symbol)))
-        pool.close()
-        pool.join()
+        # 历史数据只在主进程中载入一次，工作进程以只读内存映射的方式共享
+        d, dataFile = self.prepareWorkerData()
+
+        # 多进程优化，启动一个对应CPU核心数量的进程池，每个进程只创建一个回测引擎
+        start = time()
+        processes = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes, initOptimizeWorker, (d,))
+
+        # 统计每个工作进程的耗时和内存峰值
+        workerDict = OrderedDict()
+
+        def evaluate(settingList, endDate=None):
+            l = []
+            for setting in settingList:
+                l.append(pool.apply_async(runOptimizeTask, (strategyClass, setting, targetName,
+                                                            endDate or self.endDate)))
+
+            valueList = []
+            for res in l:
+                setting, targetValue, pid, cost, memory = res.get()
+                valueList.append(targetValue)
+
+                if pid not in workerDict:
+                    workerDict[pid] = [0, 0, 0]
+                worker = workerDict[pid]
+                worker[0] += 1
+                worker[1] += cost
+                worker[2] = max(worker[2], memory)
+            return valueList
+
+        # 有运行时间上限时分批提交，以便及时停止，否则一次提交全部待评估的参数
+        if optimizationSetting.maxTime:
+            batchSize = processes * 2
+        else:
+            batchSize = max(optimizationSetting.getSettingCount(), 1)
+
+        searcher = createSearcher(optimizationSetting, evaluate, batchSize, self.output,
+                                  self.strategyStartDate, self.getDataEndDate())
+        try:
+            resultList = [(str(setting), targetValue) for setting, targetValue in searcher.search()]
+        finally:
+            pool.close()
+            pool.join()
+
+            if dataFile:
+                os.remove(dataFile)
+
+        self.output('-' * 30)
+        self.output(u'并行优化完成，耗时%.2f秒' % (time() - start))
+        for pid, (count, cost, memory) in workerDict.items():
+            self.output(u'工作进程%s：回测%s次，耗时%.2f秒，内存峰值%.1fMB' % (pid, count, cost, memory))
 
         # 显示结果
-        resultList = [res.get() for res in l]
         resultList.sort(reverse=True, key=lambda result: result[1])
         self.output('-' * 30)
         self.output(u'优化结果：')
         for result in resultList:
             self.output(u'%s: %s' % (result[0], result[1]))
+        return resultList
 
 
             ########################################################################
@@ -838,6 +1263,11 @@ class OptimizationSetting(object):
 
         self.optimizeTarget = ''  # 优化目标字段
 
+        self.searchMode = SEARCH_GRID  # 搜索模式
+        self.searchParamDict = {}  # 搜索算法的参数
+        self.maxEvaluation = 0  # 回测次数上限，0表示不限
+        self.maxTime = 0  # 运行时间上限（秒），0表示不限
+
     # ----------------------------------------------------------------------
     def addParameter(self, name, start, end, step):
         """增加优化参数"""
@@ -881,6 +1311,162 @@ class OptimizationSetting(object):
         """设置优化目标字段"""
         self.optimizeTarget = target
 
+    # ----------------------------------------------------------------------
+    def setSearchMode(self, mode, **kwargs):
+        """
+        设置搜索模式（SEARCH_GRID/SEARCH_RANDOM/SEARCH_GENETIC/SEARCH_HALVING），
+        kwargs为搜索算法的参数，具体见ctaOptimizer中对应的类，
+        所有模式都可以通过seed设置随机数种子
+        """
+        self.searchMode = mode
+        self.searchParamDict = kwargs
+
+    # ----------------------------------------------------------------------
+    def setBudget(self, maxEvaluation=0, maxTime=0):
+        """设置回测次数和运行时间（秒）的上限，达到上限后停止搜索，0表示不限"""
+        self.maxEvaluation = maxEvaluation
+        self.maxTime = maxTime
+
+    # ----------------------------------------------------------------------
+    def getSettingCount(self):
+        """获取参数组合的总数（不生成组合列表）"""
+        count = 1
+        for l in self.paramDict.values():
+            count *= len(l)
+        return count
+
+
+# ----------------------------------------------------------------------
+def matchTrades(tradeList, rate, slippage, size):
+    """
+    按先开先平的顺序把成交记录配对为开平仓交易，返回TradingResult列表
+    未平仓的成交用双端队列保存剩余数量，不修改成交对象本身
+    """
+    resultList = []  # 交易结果列表
+
+    longTrade = deque()  # 未平仓的多头交易，元素为[成交, 剩余数量]
+    shortTrade = deque()  # 未平仓的空头交易
+
+    for trade in tradeList:
+        # 多头交易平空，空头交易平多，平仓数量为正表示多头开仓
+        if trade.direction == DIRECTION_LONG:
+            entryQueue = shortTrade
+            exitQueue = longTrade
+            sign = -1
+        else:
+            entryQueue = longTrade
+            exitQueue = shortTrade
+            sign = 1
+
+        volume = trade.volume
+
+        # 清算开平仓交易
+        while volume and entryQueue:
+            entry = entryQueue[0]
+            entryTrade, entryVolume = entry
+
+            if volume < entryVolume:
+                closedVolume = volume
+                entry[1] = entryVolume - volume
+            else:
+                # 开仓交易已经全部清算，从队列中移除
+                closedVolume = entryVolume
+                entryQueue.popleft()
+            volume -= closedVolume
+
+            resultList.append(TradingResult(entryTrade.price, entryTrade.dt,
+                                            trade.price, trade.dt,
+                                            sign * closedVolume, rate, slippage, size))
+
+        # 平仓后剩余的部分等于新的开仓交易
+        if volume:
+            exitQueue.append([trade, volume])
+
+    return resultList
+
+
+# ----------------------------------------------------------------------
+def calculateTradingStatistics(resultList):
+    """基于每笔交易的结果（TradingResult列表，不能为空）计算盈亏曲线、最大回撤等统计数据"""
+    timeList = [result.exitDt for result in resultList]  # 交易的时间戳使用平仓时间
+    pnlArray = np.array([result.pnl for result in resultList], dtype=float)  # 每笔盈亏序列
+
+    capitalArray = pnlArray.cumsum()  # 盈亏汇总的时间序列
+    maxCapitalArray = np.maximum.accumulate(np.maximum(capitalArray, 0))  # 资金最高净值，从0开始
+    drawdownArray = capitalArray - maxCapitalArray  # 回撤的时间序列
+
+    totalResult = len(resultList)  # 总成交数量
+    totalTurnover = sum([result.turnover for result in resultList])  # 总成交金额（合约面值）
+    totalCommission = sum([result.commission for result in resultList])  # 总手续费
+    totalSlippage = sum([result.slippage for result in resultList])  # 总滑点
+
+    winningMask = pnlArray >= 0
+    winningResult = int(winningMask.sum())  # 盈利次数
+    losingResult = totalResult - winningResult  # 亏损次数
+    totalWinning = pnlArray[winningMask].sum()  # 总盈利金额
+    totalLosing = pnlArray[~winningMask].sum()  # 总亏损金额
+
+    # 计算盈亏相关数据
+    winningRate = winningResult / totalResult * 100  # 胜率
+
+    averageWinning = 0  # 这里把数据都初始化为0
+    averageLosing = 0
+    profitLossRatio = 0
+    profitFactor = 0
+
+    if winningResult:
+        averageWinning = totalWinning / winningResult  # 平均每笔盈利
+    if losingResult:
+        averageLosing = totalLosing / losingResult  # 平均每笔亏损
+    if averageLosing:
+        profitLossRatio = -averageWinning / averageLosing  # 盈亏比
+    if totalLosing:
+        profitFactor = -totalWinning / totalLosing  # 总盈利除以总亏损
+
+    # 按平仓日期汇总的每日盈亏
+    timeArray = np.array(timeList, dtype='M8[us]')
+    dateArray = timeArray.astype('M8[D]')
+    dailyDateArray, dailyIndex = np.unique(dateArray, return_index=True)
+    dailyPnlArray = np.add.reduceat(pnlArray, np.sort(dailyIndex))
+
+    # 夏普比率（基于有平仓交易的交易日的每日盈亏，按每年240个交易日年化）
+    sharpeRatio = 0
+    if len(dailyPnlArray) > 1:
+        std = dailyPnlArray.std(ddof=1)
+        if std:
+            sharpeRatio = dailyPnlArray.mean() / std * np.sqrt(TRADING_DAYS_PER_YEAR)
+
+    # 最长回撤持续时间（天）：从创出新高到再次创出新高（或者回测结束）的最长时间
+    indexArray = np.arange(totalResult)
+    peakIndexArray = np.maximum.accumulate(np.where(drawdownArray >= 0, indexArray, 0))
+    durationArray = (timeArray - timeArray[peakIndexArray]) / np.timedelta64(1, 'D')
+    maxDrawdownDuration = float(durationArray.max())
+
+    # 返回回测结果
+    d = {}
+    d['capital'] = float(capitalArray[-1])
+    d['maxCapital'] = float(maxCapitalArray[-1])
+    d['drawdown'] = float(drawdownArray[-1])
+    d['totalResult'] = totalResult
+    d['totalTurnover'] = totalTurnover
+    d['totalCommission'] = totalCommission
+    d['totalSlippage'] = totalSlippage
+    d['timeList'] = timeList
+    d['pnlList'] = pnlArray.tolist()
+    d['capitalList'] = capitalArray.tolist()
+    d['drawdownList'] = drawdownArray.tolist()
+    d['winningRate'] = winningRate
+    d['averageWinning'] = averageWinning
+    d['averageLosing'] = averageLosing
+    d['profitLossRatio'] = profitLossRatio
+    d['profitFactor'] = profitFactor
+    d['sharpeRatio'] = sharpeRatio
+    d['maxDrawdownDuration'] = maxDrawdownDuration
+    d['dailyDateList'] = dailyDateArray.astype('M8[us]').tolist()
+    d['dailyPnlList'] = dailyPnlArray.tolist()
+
+    return d
+
 
 # ----------------------------------------------------------------------
 def formatNumber(n):
@@ -889,28 +1475,59 @@ def formatNumber(n):
     return format(rn, ',')  # 加上千分符
 
 
+# 并行优化工作进程中重复使用的回测引擎
+optimizeEngine = None
+
+
 # ----------------------------------------------------------------------
-def optimize(strategyClass, setting, targetName,
-             mode, startDate, initDays, endDate,
-             slippage, rate, size,
-             dbName, symbol):
-    """多进程优化时跑在每个进程中运行的函数"""
+def initOptimizeWorker(d):
+    """并行优化工作进程的初始化函数，创建回测引擎并映射主进程载入的历史数据"""
+    global optimizeEngine
+
     engine = BacktestingEngine()
-    engine.setBacktestingMode(mode)
-    engine.setStartDate(startDate, initDays)
-    engine.setSlippage(slippage)
-    engine.setRate(rate)
-    engine.setSize(size)
-    engine.setDatabase(dbName, symbol)
-
-    engine.initStrategy(strategyClass, setting)
-    engine.runBacktesting()
-    d = engine.calculateBacktestingResult()
-    try:
-        targetValue = d[targetName]
-    except KeyError:
-        targetValue = 0
-    return (str(setting), targetValue)
+    engine.setBacktestingMode(d['mode'])
+    engine.setStartDate(d['startDate'], d['initDays'])
+    engine.setEndDate(d['endDate'])
+    engine.setSlippage(d['slippage'])
+    engine.setRate(d['rate'])
+    engine.setSize(d['size'])
+    engine.setDatabase(d['dbName'], d['symbol'])
+    engine.setPrecomputeMode(d['precompute'])
+    engine.setBarEndLabel(d['barEndLabel'])
+    engine.setDailyMode(d['dailyMode'])
+
+    dataClass = d['dataClass']
+    if d['dataFile']:
+        data = ColumnarData(dataClass, openMemmapArray(d['dataFile'], dataClass, d['count']))
+        data.vtSymbol = d['vtSymbol']
+        data.symbol = d['dataSymbol']
+        data.exchange = d['exchange']
+    else:
+        # 主进程已经同步过缓存，这里直接映射缓存文件
+        data = HistoryCache(d['cacheDir']).openData(d['dbName'], d['symbol'], dataClass,
+                                                    engine.dataStartDate, engine.dataEndDate)
+    engine.setHistoryData(data)
+
+    if d['resultStoreDir']:
+        engine.setResultStore(BacktestResultStore(d['resultStoreDir'], d['resultStoreMaxCount']))
+
+    optimizeEngine = engine
+
+
+# ----------------------------------------------------------------------
+def runOptimizeTask(strategyClass, setting, targetName, endDate=None):
+    """
+    在并行优化工作进程中运行一组参数的回测，endDate不为None时修改回测的结束日期，
+    返回(参数, 优化目标值, 进程号, 耗时, 进程内存峰值)
+    """
+    start = time()
+
+    engine = optimizeEngine
+    if endDate is not None:
+        engine.setEndDate(endDate)
+    targetValue = engine.evaluateSetting(strategyClass, setting, targetName)
+
+    return (str(setting), targetValue, os.getpid(), time() - start, getPeakMemory())
 
 
 
@@ -0,0 +1,369 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了按品种交易时段合成多周期K线的工具，CTA引擎、回测引擎和行情记录
+引擎使用同一套代码。
+
+原先K线的切分规则分散在各处：CtaLineBar中写死10:15、11:30、15:00、2:30和各个
+夜盘品种的结束时间，行情记录引擎用minute % 5判断5分钟K线，策略中还有各自的规则。
+现在切分规则全部来自vtTime中按品种预先计算的交易时段表格（SessionTable）：
+1. Tick按表格归入1分钟K线，集合竞价的Tick归入开盘的第一分钟，收盘的Tick归入
+   最后一分钟并立即推送K线，非交易时段的Tick被忽略
+2. N分钟K线在每个连续交易时段内按交易分钟数划分，在时段结束时截断；自定义K线
+   在指定的时间结束；日线在交易日的最后一分钟结束，都只需要按分钟下标查表
+3. 按Tick数量、成交量和价差合成的K线和交易时段无关，实盘和Tick模式回测中由Tick
+   合成，K线模式回测中成交量和价差K线由1分钟K线合成
+4. 合成K线时直接设置字段，不使用deepcopy
+
+合成的分钟K线和日线的时间为K线开始的时间，推入的1分钟K线可以使用结束时间
+（行情记录引擎保存的K线即为结束时间，如9:01表示9:00-9:01），推送前会复制一份并改为
+开始时间，回测和实盘中策略收到的1分钟K线时间一致。
+'''
+
+from datetime import timedelta
+
+from ctaBase import *
+from vtTime import getTradingDay, getSessionTable, TRADING_DAY_START
+
+
+COUNT_BAR_TYPE_LIST = [BAR_TICK, BAR_VOLUME, BAR_RANGE]
+
+
+#----------------------------------------------------------------------
+def copyBar(bar):
+    """以K线为第一根K线生成新的合成K线（直接设置字段，不使用deepcopy）"""
+    newBar = CtaBarData()
+    newBar.vtSymbol = bar.vtSymbol
+    newBar.symbol = bar.symbol
+    newBar.exchange = bar.exchange
+
+    newBar.open = bar.open
+    newBar.high = bar.high
+    newBar.low = bar.low
+    newBar.close = bar.close
+
+    newBar.date = bar.date
+    newBar.time = bar.time
+    newBar.datetime = bar.datetime
+
+    newBar.volume = bar.volume
+    newBar.openInterest = bar.openInterest
+    return newBar
+
+
+#----------------------------------------------------------------------
+def isCountPeriod(period):
+    """是否为按Tick数量、成交量或者价差合成的K线周期"""
+    return isinstance(period, tuple) and period[0] in COUNT_BAR_TYPE_LIST
+
+
+########################################################################
+class TimeBarResampler(object):
+    """按交易时段表格把1分钟K线合成为N分钟K线、自定义K线或者日线"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period, sessionTable, onBar):
+        """Constructor，onBar为K线完成时的回调函数，参数为(周期, K线)"""
+        self.period = period
+        self.onBar = onBar
+        self.idList, self.endList = sessionTable.getWindow(period)
+
+        self.bar = None                 # 正在合成的K线
+        self.key = None                 # 正在合成的K线所属的(交易日, 窗口序号)
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """清空合成状态"""
+        self.bar = None
+        self.key = None
+
+    #----------------------------------------------------------------------
+    def updateBar(self, bar, start, minute, tradingDay):
+        """加入一根1分钟K线，start为K线开始的时间，minute为其在一天中的分钟数"""
+        key = (tradingDay, self.idList[minute])
+
+        # 进入新的窗口时，先推送之前未结束的K线（如数据缺失）
+        if self.bar is not None and key != self.key:
+            self.emit()
+
+        if self.bar is None:
+            b = copyBar(bar)
+            b.datetime = start
+            b.time = start.strftime('%H:%M:%S')
+            if self.period == PERIOD_DAILY:
+                b.date = tradingDay.strftime('%Y%m%d')
+            else:
+                b.date = start.strftime('%Y%m%d')
+            self.bar = b
+            self.key = key
+        else:
+            b = self.bar
+            if bar.high > b.high:
+                b.high = bar.high
+            if bar.low < b.low:
+                b.low = bar.low
+            b.close = bar.close
+            b.volume += bar.volume
+            b.openInterest = bar.openInterest
+
+        if self.endList[minute]:
+            self.emit()
+
+    #----------------------------------------------------------------------
+    def emit(self):
+        """推送正在合成的K线"""
+        bar = self.bar
+        self.bar = None
+        self.key = None
+        self.onBar(self.period, bar)
+
+
+########################################################################
+class CountBarAggregator(object):
+    """按Tick数量、成交量或者价差合成K线，period为(类型, 大小)"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period, onBar):
+        """Constructor，onBar为K线完成时的回调函数，参数为(周期, K线)"""
+        self.period = period
+        self.barType, self.size = period
+        self.onBar = onBar
+
+        self.bar = None                 # 正在合成的K线
+        self.count = 0                  # 正在合成的K线中的Tick数量
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """清空合成状态"""
+        self.bar = None
+        self.count = 0
+
+    #----------------------------------------------------------------------
+    def updateTick(self, tick, volume):
+        """加入一个Tick，volume为该Tick的成交量"""
+        price = tick.lastPrice
+        bar = self.bar
+        if bar is None:
+            bar = CtaBarData()
+            bar.vtSymbol = tick.vtSymbol
+            bar.symbol = tick.symbol
+            bar.exchange = tick.exchange
+
+            bar.open = price
+            bar.high = price
+            bar.low = price
+
+            bar.date = tick.date
+            bar.time = tick.time
+            bar.datetime = tick.datetime
+            self.bar = bar
+            self.count = 0
+        else:
+            if price > bar.high:
+                bar.high = price
+            elif price < bar.low:
+                bar.low = price
+
+        bar.close = price
+        bar.volume += volume
+        bar.openInterest = tick.openInterest
+        self.count += 1
+        self.check()
+
+    #----------------------------------------------------------------------
+    def updateBar(self, bar):
+        """加入一根1分钟K线（K线模式回测中合成成交量和价差K线）"""
+        if self.bar is None:
+            self.bar = copyBar(bar)
+        else:
+            b = self.bar
+            if bar.high > b.high:
+                b.high = bar.high
+            if bar.low < b.low:
+                b.low = bar.low
+            b.close = bar.close
+            b.volume += bar.volume
+            b.openInterest = bar.openInterest
+        self.check()
+
+    #----------------------------------------------------------------------
+    def check(self):
+        """检查K线是否结束，结束则推送"""
+        bar = self.bar
+        if self.barType == BAR_TICK:
+            end = self.count >= self.size
+        elif self.barType == BAR_VOLUME:
+            end = bar.volume >= self.size
+        else:
+            end = bar.high - bar.low >= self.size
+
+        if end:
+            self.bar = None
+            self.onBar(self.period, bar)
+
+
+########################################################################
+class BarGenerator(object):
+    """单个合约的K线合成：Tick合成1分钟K线，1分钟K线再按交易时段合成其他周期的K线"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol, onBar, sessionTable=None, endLabel=False):
+        """
+        Constructor，onBar为K线完成时的回调函数，参数为(周期, K线)，
+        sessionTable为None时使用品种默认的交易时段，endLabel表示推入的1分钟K线的时间为结束时间
+        """
+        self.vtSymbol = vtSymbol
+        self.onBar = onBar
+        self.sessionTable = sessionTable or getSessionTable(vtSymbol)
+        self.tickOffsetList = self.sessionTable.tickOffsetList
+        self.endLabel = endLabel
+
+        self.periodList = []                # 已添加的周期
+        self.resamplerList = []             # 由1分钟K线合成的分钟K线和日线
+        self.tickAggregatorList = []        # 由Tick合成的K线
+        self.barAggregatorList = []         # 推入1分钟K线时合成的成交量和价差K线
+
+        self.bar = None                     # 正在合成的1分钟K线
+        self.lastVolume = None              # 上一个Tick的累计成交量
+        self.lastTickDatetime = None        # 上一个Tick的时间
+        self.lastDatetime = None            # 最近一根完成的1分钟K线的开始时间
+        self.dayKey = None                  # 交易日缓存的(日期, 是否夜盘)
+        self.tradingDay = None
+
+    #----------------------------------------------------------------------
+    def addPeriod(self, period):
+        """添加需要合成的周期"""
+        if period == 1 or period in self.periodList:
+            return
+        self.periodList.append(period)
+
+        if isCountPeriod(period):
+            aggregator = CountBarAggregator(period, self.onBar)
+            self.tickAggregatorList.append(aggregator)
+            if period[0] != BAR_TICK:
+                self.barAggregatorList.append(aggregator)
+        else:
+            self.resamplerList.append(TimeBarResampler(period, self.sessionTable, self.onBar))
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """清空合成状态"""
+        self.bar = None
+        self.lastVolume = None
+        self.lastTickDatetime = None
+        self.lastDatetime = None
+        for resampler in self.resamplerList:
+            resampler.reset()
+        for aggregator in self.tickAggregatorList:
+            aggregator.reset()
+
+    #----------------------------------------------------------------------
+    def isEmpty(self):
+        """是否还没有推入任何数据"""
+        return self.lastTickDatetime is None and self.lastDatetime is None
+
+    #----------------------------------------------------------------------
+    def updateTick(self, tick):
+        """加入一个Tick，早于之前Tick的Tick（如重复载入的历史数据）会被忽略"""
+        dt = tick.datetime
+        if self.lastTickDatetime is not None and dt < self.lastTickDatetime:
+            return
+        self.lastTickDatetime = dt
+
+        # 成交量为累计值，取和上一个Tick的差，累计值变小时（如换日）为新的累计值
+        volume = 0
+        if self.lastVolume is not None:
+            volume = tick.volume - self.lastVolume
+            if volume < 0:
+                volume = tick.volume
+        self.lastVolume = tick.volume
+
+        # 按交易时段表格确定Tick所属的分钟，非交易时段的Tick直接忽略
+        offset = self.tickOffsetList[dt.hour * 60 + dt.minute]
+        if offset is None:
+            return
+        start = dt.replace(second=0, microsecond=0)
+        if offset:
+            start += timedelta(minutes=offset)
+
+        # 进入新的分钟时推送之前的1分钟K线
+        bar = self.bar
+        if bar is not None and bar.datetime != start:
+            self.bar = None
+            self.pushBar(bar, bar.datetime)
+            bar = None
+
+        for aggregator in self.tickAggregatorList:
+            aggregator.updateTick(tick, volume)
+
+        # 该分钟的K线已经推送（如收盘之后重复的收盘Tick）
+        if self.lastDatetime is not None and start <= self.lastDatetime:
+            return
+
+        price = tick.lastPrice
+        if bar is None:
+            bar = CtaBarData()
+            bar.vtSymbol = tick.vtSymbol
+            bar.symbol = tick.symbol
+            bar.exchange = tick.exchange
+
+            bar.open = price
+            bar.high = price
+            bar.low = price
+
+            bar.date = start.strftime('%Y%m%d')
+            bar.time = start.strftime('%H:%M:%S')
+            bar.datetime = start
+            self.bar = bar
+        else:
+            if price > bar.high:
+                bar.high = price
+            elif price < bar.low:
+                bar.low = price
+
+        bar.close = price
+        bar.volume += volume
+        bar.openInterest = tick.openInterest
+
+        # 收盘的Tick之后该时段不会再有数据，立即推送K线
+        if offset < 0:
+            self.bar = None
+            self.pushBar(bar, start)
+
+    #----------------------------------------------------------------------
+    def updateBar(self, bar):
+        """加入一根完成的1分钟K线，不晚于之前K线的K线（如重复载入的历史数据）会被忽略"""
+        start = bar.datetime.replace(second=0, microsecond=0)
+        if self.endLabel:
+            start -= timedelta(minutes=1)
+        if self.lastDatetime is not None and start <= self.lastDatetime:
+            return
+
+        # 推送的K线时间统一为开始时间，和Tick合成的K线一致
+        if bar.datetime != start:
+            bar = copyBar(bar)
+            bar.datetime = start
+            bar.date = start.strftime('%Y%m%d')
+            bar.time = start.strftime('%H:%M:%S')
+
+        self.pushBar(bar, start)
+        for aggregator in self.barAggregatorList:
+            aggregator.updateBar(bar)
+
+    #----------------------------------------------------------------------
+    def pushBar(self, bar, start):
+        """推送完成的1分钟K线，并合成其他周期的K线，start为K线开始的时间"""
+        self.lastDatetime = start
+        self.onBar(1, bar)
+
+        if self.resamplerList:
+            minute = start.hour * 60 + start.minute
+
+            # 同一个自然日的日盘或者夜盘属于同一个交易日，只需要计算一次
+            dayKey = (start.date(), minute >= TRADING_DAY_START)
+            if dayKey != self.dayKey:
+                self.dayKey = dayKey
+                self.tradingDay = getTradingDay(start)
+
+            for resampler in self.resamplerList:
+                resampler.updateBar(bar, start, minute, self.tradingDay)
@@ -0,0 +1,104 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了策略缓存K线数据使用的固定容量序列。
+
+原先策略在每根K线到来时都用self.closeArray[0:n-1] = self.closeArray[1:n]
+把整个数组向前平移一位，每个字段每根K线都要复制n个数据。序列使用环形缓冲区：
+1. 缓冲区长度为容量的两倍，每个数据同时写入位置i和i+容量，加入数据为O(1)
+2. 缓冲区[i+1:i+1+容量]总是按时间顺序排列的连续数据，获取数组时直接返回
+   NumPy视图，不复制数据，可以直接传入talib
+3. 数据不足容量时，较早的部分为0，和原先的np.zeros数组一致
+
+注意返回的数组是缓冲区的视图，加入下一个数据后内容会改变，需要保存时请复制。
+'''
+
+import numpy as np
+
+
+########################################################################
+class ArraySeries(object):
+    """固定容量的数值序列（如某个指标的历史数值）"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, size, dtype=float):
+        """Constructor"""
+        self.size = size                # 容量
+        self.count = 0                  # 已经加入的数据数量
+        self.index = 0                  # 下一个数据的写入位置
+        self.buffer = np.zeros(size * 2, dtype)
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据"""
+        i = self.index
+        self.buffer[i] = value
+        self.buffer[i + self.size] = value
+
+        i += 1
+        self.index = i if i < self.size else 0
+        self.count += 1
+
+    #----------------------------------------------------------------------
+    def isFull(self):
+        """数据数量是否已经达到容量"""
+        return self.count >= self.size
+
+    #----------------------------------------------------------------------
+    def getArray(self):
+        """获取按时间顺序排列的数组（最新的数据在最后）"""
+        i = self.index
+        return self.buffer[i:i + self.size]
+
+    #----------------------------------------------------------------------
+    def getLast(self, n=1):
+        """获取倒数第n个数据"""
+        return self.buffer[self.index + self.size - n]
+
+
+########################################################################
+class BarSeries(object):
+    """固定容量的K线序列，用于替代策略中的highArray、lowArray、closeArray和bufferCount"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, size, fieldList=None):
+        """Constructor，fieldList为需要缓存的K线字段，默认为开高低收和成交量"""
+        if fieldList is None:
+            fieldList = ['open', 'high', 'low', 'close', 'volume']
+
+        self.size = size                # 容量
+        self.count = 0                  # 已经加入的K线数量
+        self.index = 0                  # 下一根K线的写入位置
+        self.fieldList = list(fieldList)
+        self.bufferList = [(name, np.zeros(size * 2)) for name in self.fieldList]
+        self.bufferDict = dict(self.bufferList)
+
+    #----------------------------------------------------------------------
+    def update(self, bar):
+        """加入一根K线"""
+        i = self.index
+        j = i + self.size
+        for name, buf in self.bufferList:
+            value = getattr(bar, name)
+            buf[i] = value
+            buf[j] = value
+
+        i += 1
+        self.index = i if i < self.size else 0
+        self.count += 1
+
+    #----------------------------------------------------------------------
+    def isFull(self):
+        """K线数量是否已经达到容量"""
+        return self.count >= self.size
+
+    #----------------------------------------------------------------------
+    def getArray(self, name):
+        """获取某个字段按时间顺序排列的数组（最新的K线在最后）"""
+        i = self.index
+        return self.bufferDict[name][i:i + self.size]
+
+    #----------------------------------------------------------------------
+    def getLast(self, name, n=1):
+        """获取某个字段倒数第n根K线的数值"""
+        return self.bufferDict[name][self.index + self.size - n]
@@ -0,0 +1,344 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了CTA引擎按合约共享的K线合成和指标计算。
+
+原先每个策略实例都在onTick中自己合成1分钟K线，再合成5分钟等周期的K线，并各自
+用talib计算指标。同一个合约上运行多个策略实例时，相同的K线和相同参数的指标会被
+重复计算多次。K线服务由引擎持有：
+1. 每个合约一个K线合成对象，Tick合成1分钟K线，1分钟K线再合成N分钟K线和日线，
+   也可以按Tick数量、成交量和价差合成K线
+2. 每个（合约、周期）一个K线推送对象，保存该周期上订阅的指标，相同名称和参数的
+   指标只创建一次，每根K线完成时先更新指标，再按订阅顺序推送给各个策略
+3. 回测中K线模式的1分钟K线直接推入K线合成，和实盘使用相同的代码
+4. 策略初始化之前不推送K线。策略初始化时载入的历史数据通过独立的K线合成对象重放，
+   只推送给该策略，尚未预热的指标用重放的K线重新计算，已经预热的共享指标重放后恢复
+   原来的状态，不影响实盘中正在合成的K线和其他策略。有尚未预热的策略或者指标时，
+   推送对象缓存收到的K线，重放时接在历史数据之后
+
+K线的合成规则见ctaBarAggregator（按品种的交易时段切分K线）。
+'''
+
+import copy
+from collections import OrderedDict, deque
+
+from ctaBase import *
+from ctaBarAggregator import BarGenerator
+from ctaIndicator import SmaIndicator, EmaIndicator, BollIndicator, RsiIndicator, \
+    AtrIndicator, DmiIndicator, HighestIndicator, LowestIndicator
+
+
+# 指标名称对应的指标类和输入字段，hlc表示依次输入最高价、最低价和收盘价
+INDICATOR_DICT = {
+    'sma': (SmaIndicator, 'close'),
+    'ema': (EmaIndicator, 'close'),
+    'boll': (BollIndicator, 'close'),
+    'rsi': (RsiIndicator, 'close'),
+    'atr': (AtrIndicator, 'hlc'),
+    'dmi': (DmiIndicator, 'hlc'),
+    'highest': (HighestIndicator, 'high'),
+    'lowest': (LowestIndicator, 'low')
+}
+
+FEED_BUFFER_SIZE = 10000        # 预热之前每个推送对象最多缓存的K线数量
+
+
+#----------------------------------------------------------------------
+def updateIndicator(indicator, field, bar):
+    """用K线的输入字段更新指标"""
+    if field == 'hlc':
+        indicator.update(bar.high, bar.low, bar.close)
+    else:
+        indicator.update(getattr(bar, field))
+
+
+#----------------------------------------------------------------------
+def callStrategy(strategy, func, bar, callFunc=None):
+    """推送K线给策略，callFunc为调用策略函数的方法（如捕捉异常），为None时直接调用"""
+    if callFunc:
+        callFunc(strategy, func, bar)
+    else:
+        func(bar)
+
+
+########################################################################
+class BarFeed(object):
+    """单个合约单个周期的K线推送，保存该周期上共享的指标和订阅的策略"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol, period):
+        """Constructor"""
+        self.vtSymbol = vtSymbol
+        self.period = period
+        self.bar = None                 # 最近一根完成的K线
+        self.count = 0                  # 已经完成的K线数量
+
+        self.indicatorDict = OrderedDict()  # key为(名称, 参数...)，value为指标对象
+        self.inputList = []                 # (key, 指标对象, 输入字段)
+        self.subscriberList = []            # (策略对象, 回调函数)
+
+        self.coldSet = set()                # 尚未用历史数据预热的指标key
+        self.warmedSet = set()              # 已经预热的策略对象
+        self.pending = False                # 是否有尚未预热的策略或者指标
+        self.bufferList = deque(maxlen=FEED_BUFFER_SIZE)   # 有尚未预热的策略或者指标时缓存的K线
+
+    #----------------------------------------------------------------------
+    def addIndicator(self, name, *params):
+        """添加指标（名称和参数相同的指标只创建一次），返回指标对象"""
+        key = (name,) + params
+        if key in self.indicatorDict:
+            return self.indicatorDict[key]
+
+        indicatorClass, field = INDICATOR_DICT[name]
+        indicator = indicatorClass(*params)
+        self.indicatorDict[key] = indicator
+        self.inputList.append((key, indicator, field))
+        self.coldSet.add(key)
+        self.updatePending()
+        return indicator
+
+    #----------------------------------------------------------------------
+    def getIndicator(self, name, *params):
+        """获取已添加的指标对象，不存在则返回None"""
+        return self.indicatorDict.get((name,) + params)
+
+    #----------------------------------------------------------------------
+    def subscribe(self, strategy, func):
+        """添加订阅，同一个回调函数只订阅一次"""
+        if (strategy, func) not in self.subscriberList:
+            self.subscriberList.append((strategy, func))
+            self.updatePending()
+
+    #----------------------------------------------------------------------
+    def isSubscribed(self, strategy):
+        """策略是否订阅了该推送对象"""
+        for s, func in self.subscriberList:
+            if s is strategy:
+                return True
+        return False
+
+    #----------------------------------------------------------------------
+    def updatePending(self):
+        """更新是否有尚未预热的策略或者指标，没有时清空缓存的K线"""
+        self.pending = bool(self.coldSet)
+        for strategy, func in self.subscriberList:
+            if strategy not in self.warmedSet:
+                self.pending = True
+
+        if not self.pending:
+            self.bufferList.clear()
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """清空K线和指标的状态，保留指标和订阅"""
+        self.bar = None
+        self.count = 0
+
+        # 重新初始化指标对象本身，策略保存的指标对象引用仍然有效
+        for key, indicator in self.indicatorDict.items():
+            indicator.__init__(*key[1:])
+
+        self.coldSet = set(self.indicatorDict.keys())
+        self.warmedSet.clear()
+        self.bufferList.clear()
+        self.updatePending()
+
+    #----------------------------------------------------------------------
+    def updateBar(self, bar, callFunc=None):
+        """
+        K线完成，先更新指标再推送给订阅的策略，callFunc为调用策略函数的方法，
+        尚未初始化的策略不推送
+        """
+        self.bar = bar
+        self.count += 1
+
+        for key, indicator, field in self.inputList:
+            updateIndicator(indicator, field, bar)
+
+        if self.pending:
+            self.bufferList.append(bar)
+
+        for strategy, func in self.subscriberList:
+            if strategy.inited:
+                callStrategy(strategy, func, bar, callFunc)
+
+    #----------------------------------------------------------------------
+    def finishWarmUp(self):
+        """历史数据已经通过共享的K线合成推送（之前没有任何数据），全部指标都已预热"""
+        self.coldSet.clear()
+        self.updatePending()
+
+    #----------------------------------------------------------------------
+    def warmUp(self, strategy, barList, callFunc=None):
+        """
+        用独立合成的历史K线预热：历史K线（早于缓存的第一根K线）和缓存的K线依次重新计算
+        全部指标并只推送给该策略，重放期间策略读到的是历史K线对应的指标数值，重放结束后
+        已经预热的共享指标恢复为重放之前的状态，尚未预热的指标保留重新计算的结果
+        """
+        if self.bufferList:
+            first = self.bufferList[0].datetime
+            barList = [bar for bar in barList if bar.datetime < first]
+        barList = list(barList) + list(self.bufferList)
+
+        savedList = []
+        for key, indicator, field in self.inputList:
+            if key not in self.coldSet:
+                savedList.append((indicator, copy.deepcopy(indicator.__dict__)))
+            indicator.__init__(*key[1:])
+
+        funcList = [func for s, func in self.subscriberList if s is strategy]
+
+        for bar in barList:
+            for key, indicator, field in self.inputList:
+                updateIndicator(indicator, field, bar)
+            for func in funcList:
+                callStrategy(strategy, func, bar, callFunc)
+
+        for indicator, d in savedList:
+            indicator.__dict__ = d
+
+        self.coldSet.clear()
+        self.warmedSet.add(strategy)
+        self.updatePending()
+
+
+########################################################################
+class BarService(object):
+    """按合约共享的K线合成和指标计算服务"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, callFunc=None, endLabel=True):
+        """
+        Constructor，callFunc(strategy, func, bar)用于调用策略函数（如捕捉异常），为None时直接调用，
+        endLabel表示推入的1分钟K线的时间为结束时间（和行情记录引擎保存的K线一致）
+        """
+        self.callFunc = callFunc
+        self.endLabel = endLabel
+        self.generatorDict = {}         # key为vtSymbol，value为BarGenerator
+        self.feedDict = {}              # key为(vtSymbol, 周期)，value为BarFeed
+        self.strategySet = set()        # 订阅了K线的策略对象
+
+    #----------------------------------------------------------------------
+    def subscribe(self, strategy, vtSymbol, period=1, func=None, indicatorList=None):
+        """
+        订阅合约某个周期的K线（周期的格式见ctaBase），func为K线回调函数（默认为策略的onBar），
+        indicatorList为指标列表，每项为(名称, 参数...)，如[('ema', 20), ('boll', 20, 2)]，
+        返回BarFeed对象，可以通过getIndicator获取指标对象
+        """
+        key = (vtSymbol, period)
+        if key in self.feedDict:
+            feed = self.feedDict[key]
+        else:
+            feed = BarFeed(vtSymbol, period)
+            self.feedDict[key] = feed
+
+        if vtSymbol not in self.generatorDict:
+            self.generatorDict[vtSymbol] = BarGenerator(vtSymbol, self.getBarCallback(vtSymbol),
+                                                        endLabel=self.endLabel)
+        self.generatorDict[vtSymbol].addPeriod(period)
+
+        for params in indicatorList or []:
+            feed.addIndicator(*params)
+
+        feed.subscribe(strategy, func or strategy.onBar)
+        self.strategySet.add(strategy)
+        return feed
+
+    #----------------------------------------------------------------------
+    def setEndLabel(self, endLabel):
+        """设置推入的1分钟K线的时间是否为结束时间"""
+        self.endLabel = endLabel
+        for generator in self.generatorDict.values():
+            generator.endLabel = endLabel
+
+    #----------------------------------------------------------------------
+    def getBarCallback(self, vtSymbol):
+        """生成合约K线合成的回调函数"""
+        feedDict = self.feedDict
+        callFunc = self.callFunc
+
+        def onBar(period, bar):
+            feed = feedDict.get((vtSymbol, period))
+            if feed:
+                feed.updateBar(bar, callFunc)
+
+        return onBar
+
+    #----------------------------------------------------------------------
+    def isSubscribed(self, strategy):
+        """策略是否订阅了K线"""
+        return strategy in self.strategySet
+
+    #----------------------------------------------------------------------
+    def getFeed(self, vtSymbol, period=1):
+        """获取K线推送对象，不存在则返回None"""
+        return self.feedDict.get((vtSymbol, period))
+
+    #----------------------------------------------------------------------
+    def updateTick(self, vtSymbol, tick):
+        """推入Tick"""
+        generator = self.generatorDict.get(vtSymbol)
+        if generator:
+            generator.updateTick(tick)
+
+    #----------------------------------------------------------------------
+    def updateBar(self, vtSymbol, bar):
+        """推入完成的1分钟K线（如回测数据或者初始化用的历史数据）"""
+        generator = self.generatorDict.get(vtSymbol)
+        if generator:
+            generator.updateBar(bar)
+
+    #----------------------------------------------------------------------
+    def warmUp(self, strategy, vtSymbol, dataList, isTick=False):
+        """
+        用历史数据预热策略订阅的K线和指标，dataList为1分钟K线或者Tick（isTick为True）：
+        1. 合约还没有收到任何数据时，历史数据直接推入共享的K线合成（和之后的数据连续）
+        2. 否则用独立的K线合成对象合成历史K线，只重放给该策略和尚未预热的指标，
+           实盘中已经在合成的K线不受影响
+        """
+        generator = self.generatorDict.get(vtSymbol)
+        if not generator:
+            return
+        feedList = [feed for feed in self.feedDict.values()
+                    if feed.vtSymbol == vtSymbol and feed.isSubscribed(strategy)]
+
+        if generator.isEmpty():
+            for feed in feedList:
+                feed.warmedSet.add(strategy)
+            for data in dataList:
+                if isTick:
+                    generator.updateTick(data)
+                else:
+                    generator.updateBar(data)
+
+            # 同一合约的全部推送对象都收到了完整的历史K线，指标都已预热
+            for feed in self.feedDict.values():
+                if feed.vtSymbol == vtSymbol:
+                    feed.finishWarmUp()
+            return
+
+        barDict = dict([(feed.period, []) for feed in feedList])
+
+        def onBar(period, bar):
+            if period in barDict:
+                barDict[period].append(bar)
+
+        history = BarGenerator(vtSymbol, onBar, generator.sessionTable, generator.endLabel)
+        for period in barDict.keys():
+            history.addPeriod(period)
+        for data in dataList:
+            if isTick:
+                history.updateTick(data)
+            else:
+                history.updateBar(data)
+
+        for feed in feedList:
+            feed.warmUp(strategy, barDict[feed.period], self.callFunc)
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """清空所有K线合成和指标的状态，保留订阅关系（如重新运行回测）"""
+        for generator in self.generatorDict.values():
+            generator.reset()
+        for feed in self.feedDict.values():
+            feed.reset()
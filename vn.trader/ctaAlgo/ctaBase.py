@@ -44,8 +44,17 @@ MINUTE5_DB_NAME = 'VnTrader_5Min_Db'
 ENGINETYPE_BACKTESTING = 'backtesting'  # 回测
 ENGINETYPE_TRADING = 'trading'          # 实盘
 
+# 引擎合成K线的周期：分钟周期直接使用整数（如1、5、15、30），K线结束时间的元组
+# （如('10:45', '15:00')）表示自定义的分钟K线，按Tick、成交量和价差合成的K线
+# 使用(类型, 大小)的元组（如(BAR_TICK, 100)）
+PERIOD_DAILY = 'daily'
+BAR_TICK = 'tick'               # 每N个Tick一根K线
+BAR_VOLUME = 'volume'           # 成交量达到N时结束K线
+BAR_RANGE = 'range'             # 最高价和最低价的价差达到N时结束K线
+
 # CTA引擎中涉及的数据类定义
 from vtConstant import EMPTY_UNICODE, EMPTY_STRING, EMPTY_FLOAT, EMPTY_INT
+from vtGateway import VtSlotsData
 
 ########################################################################
 class StopOrder(object):
@@ -67,8 +76,12 @@ class StopOrder(object):
 
 
 ########################################################################
-class CtaBarData(object):
+class CtaBarData(VtSlotsData):
     """K线数据"""
+    __slots__ = ('vtSymbol', 'symbol', 'exchange',
+                 'open', 'high', 'low', 'close',
+                 'date', 'time', 'datetime',
+                 'volume', 'openInterest')
 
     #----------------------------------------------------------------------
     def __init__(self):
@@ -91,8 +104,16 @@ class CtaBarData(object):
 
 
 ########################################################################
-class CtaTickData(object):
+class CtaTickData(VtSlotsData):
     """Tick数据"""
+    __slots__ = ('vtSymbol', 'symbol', 'exchange',
+                 'lastPrice', 'openPrice', 'highPrice', 'lowPrice', 'volume', 'openInterest',
+                 'upperLimit', 'lowerLimit',
+                 'date', 'time', 'datetime',
+                 'bidPrice1', 'bidPrice2', 'bidPrice3', 'bidPrice4', 'bidPrice5',
+                 'askPrice1', 'askPrice2', 'askPrice3', 'askPrice4', 'askPrice5',
+                 'bidVolume1', 'bidVolume2', 'bidVolume3', 'bidVolume4', 'bidVolume5',
+                 'askVolume1', 'askVolume2', 'askVolume3', 'askVolume4', 'askVolume5')
 
     #----------------------------------------------------------------------
     def __init__(self):
@@ -0,0 +1,203 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了回测使用的逐日盯市结算。
+
+原先的回测结果只基于开平仓配对后的每笔交易，跨日持仓的策略无法得到每日的
+资金曲线。逐日结算在回放数据的过程中增量计算：
+1. 每个交易日结束时，把开盘前的持仓按当日收盘价和前一日收盘价之差计算持仓盈亏
+2. 当日成交按成交价和当日收盘价之差计算交易盈亏
+3. 成交金额、手续费和滑点按日累计
+结果保存在预先分配的NumPy数组中，统计指标的计算量只和交易日数量有关。
+
+交易日按vtTime.getTradingDay划分，夜盘（包括凌晨）属于下一个交易日，
+日线数据每根K线为一天。
+'''
+
+from __future__ import division
+
+import numpy as np
+
+from ctaBase import *
+from vtTime import getTradingDay
+
+
+DAILY_FIELD_LIST = ['holdingPnl', 'tradingPnl', 'turnover', 'commission',
+                    'slippage', 'netPnl', 'tradeCount', 'position', 'closePrice']
+DAILY_SUM_FIELD_LIST = DAILY_FIELD_LIST[:-2]    # 多个结果按日期汇总时相加的字段
+TRADING_DAYS_PER_YEAR = 240     # 每年的交易日数量，用于计算年化指标
+
+
+########################################################################
+class DailySettlement(object):
+    """逐日盯市结算"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, size=1, rate=0, slippage=0, capacity=256):
+        """Constructor，capacity为预先分配的交易日数量，不足时自动扩容"""
+        self.size = size                # 合约大小
+        self.rate = rate                # 手续费比例
+        self.slippage = slippage        # 滑点
+
+        self.count = 0                  # 已经结算的交易日数量
+        self.dateArray = np.zeros(capacity, dtype='M8[D]')
+        self.arrayDict = dict([(name, np.zeros(capacity)) for name in DAILY_FIELD_LIST])
+
+        # 当前交易日的数据
+        self.date = None
+        self.startPos = 0               # 开盘前的持仓
+        self.pos = 0                    # 当前持仓
+        self.preClose = None            # 前一交易日收盘价
+        self.close = None               # 最新价格
+        self.tradeVolume = 0            # 成交数量（买入为正）
+        self.tradeValue = 0             # 成交数量乘以成交价（买入为正）
+        self.turnover = 0               # 成交金额
+        self.slippageCost = 0           # 滑点成本
+        self.tradeCount = 0             # 成交笔数
+
+    #----------------------------------------------------------------------
+    def updatePrice(self, dt, price):
+        """更新最新价格，交易日变化时先结算前一个交易日"""
+        date = getTradingDay(dt)
+        if date != self.date:
+            if self.date is not None:
+                self.settle()
+            self.date = date
+        self.close = price
+
+    #----------------------------------------------------------------------
+    def addTrade(self, direction, price, volume):
+        """记录当前交易日的成交"""
+        if direction == DIRECTION_LONG:
+            signedVolume = volume
+        else:
+            signedVolume = -volume
+
+        self.pos += signedVolume
+        self.tradeVolume += signedVolume
+        self.tradeValue += signedVolume * price
+        self.turnover += price * volume * self.size
+        self.slippageCost += self.slippage * volume * self.size
+        self.tradeCount += 1
+
+    #----------------------------------------------------------------------
+    def settle(self):
+        """按最新价格结算当前交易日"""
+        if self.count >= len(self.dateArray):
+            self.reserve(len(self.dateArray) * 2)
+
+        close = self.close
+        size = self.size
+
+        if self.preClose is None:
+            holdingPnl = 0
+        else:
+            holdingPnl = self.startPos * (close - self.preClose) * size
+        tradingPnl = (self.tradeVolume * close - self.tradeValue) * size
+        commission = self.turnover * self.rate
+
+        i = self.count
+        d = self.arrayDict
+        self.dateArray[i] = self.date
+        d['holdingPnl'][i] = holdingPnl
+        d['tradingPnl'][i] = tradingPnl
+        d['turnover'][i] = self.turnover
+        d['commission'][i] = commission
+        d['slippage'][i] = self.slippageCost
+        d['netPnl'][i] = holdingPnl + tradingPnl - commission - self.slippageCost
+        d['tradeCount'][i] = self.tradeCount
+        d['position'][i] = self.pos
+        d['closePrice'][i] = close
+        self.count += 1
+
+        # 开始新的交易日
+        self.startPos = self.pos
+        self.preClose = close
+        self.tradeVolume = 0
+        self.tradeValue = 0
+        self.turnover = 0
+        self.slippageCost = 0
+        self.tradeCount = 0
+
+    #----------------------------------------------------------------------
+    def finish(self):
+        """回放结束时结算最后一个交易日"""
+        if self.date is not None:
+            self.settle()
+            self.date = None
+
+    #----------------------------------------------------------------------
+    def reserve(self, capacity):
+        """扩大预先分配的数组"""
+        self.dateArray = np.resize(self.dateArray, capacity)
+        for name, array in self.arrayDict.items():
+            self.arrayDict[name] = np.resize(array, capacity)
+
+    #----------------------------------------------------------------------
+    def getResult(self):
+        """获取逐日结算结果和统计指标，无数据时返回空字典"""
+        n = self.count
+        if not n:
+            return {}
+
+        d = {}
+        d['dateList'] = self.dateArray[:n].astype('M8[us]').tolist()
+        for name in DAILY_FIELD_LIST:
+            d[name + 'Array'] = self.arrayDict[name][:n].copy()
+
+        calculateDailyStatistics(d)
+        return d
+
+
+#----------------------------------------------------------------------
+def calculateDailyStatistics(d):
+    """根据逐日结算结果字典中的每日数组计算资金、回撤数组和统计指标，结果写入字典"""
+    netPnl = d['netPnlArray']
+    n = len(netPnl)
+    capital = netPnl.cumsum()
+    maxCapital = np.maximum.accumulate(np.maximum(capital, 0))
+    drawdown = capital - maxCapital
+
+    d['capitalArray'] = capital
+    d['drawdownArray'] = drawdown
+
+    d['totalDays'] = n
+    d['profitDays'] = int((netPnl > 0).sum())
+    d['lossDays'] = int((netPnl < 0).sum())
+    d['totalNetPnl'] = float(capital[-1])
+    d['maxDrawdown'] = float(drawdown.min())
+    d['totalTurnover'] = float(d['turnoverArray'].sum())
+    d['totalCommission'] = float(d['commissionArray'].sum())
+    d['totalSlippage'] = float(d['slippageArray'].sum())
+    d['totalTradeCount'] = int(d['tradeCountArray'].sum())
+    d['dailyNetPnl'] = float(netPnl.mean())
+
+    d['sharpeRatio'] = 0
+    if n > 1:
+        std = netPnl.std(ddof=1)
+        if std:
+            d['sharpeRatio'] = float(netPnl.mean() / std * np.sqrt(TRADING_DAYS_PER_YEAR))
+
+
+#----------------------------------------------------------------------
+def combineDailyResult(resultList):
+    """
+    按日期汇总多个逐日结算结果（如组合中的各个策略），日期取各结果的并集，
+    持仓和收盘价没有汇总意义不包括在内，无数据时返回空字典
+    """
+    resultList = [result for result in resultList if result]
+    if not resultList:
+        return {}
+
+    dateArray = np.concatenate([np.array(result['dateList'], dtype='M8[D]') for result in resultList])
+    dailyDateArray, indexArray = np.unique(dateArray, return_inverse=True)
+
+    d = {}
+    d['dateList'] = dailyDateArray.astype('M8[us]').tolist()
+    for name in DAILY_SUM_FIELD_LIST:
+        array = np.zeros(len(dailyDateArray))
+        np.add.at(array, indexArray, np.concatenate([result[name + 'Array'] for result in resultList]))
+        d[name + 'Array'] = array
+
+    calculateDailyStatistics(d)
+    return d
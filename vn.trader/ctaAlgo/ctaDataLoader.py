@@ -0,0 +1,347 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了回测引擎使用的列式历史数据载入工具。
+
+原先回测时逐条遍历MongoDB查询指针，每条记录先解码为字典再通过
+data.__dict__ = d赋值给CtaBarData，多年的分钟线仅反序列化就需要数分钟。
+列式载入的流程：
+1. 从MongoDB批量读取（只读取数据类需要的字段），每批转换为NumPy结构化数组
+2. 可以把数组保存为本地文件，之后直接从文件载入，不再访问数据库
+3. 回放时按块把各列一次性转换为python列表，再逐条生成CtaBarData/CtaTickData，
+   不再为每条数据生成中间字典
+
+直接运行本文件可以对比两种方式的载入耗时和内存峰值：
+python ctaDataLoader.py 数据库名 合约代码 开始日期 [结束日期] [bar/tick]
+'''
+
+import sys
+from datetime import datetime
+from time import time
+import multiprocessing
+
+import numpy as np
+
+try:
+    import resource     # Windows下没有resource模块
+except ImportError:
+    resource = None
+
+from ctaBase import *
+from vtFunction import loadMongoSetting
+
+
+# 每条数据都相同的代码字段，不保存在数组中
+CONST_FIELD_LIST = ['vtSymbol', 'symbol', 'exchange']
+
+# 特殊字段在数组中的类型，其余字段均为float64
+FIELD_DTYPE_DICT = {'datetime': 'M8[us]',
+                    'date': 'S8',
+                    'time': 'S16'}
+
+LOAD_BATCH_SIZE = 50000         # 从数据库载入时每批转换的数据条数
+ITER_CHUNK_SIZE = 100000        # 回放时每块转换为python列表的数据条数
+
+
+#----------------------------------------------------------------------
+def getDtype(dataClass):
+    """获取数据类对应的NumPy结构化数组类型"""
+    l = []
+    for name in dataClass.getFieldList():
+        if name not in CONST_FIELD_LIST:
+            l.append((name, FIELD_DTYPE_DICT.get(name, 'f8')))
+    return np.dtype(l)
+
+
+#----------------------------------------------------------------------
+def makeRowSetter(nameList):
+    """
+    生成把一行数据按顺序赋值给对象各字段的函数，即data.a, data.b, ... = row，
+    比逐个字段调用setattr快数倍
+    """
+    code = 'def setRow(data, row):\n    %s, = row\n' % ', '.join(['data.%s' % name for name in nameList])
+    namespace = {}
+    exec code in namespace
+    return namespace['setRow']
+
+
+########################################################################
+class ColumnarData(object):
+    """列式保存的历史数据，array为NumPy结构化数组"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, dataClass, array=None):
+        """Constructor"""
+        self.dataClass = dataClass          # CtaBarData或者CtaTickData
+        if array is None:
+            array = np.zeros(0, dtype=getDtype(dataClass))
+        self.array = array
+
+        self.vtSymbol = EMPTY_STRING
+        self.symbol = EMPTY_STRING
+        self.exchange = EMPTY_STRING
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """数据条数"""
+        return len(self.array)
+
+    #----------------------------------------------------------------------
+    def isSorted(self):
+        """检查数据是否按时间升序排列"""
+        dt = self.array['datetime']
+        return bool(np.all(dt[1:] >= dt[:-1]))
+
+    #----------------------------------------------------------------------
+    def sort(self):
+        """按时间升序排列（时间相同的数据保持原有顺序）"""
+        if not self.isSorted():
+            self.array = self.array[np.argsort(self.array['datetime'], kind='mergesort')]
+
+    #----------------------------------------------------------------------
+    def split(self, dt):
+        """
+        按时间拆分为早于dt和不早于dt的两部分
+        数据已按时间排列时两部分都是原数组的视图（不复制数据，适用于内存映射的数组）
+        """
+        if self.isSorted():
+            i = np.searchsorted(self.array['datetime'], np.datetime64(dt, 'us'))
+            beforeArray = self.array[:i]
+            afterArray = self.array[i:]
+        else:
+            mask = self.array['datetime'] < np.datetime64(dt, 'us')
+            beforeArray = self.array[mask]
+            afterArray = self.array[~mask]
+
+        before = self.copyInfo(ColumnarData(self.dataClass, beforeArray))
+        after = self.copyInfo(ColumnarData(self.dataClass, afterArray))
+        return before, after
+
+    #----------------------------------------------------------------------
+    def slice(self, startDate=None, endDate=None):
+        """
+        截取时间在[startDate, endDate]之间的数据，None表示不限，
+        数据已按时间排列时返回原数组的视图
+        """
+        dt = self.array['datetime']
+        if self.isSorted():
+            i = 0
+            j = len(dt)
+            if startDate:
+                i = np.searchsorted(dt, np.datetime64(startDate, 'us'))
+            if endDate:
+                j = np.searchsorted(dt, np.datetime64(endDate, 'us'), side='right')
+            array = self.array[i:j]
+        else:
+            mask = np.ones(len(dt), dtype=bool)
+            if startDate:
+                mask &= dt >= np.datetime64(startDate, 'us')
+            if endDate:
+                mask &= dt <= np.datetime64(endDate, 'us')
+            array = self.array[mask]
+
+        return self.copyInfo(ColumnarData(self.dataClass, array))
+
+    #----------------------------------------------------------------------
+    def copyInfo(self, data):
+        """把代码信息复制到另一个列式数据对象，并返回该对象"""
+        for name in CONST_FIELD_LIST:
+            setattr(data, name, getattr(self, name))
+        return data
+
+    #----------------------------------------------------------------------
+    def iterData(self, chunkSize=ITER_CHUNK_SIZE):
+        """逐条生成数据类对象"""
+        dataClass = self.dataClass
+        nameList = self.array.dtype.names
+        setRow = makeRowSetter(nameList)
+        vtSymbol = self.vtSymbol
+        symbol = self.symbol
+        exchange = self.exchange
+
+        for start in xrange(0, len(self.array), chunkSize):
+            chunk = self.array[start:start+chunkSize]
+
+            # 每一列一次性转换为python对象（float、str、datetime）
+            columnList = [chunk[name].tolist() for name in nameList]
+
+            for row in zip(*columnList):
+                # 所有字段都会被赋值，因此跳过构造函数中的默认值赋值
+                data = dataClass.__new__(dataClass)
+                data.vtSymbol = vtSymbol
+                data.symbol = symbol
+                data.exchange = exchange
+                setRow(data, row)
+                yield data
+
+    #----------------------------------------------------------------------
+    def toList(self):
+        """转换为数据类对象的列表"""
+        return list(self.iterData())
+
+    #----------------------------------------------------------------------
+    def save(self, fileName):
+        """保存到本地文件（NumPy的npz格式）"""
+        info = np.array([self.vtSymbol, self.symbol, self.exchange])
+        with open(fileName, 'wb') as f:
+            np.savez(f, data=self.array, info=info)
+
+    #----------------------------------------------------------------------
+    @classmethod
+    def load(cls, dataClass, fileName):
+        """从本地文件载入"""
+        npz = np.load(fileName)
+        data = cls(dataClass, npz['data'])
+        data.vtSymbol, data.symbol, data.exchange = npz['info'].tolist()
+        return data
+
+
+#----------------------------------------------------------------------
+def openMemmapArray(fileName, dataClass, count):
+    """
+    以只读内存映射方式打开ndarray.tofile保存的数组文件，count为数据条数，
+    多个进程打开同一个文件时共享操作系统的页缓存
+    """
+    dtype = getDtype(dataClass)
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fileName, dtype=dtype, mode='r', shape=(count,))
+
+
+#----------------------------------------------------------------------
+def loadColumnarData(collection, flt, dataClass, batchSize=LOAD_BATCH_SIZE):
+    """从MongoDB集合中批量载入数据，返回ColumnarData"""
+    projection = dict([(name, True) for name in dataClass.getFieldList()])
+    projection['_id'] = False
+    cursor = collection.find(flt, projection, batch_size=batchSize)
+    return buildColumnarData(cursor, dataClass, batchSize)
+
+
+#----------------------------------------------------------------------
+def buildColumnarData(cursor, dataClass, batchSize=LOAD_BATCH_SIZE):
+    """把逐条返回字典的数据库查询指针（或者字典列表）转换为ColumnarData"""
+    dtype = getDtype(dataClass)
+    nameList = dtype.names
+
+    # 缺少字段时使用数据类的默认值
+    template = dataClass()
+    defaultList = [getattr(template, name) for name in nameList]
+    fieldList = zip(nameList, defaultList)
+
+    data = ColumnarData(dataClass)
+    chunkList = []
+    rowList = []
+    first = True
+
+    for d in cursor:
+        if first:
+            for name in CONST_FIELD_LIST:
+                setattr(data, name, d.get(name, EMPTY_STRING))
+            first = False
+
+        rowList.append(tuple([d.get(name, default) for name, default in fieldList]))
+
+        if len(rowList) >= batchSize:
+            chunkList.append(np.array(rowList, dtype=dtype))
+            rowList = []
+
+    if rowList:
+        chunkList.append(np.array(rowList, dtype=dtype))
+
+    if chunkList:
+        data.array = np.concatenate(chunkList)
+
+    return data
+
+
+#----------------------------------------------------------------------
+def getPeakMemory():
+    """获取当前进程的内存峰值（MB），无法获取时返回0"""
+    if resource:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024.0 / 1024.0
+    except Exception:
+        return 0.0
+
+
+#----------------------------------------------------------------------
+def runLegacyLoading(dbName, symbol, flt, dataClass, queue):
+    """原先的载入方式：逐条遍历查询指针并生成数据对象"""
+    import pymongo
+    host, port, logging = loadMongoSetting()
+    collection = pymongo.MongoClient(host, port)[dbName][symbol]
+
+    start = time()
+    count = 0
+    for d in collection.find(flt):
+        data = dataClass()
+        data.__dict__ = d
+        count += 1
+    queue.put((count, time() - start, getPeakMemory()))
+
+
+#----------------------------------------------------------------------
+def runColumnarLoading(dbName, symbol, flt, dataClass, queue, fileName=''):
+    """列式载入方式：批量载入为数组后逐条生成数据对象，fileName不为空时从本地文件载入"""
+    start = time()
+    if fileName:
+        data = ColumnarData.load(dataClass, fileName)
+    else:
+        import pymongo
+        host, port, logging = loadMongoSetting()
+        collection = pymongo.MongoClient(host, port)[dbName][symbol]
+        data = loadColumnarData(collection, flt, dataClass)
+
+    count = 0
+    for bar in data.iterData():
+        count += 1
+    queue.put((count, time() - start, getPeakMemory()))
+
+
+#----------------------------------------------------------------------
+def compareLoading(dbName, symbol, startDate, endDate='', mode='bar'):
+    """对比原方式和列式方式的载入耗时和内存峰值，每种方式在单独的进程中运行"""
+    import os
+    import tempfile
+    import pymongo
+
+    flt = {'datetime': {'$gte': datetime.strptime(startDate, '%Y%m%d')}}
+    if endDate:
+        flt['datetime']['$lte'] = datetime.strptime(endDate, '%Y%m%d')
+
+    if mode == 'bar':
+        dataClass = CtaBarData
+    else:
+        dataClass = CtaTickData
+
+    # 先生成本地文件，用于测试从文件载入的速度
+    host, port, logging = loadMongoSetting()
+    collection = pymongo.MongoClient(host, port)[dbName][symbol]
+    fileName = os.path.join(tempfile.gettempdir(), '%s_%s.npz' % (dbName, symbol))
+    loadColumnarData(collection, flt, dataClass).save(fileName)
+
+    testList = [(u'原逐条载入', runLegacyLoading, ()),
+                (u'列式载入（数据库）', runColumnarLoading, ()),
+                (u'列式载入（本地文件）', runColumnarLoading, (fileName,))]
+
+    for name, func, extra in testList:
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=func, args=(dbName, symbol, flt, dataClass, queue) + extra)
+        p.start()
+        count, cost, memory = queue.get()
+        p.join()
+        print u'%s：%s条数据，耗时%.2f秒，内存峰值%.1fMB' % (name, count, cost, memory)
+
+    os.remove(fileName)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print u'用法：python ctaDataLoader.py 数据库名 合约代码 开始日期 [结束日期] [bar/tick]'
+    else:
+        endDate = sys.argv[4] if len(sys.argv) > 4 else ''
+        mode = sys.argv[5] if len(sys.argv) > 5 else 'bar'
+        compareLoading(sys.argv[1], sys.argv[2], sys.argv[3], endDate, mode)
@@ -18,16 +18,20 @@
 
 import json
 import os
+import sys
 import traceback
 from collections import OrderedDict
 from datetime import datetime, timedelta
 
 from ctaBase import *
+from ctaStopOrder import StopOrderBook
+from ctaBarService import BarService
 from ctaSetting import STRATEGY_CLASS
 from eventEngine import *
 from vtConstant import *
 from vtGateway import VtSubscribeReq, VtOrderReq, VtCancelOrderReq, VtLogData
-from vtFunction import todayDate
+from vtFunction import todayDate, loadHistoryCacheSetting
+from vtTime import parseTickDatetime
 
 
 ########################################################################
@@ -58,8 +62,18 @@ class CtaEngine(object):
         
         # 保存vtOrderID和strategy对象映射的字典（用于推送order和trade数据）
         # key为vtOrderID，value为strategy对象
+        # 委托结束（全部成交或撤销）且收到最后一笔成交后会从本字典中删除
         self.orderStrategyDict = {}     
         
+        # 保存策略名称和活动委托映射的字典（用于停止策略时撤单）
+        # key为策略名称，value为该策略活动委托vtOrderID的set
+        self.strategyOrderDict = {}
+        
+        # 委托生命周期跟踪，key均为vtOrderID
+        self.orderTradedDict = {}           # 已收到的成交推送数量
+        self.orderFinishedDict = {}         # 委托结束时的成交数量（收到的成交推送达到该数量后删除委托索引）
+        self.removedOrderCount = 0          # 已经删除的委托索引数量
+        
         # 本地停止单编号计数
         self.stopOrderCount = 0
         # stopOrderID = STOPORDERPREFIX + str(stopOrderCount)
@@ -68,10 +82,21 @@ class CtaEngine(object):
         # key为stopOrderID，value为stopOrder对象
         self.stopOrderDict = {}             # 停止单撤销后不会从本字典中删除
         self.workingStopOrderDict = {}      # 停止单撤销后会从本字典中删除
+        self.stopOrderBook = StopOrderBook()  # 按合约和价格排列的等待中停止单
+        
+        # 按合约共享的K线合成和指标计算，K线推送给策略时捕捉异常
+        self.barService = BarService(self.callStrategyFunc)
         
         # 持仓缓存字典
         # key为vtSymbol，value为PositionBuffer对象
         self.posBufferDict = {}
+        
+        # 本地历史数据缓存，VT_setting.json中配置了historyCacheDir时使用
+        self.historyCache = None
+        cacheDir = loadHistoryCacheSetting()
+        if cacheDir:
+            from ctaHistoryCache import HistoryCache
+            self.historyCache = HistoryCache(cacheDir, self.mainEngine.dbQuery)
 
 
         # 注册事件监听
@@ -142,7 +167,9 @@ class CtaEngine(object):
                     req.offset = OFFSET_CLOSE
 
         vtOrderID = self.mainEngine.sendOrder(req, contract.gatewayName)    # 发单
-        self.orderStrategyDict[vtOrderID] = strategy        # 保存vtOrderID和策略的映射关系
+        if vtOrderID:
+            self.orderStrategyDict[vtOrderID] = strategy        # 保存vtOrderID和策略的映射关系
+            self.strategyOrderDict.setdefault(strategy.name, set()).add(vtOrderID)
 
         self.writeCtaLog(u'策略%s发送委托，%s，%s，%s@%s'
                          %(strategy.name, vtSymbol, req.direction, volume, price))
@@ -199,6 +226,7 @@ class CtaEngine(object):
         # 保存stopOrder对象到字典中
         self.stopOrderDict[stopOrderID] = so
         self.workingStopOrderDict[stopOrderID] = so
+        self.stopOrderBook.addStopOrder(so)
         
         return stopOrderID
     
@@ -210,6 +238,7 @@ class CtaEngine(object):
             so = self.workingStopOrderDict[stopOrderID]
             so.status = STOPORDER_CANCELLED
             del self.workingStopOrderDict[stopOrderID]
+            self.stopOrderBook.cancelStopOrder(so)
 
     #----------------------------------------------------------------------
     def processStopOrder(self, tick):
@@ -218,22 +247,17 @@ class CtaEngine(object):
         
         # 首先检查是否有策略交易该合约
         if vtSymbol in self.tickStrategyDict:
-            # 遍历等待中的停止单，检查是否会被触发
-            for so in self.workingStopOrderDict.values():
-                if so.vtSymbol == vtSymbol:
-                    longTriggered = so.direction==DIRECTION_LONG and tick.lastPrice>=so.price        # 多头停止单被触发
-                    shortTriggered = so.direction==DIRECTION_SHORT and tick.lastPrice<=so.price     # 空头停止单被触发
-                    
-                    if longTriggered or shortTriggered:
-                        # 买入和卖出分别以涨停跌停价发单（模拟市价单）
-                        if so.direction==DIRECTION_LONG:
-                            price = tick.upperLimit
-                        else:
-                            price = tick.lowerLimit
-                        
-                        so.status = STOPORDER_TRIGGERED
-                        self.sendOrder(so.vtSymbol, so.orderType, price, so.volume, so.strategy)
-                        del self.workingStopOrderDict[so.stopOrderID]
+            # 从停止单簿中取出被触发的停止单（多头停止价小于等于最新价，空头停止价大于等于最新价）
+            for so in self.stopOrderBook.popTriggered(tick.lastPrice, tick.lastPrice, vtSymbol):
+                # 买入和卖出分别以涨停跌停价发单（模拟市价单）
+                if so.direction==DIRECTION_LONG:
+                    price = tick.upperLimit
+                else:
+                    price = tick.lowerLimit
+                
+                so.status = STOPORDER_TRIGGERED
+                self.sendOrder(so.vtSymbol, so.orderType, price, so.volume, so.strategy)
+                del self.workingStopOrderDict[so.stopOrderID]
 
     #----------------------------------------------------------------------
     def processTickEvent(self, event):
@@ -244,20 +268,19 @@ class CtaEngine(object):
         
         # 推送tick到对应的策略实例进行处理
         if tick.vtSymbol in self.tickStrategyDict:
-            # 将vtTickData数据转化为ctaTickData
-            ctaTick = CtaTickData()
-            d = ctaTick.__dict__
-            for key in d.keys():
-                if key != 'datetime':
-                    d[key] = tick.__getattribute__(key)
-            # 添加datetime字段
-            ctaTick.datetime = datetime.strptime(' '.join([tick.date, tick.time]), '%Y%m%d %H:%M:%S.%f')
+            # VtTickData已包含CtaTickData的全部字段，直接推送给策略，不再复制
+            # datetime字段只解析一次，行情记录引擎等其他模块可以复用
+            if tick.datetime is None:
+                tick.datetime = parseTickDatetime(tick.date, tick.time)
+            
+            # 先合成K线（推送订阅了K线的策略），再推送Tick
+            self.barService.updateTick(tick.vtSymbol, tick)
             
             # 逐个推送到策略实例中
             l = self.tickStrategyDict[tick.vtSymbol]
             for strategy in l:
-                #strategy.onTick(ctaTick)
-                self.callStrategyFunc(strategy, strategy.onTick,ctaTick)
+                #strategy.onTick(tick)
+                self.callStrategyFunc(strategy, strategy.onTick, tick)
     
     #----------------------------------------------------------------------
     def processOrderEvent(self, event):
@@ -268,6 +291,11 @@ class CtaEngine(object):
             strategy = self.orderStrategyDict[order.vtOrderID]            
             #strategy.onOrder(order)
             self.callStrategyFunc(strategy, strategy.onOrder, order)
+            
+            # 委托结束后，等收到全部成交推送再删除索引（成交推送可能晚于委托推送）
+            if order.status == STATUS_ALLTRADED or order.status == STATUS_CANCELLED:
+                self.orderFinishedDict[order.vtOrderID] = order.tradedVolume
+                self.checkOrderFinished(order.vtOrderID)
     
     #----------------------------------------------------------------------
     def processTradeEvent(self, event):
@@ -285,6 +313,9 @@ class CtaEngine(object):
             
             #strategy.onTrade(trade)
             self.callStrategyFunc(strategy, strategy.onTrade, trade)
+            
+            self.orderTradedDict[trade.vtOrderID] = self.orderTradedDict.get(trade.vtOrderID, 0) + trade.volume
+            self.checkOrderFinished(trade.vtOrderID)
 
         # 更新持仓缓存数据
         if trade.vtSymbol in self.tickStrategyDict:
@@ -295,6 +326,36 @@ class CtaEngine(object):
                 self.posBufferDict[trade.vtSymbol] = posBuffer
             posBuffer.updateTradeData(trade)
 
+    #----------------------------------------------------------------------
+    def checkOrderFinished(self, vtOrderID):
+        """检查委托是否已经结束且收到了全部成交推送，若是则删除该委托的索引"""
+        if vtOrderID not in self.orderFinishedDict:
+            return
+        
+        if self.orderTradedDict.get(vtOrderID, 0) >= self.orderFinishedDict[vtOrderID]:
+            strategy = self.orderStrategyDict.pop(vtOrderID)
+            
+            orderSet = self.strategyOrderDict.get(strategy.name)
+            if orderSet is not None:
+                orderSet.discard(vtOrderID)
+                
+            self.orderTradedDict.pop(vtOrderID, None)
+            del self.orderFinishedDict[vtOrderID]
+            self.removedOrderCount += 1
+    
+    #----------------------------------------------------------------------
+    def getOrderIndexStats(self):
+        """获取委托索引的统计信息（数量和字典占用的内存字节数）"""
+        d = OrderedDict()
+        d['liveOrders'] = len(self.orderStrategyDict)
+        d['finishedOrders'] = len(self.orderFinishedDict)
+        d['removedOrders'] = self.removedOrderCount
+        d['strategyOrders'] = dict([(name, len(orderSet)) for name, orderSet in self.strategyOrderDict.items()])
+        d['memory'] = (sys.getsizeof(self.orderStrategyDict) + sys.getsizeof(self.orderTradedDict) +
+                       sys.getsizeof(self.orderFinishedDict) + sys.getsizeof(self.strategyOrderDict) +
+                       sum([sys.getsizeof(orderSet) for orderSet in self.strategyOrderDict.values()]))
+        return d
+
     #----------------------------------------------------------------------
     def processPositionEvent(self, event):
         """处理持仓推送"""
@@ -359,6 +420,12 @@ class CtaEngine(object):
         """从数据库中读取Bar数据，startDate是datetime对象"""
         startDate = self.today - timedelta(days)
         
+        # 优先从本地缓存读取，缓存只需要从数据库追加新的数据
+        if self.historyCache:
+            data = self.historyCache.loadData(dbName, collectionName, CtaBarData, startDate)
+            if data is not None:
+                return data.toList()
+        
         d = {'datetime':{'$gte':startDate}}
         cursor = self.mainEngine.dbQuery(dbName, collectionName, d)
         
@@ -377,6 +444,12 @@ class CtaEngine(object):
         """从数据库中读取Tick数据，startDate是datetime对象"""
         startDate = self.today - timedelta(days)
         
+        # 优先从本地缓存读取，缓存只需要从数据库追加新的数据
+        if self.historyCache:
+            data = self.historyCache.loadData(dbName, collectionName, CtaTickData, startDate)
+            if data is not None:
+                return data.toList()
+        
         d = {'datetime':{'$gte':startDate}}
         cursor = self.mainEngine.dbQuery(dbName, collectionName, d)
         
@@ -391,6 +464,16 @@ class CtaEngine(object):
 
 
 
+    #----------------------------------------------------------------------
+    def subscribeBar(self, strategy, vtSymbol, period, func, indicatorList):
+        """订阅合约K线，同一合约、周期和指标参数在多个策略之间共享，返回BarFeed对象"""
+        return self.barService.subscribe(strategy, vtSymbol, period, func, indicatorList)
+    
+    #----------------------------------------------------------------------
+    def updateHistoryBar(self, strategy, vtSymbol, barList):
+        """用历史1分钟K线预热策略订阅的K线和指标"""
+        self.barService.warmUp(strategy, vtSymbol, barList)
+    
     #----------------------------------------------------------------------
     def writeCtaLog(self, content):
         """快速发出CTA模块日志事件"""
@@ -487,9 +570,8 @@ class CtaEngine(object):
                 self.callStrategyFunc(strategy, strategy.onStop)
                 
                 # 对该策略发出的所有限价单进行撤单
-                for vtOrderID, s in self.orderStrategyDict.items():
-                    if s is strategy:
-                        self.cancelOrder(vtOrderID)
+                for vtOrderID in list(self.strategyOrderDict.get(name, ())):
+                    self.cancelOrder(vtOrderID)
                 
                 # 对该策略发出的所有本地停止单撤单
                 for stopOrderID, so in self.workingStopOrderDict.items():
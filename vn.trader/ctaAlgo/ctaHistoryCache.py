@@ -0,0 +1,300 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了CTA模块使用的本地历史数据缓存。
+
+回测引擎、并行优化的每个工作进程以及CtaEngine.loadBar原先都会从MongoDB
+重复读取相同合约、相同时间段的数据。本地缓存按(数据库名, 合约代码)把数据
+保存为按时间排列的列式二进制文件，读取时使用内存映射：
+1. 请求的时间段已经在缓存中时完全不访问数据库
+2. 请求的结束时间晚于缓存时，只从数据库查询新增的数据追加到文件末尾
+3. 请求的开始时间早于缓存、数据类型变化或者数据被重新导入（调用
+   invalidateHistoryCache）时重建缓存
+4. 多个进程读取同一个缓存文件时共享操作系统的页缓存
+5. 更新缓存时持有进程间的文件锁（合约代码.lock），多个进程（如分片运行的策略、
+   共享缓存目录的并行回测）同时更新同一个合约时不会重复追加数据
+
+缓存目录结构：缓存目录/数据库名/合约代码.dat（数据）、合约代码.json（描述信息）
+和合约代码.lock（文件锁）
+'''
+
+import json
+import os
+import shutil
+from datetime import datetime
+
+from ctaBase import *
+from ctaDataLoader import ColumnarData, getDtype, buildColumnarData, openMemmapArray
+from vtFunction import loadMongoSetting, loadHistoryCacheSetting
+
+try:
+    import fcntl
+except ImportError:
+    # Windows下没有fcntl，使用msvcrt锁定文件的第一个字节
+    fcntl = None
+    import msvcrt
+
+
+DATETIME_FORMAT = '%Y%m%d %H:%M:%S.%f'
+
+
+########################################################################
+class HistoryCache(object):
+    """本地历史数据缓存"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, cacheDir, queryFunc=None):
+        """
+        Constructor
+        queryFunc为查询数据库的函数，参数为(数据库名, 集合名, 查询条件)，返回逐条字典的
+        查询指针（如MainEngine.dbQuery），为空时使用本地的MongoDB连接
+        """
+        self.cacheDir = cacheDir
+        self.queryFunc = queryFunc
+        self.dbClient = None
+
+    #----------------------------------------------------------------------
+    def getPath(self, dbName, symbol):
+        """获取缓存数据文件和描述文件的路径"""
+        path = os.path.join(self.cacheDir, dbName)
+        return os.path.join(path, symbol + '.dat'), os.path.join(path, symbol + '.json')
+
+    #----------------------------------------------------------------------
+    def readInfo(self, dbName, symbol):
+        """读取缓存的描述信息，缓存不存在时返回None"""
+        dataFile, infoFile = self.getPath(dbName, symbol)
+        if not os.path.exists(infoFile) or not os.path.exists(dataFile):
+            return None
+
+        try:
+            with open(infoFile) as f:
+                info = json.load(f)
+            info['start'] = datetime.strptime(info['start'], DATETIME_FORMAT)
+            info['end'] = datetime.strptime(info['end'], DATETIME_FORMAT)
+            return info
+        except Exception:
+            return None
+
+    #----------------------------------------------------------------------
+    def writeInfo(self, dbName, symbol, info):
+        """写入缓存的描述信息（先写入临时文件再替换，防止其他进程读到不完整的内容）"""
+        dataFile, infoFile = self.getPath(dbName, symbol)
+
+        d = dict(info)
+        d['start'] = info['start'].strftime(DATETIME_FORMAT)
+        d['end'] = info['end'].strftime(DATETIME_FORMAT)
+
+        tempFile = infoFile + '.tmp%s' % os.getpid()
+        with open(tempFile, 'w') as f:
+            json.dump(d, f, indent=4)
+        replaceFile(tempFile, infoFile)
+
+    #----------------------------------------------------------------------
+    def query(self, dbName, symbol, flt, dataClass):
+        """从数据库查询数据，返回按时间排列的ColumnarData，数据库不可用时返回None"""
+        if self.queryFunc:
+            cursor = self.queryFunc(dbName, symbol, flt)
+            if cursor is None:
+                return None
+        else:
+            if not self.dbClient:
+                import pymongo
+                host, port, logging = loadMongoSetting()
+                self.dbClient = pymongo.MongoClient(host, port)
+            cursor = self.dbClient[dbName][symbol].find(flt)
+
+        data = buildColumnarData(cursor, dataClass)
+        data.sort()
+        return data
+
+    #----------------------------------------------------------------------
+    def syncData(self, dbName, symbol, dataClass, startDate, endDate=None):
+        """
+        确保缓存包含[startDate, endDate]的数据，endDate为None表示到最新数据，
+        返回缓存的描述信息（缓存不存在且数据库不可用时返回None）
+        """
+        dataFile, infoFile = self.getPath(dbName, symbol)
+        path = os.path.dirname(dataFile)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                pass    # 其他进程同时创建了目录
+
+        # 读取描述信息、写入数据和描述信息的整个过程都持有文件锁
+        with FileLock(os.path.join(path, symbol + '.lock')):
+            return self.updateCache(dbName, symbol, dataClass, startDate, endDate)
+
+    #----------------------------------------------------------------------
+    def updateCache(self, dbName, symbol, dataClass, startDate, endDate):
+        """更新缓存，返回缓存的描述信息，调用时需要持有该合约的文件锁"""
+        dataFile, infoFile = self.getPath(dbName, symbol)
+        info = self.readInfo(dbName, symbol)
+        itemSize = getDtype(dataClass).itemsize
+
+        # 缓存不存在、数据类型变化、开始时间早于缓存或者数据文件比描述信息短时重建
+        if (not info or info['dataClass'] != dataClass.__name__ or
+            info['fieldList'] != list(getDtype(dataClass).names) or
+            startDate < info['start'] or
+            os.path.getsize(dataFile) < info['count'] * itemSize):
+            flt = {'datetime': {'$gte': startDate}}
+            if endDate:
+                flt['datetime']['$lte'] = endDate
+            queryTime = datetime.now()
+            data = self.query(dbName, symbol, flt, dataClass)
+            if data is None:
+                return None
+
+            tempFile = dataFile + '.tmp%s' % os.getpid()
+            with open(tempFile, 'wb') as f:
+                data.array.tofile(f)
+            replaceFile(tempFile, dataFile)
+
+            info = {'dataClass': dataClass.__name__,
+                    'fieldList': list(data.array.dtype.names),
+                    'vtSymbol': data.vtSymbol,
+                    'symbol': data.symbol,
+                    'exchange': data.exchange,
+                    'count': len(data),
+                    'start': startDate,
+                    'end': self.getEnd(data, startDate, endDate, queryTime)}
+            self.writeInfo(dbName, symbol, info)
+
+        # 请求的结束时间晚于缓存时追加新数据
+        elif not endDate or endDate > info['end']:
+            flt = {'datetime': {'$gt': info['end']}}
+            if endDate:
+                flt['datetime']['$lte'] = endDate
+            queryTime = datetime.now()
+            data = self.query(dbName, symbol, flt, dataClass)
+            if data is None:
+                return info
+
+            if len(data):
+                # 先截断之前中断的写入留下的多余数据，保证追加的数据和描述信息对齐
+                with open(dataFile, 'r+b') as f:
+                    f.truncate(info['count'] * itemSize)
+                    f.seek(0, os.SEEK_END)
+                    data.array.tofile(f)
+                info['count'] += len(data)
+                if not info['vtSymbol']:
+                    info['vtSymbol'] = data.vtSymbol
+                    info['symbol'] = data.symbol
+                    info['exchange'] = data.exchange
+
+            info['end'] = self.getEnd(data, info['end'], endDate, queryTime)
+            self.writeInfo(dbName, symbol, info)
+
+        return info
+
+    #----------------------------------------------------------------------
+    def getEnd(self, data, lastEnd, endDate, queryTime):
+        """
+        计算缓存覆盖的结束时间，未指定结束时间或者结束时间晚于查询时间时为最后一条数据的时间
+        （之后的数据可能还没有写入数据库，下次请求时再追加）
+        """
+        if endDate and endDate <= queryTime:
+            return max(endDate, lastEnd)
+        if len(data):
+            return max(data.array['datetime'][-1].tolist(), lastEnd)
+        return lastEnd
+
+    #----------------------------------------------------------------------
+    def loadData(self, dbName, symbol, dataClass, startDate, endDate=None):
+        """
+        读取[startDate, endDate]的数据，返回ColumnarData，其中的数组为内存映射文件的视图，
+        缓存不存在且数据库不可用时返回None
+        """
+        info = self.syncData(dbName, symbol, dataClass, startDate, endDate)
+        if info is None:
+            return None
+        return self.openData(dbName, symbol, dataClass, startDate, endDate, info)
+
+    #----------------------------------------------------------------------
+    def openData(self, dbName, symbol, dataClass, startDate, endDate=None, info=None):
+        """
+        直接打开缓存中[startDate, endDate]的数据，不检查缓存是否需要更新（用于缓存已经
+        同步过的场合，如并行优化的工作进程），缓存不存在时返回None
+        """
+        if info is None:
+            info = self.readInfo(dbName, symbol)
+            if info is None or info['dataClass'] != dataClass.__name__:
+                return None
+        dataFile, infoFile = self.getPath(dbName, symbol)
+
+        array = openMemmapArray(dataFile, dataClass, info['count'])
+
+        # 数据按时间排列，直接切片得到视图
+        data = ColumnarData(dataClass, array)
+        data.vtSymbol = info['vtSymbol']
+        data.symbol = info['symbol']
+        data.exchange = info['exchange']
+        return data.slice(startDate, endDate)
+
+    #----------------------------------------------------------------------
+    def invalidate(self, dbName, symbol=None):
+        """删除缓存，symbol为None时删除该数据库的全部缓存"""
+        if symbol is None:
+            path = os.path.join(self.cacheDir, dbName)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        else:
+            for fileName in self.getPath(dbName, symbol):
+                if os.path.exists(fileName):
+                    os.remove(fileName)
+
+
+########################################################################
+class FileLock(object):
+    """进程间的文件排他锁，用于with语句，获取锁时阻塞等待"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, fileName):
+        """Constructor"""
+        self.fileName = fileName
+        self.f = None
+
+    #----------------------------------------------------------------------
+    def __enter__(self):
+        """获取锁"""
+        self.f = open(self.fileName, 'a+b')
+        if fcntl:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        else:
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    pass    # LK_LOCK重试10秒后仍未获取到锁时报错，继续等待
+        return self
+
+    #----------------------------------------------------------------------
+    def __exit__(self, excType, excValue, traceback):
+        """释放锁"""
+        if fcntl:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        self.f.close()
+        self.f = None
+
+
+#----------------------------------------------------------------------
+def replaceFile(src, dst):
+    """用src替换dst（Windows下os.rename不能覆盖已存在的文件）"""
+    try:
+        os.rename(src, dst)
+    except OSError:
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+#----------------------------------------------------------------------
+def invalidateHistoryCache(dbName, symbol=None):
+    """数据重新导入数据库后，删除VT_setting.json中配置的本地缓存"""
+    cacheDir = loadHistoryCacheSetting()
+    if cacheDir:
+        HistoryCache(cacheDir).invalidate(dbName, symbol)
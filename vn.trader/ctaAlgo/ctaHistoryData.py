@@ -14,6 +14,7 @@ from multiprocessing.pool import ThreadPool
 from ctaBase import *
 from vtConstant import *
 from vtFunction import loadMongoSetting
+from ctaHistoryCache import invalidateHistoryCache
 from datayesClient import DatayesClient
 
 
@@ -157,6 +158,9 @@ class HistoryDataEngine(object):
                 self.dbClient[DAILY_DB_NAME][symbol].update_one(flt, {'$set':bar.__dict__}, upsert=True)            
             
                 print u'%s下载完成' %symbol
+            
+            # 数据库中的数据已更新，删除本地历史数据缓存
+            invalidateHistoryCache(DAILY_DB_NAME, symbol)
         else:
             print u'找不到合约%s' %symbol
             
@@ -225,6 +229,9 @@ class HistoryDataEngine(object):
                 flt = {'datetime': bar.datetime}
                 self.dbClient[MINUTE_DB_NAME][symbol].update_one(flt, {'$set':bar.__dict__}, upsert=True)            
             
+            # 数据库中的数据已更新，删除本地历史数据缓存
+            invalidateHistoryCache(MINUTE_DB_NAME, symbol)
+            
             print u'%s下载完成' %symbol
         else:
             print u'找不到合约%s' %symbol   
@@ -308,6 +315,9 @@ class HistoryDataEngine(object):
                 flt = {'datetime': bar.datetime}
                 self.dbClient[DAILY_DB_NAME][symbol].update_one(flt, {'$set':bar.__dict__}, upsert=True)            
             
+            # 数据库中的数据已更新，删除本地历史数据缓存
+            invalidateHistoryCache(DAILY_DB_NAME, symbol)
+            
             print u'%s下载完成' %symbol
         else:
             print u'找不到合约%s' %symbol    
@@ -348,6 +358,7 @@ def loadMcCsv(fileName, dbName, symbol):
         collection.update_one(flt, {'$set':bar.__dict__}, upsert=True)  
         print bar.date, bar.time
     
+    invalidateHistoryCache(dbName, symbol)
     print u'插入完毕，耗时：%s' % (time()-start)
 
 
@@ -394,6 +405,7 @@ def loadMinuteTxt(fileName, dbName, symbol):
         collection.update_one(flt, {'$set':bar.__dict__}, upsert=True)
         print bar.date, bar.time
 
+    invalidateHistoryCache(dbName, symbol)
     print u'插入完毕，耗时：%s' % (time()-start)
 
 
@@ -439,6 +451,7 @@ def loadDayTxt(fileName, dbName, symbol):
         collection.update_one(flt, {'$set':bar.__dict__}, upsert=True)
         print bar.date, bar.time
 
+    invalidateHistoryCache(dbName, symbol)
     print u'插入完毕，耗时：%s' % (time()-start)
 
 
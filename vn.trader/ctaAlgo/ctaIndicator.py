@@ -0,0 +1,444 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了CTA K线使用的流式技术指标。
+
+原先每根K线完成时都从K线列表中取出整个窗口，转换为数组后调用talib重新计算，
+计算量和窗口长度成正比。流式指标只保存递推需要的状态，每根K线O(1)更新：
+1. EMA：前period个数据的简单平均作为初始值，之后递推（和talib.EMA一致）
+2. RSI、ATR、DMI/ADX：Wilder平滑递推（和talib.RSI、ATR、PLUS_DI、MINUS_DI、ADX一致）
+3. SMA、标准差、布林带：滚动窗口内数据的和与平方和（和talib.SMA、STDDEV、BBANDS一致）
+4. 最高、最低：单调队列，每个数据最多进出队列一次
+
+update函数返回最新的指标值，数据不足时返回None。
+'''
+
+from __future__ import division
+
+from collections import deque
+from math import sqrt
+
+
+ZERO_THRESHOLD = 0.00000001     # 和talib的TA_IS_ZERO一致，绝对值小于该值视为0
+RESUM_INTERVAL = 1000           # 滚动窗口重新求和的最小间隔（更新次数）
+
+
+#----------------------------------------------------------------------
+def isZero(value):
+    """判断是否为0（和talib的TA_IS_ZERO一致）"""
+    return -ZERO_THRESHOLD < value < ZERO_THRESHOLD
+
+
+#----------------------------------------------------------------------
+def getTrueRange(high, low, preClose):
+    """计算真实波幅：最高与最低、最高与昨收、最低与昨收的价差中的最大值"""
+    return max(high - low, abs(high - preClose), abs(low - preClose))
+
+
+#----------------------------------------------------------------------
+def getDirectionalMovement(high, low, preHigh, preLow):
+    """计算动向，返回(上升动向, 下降动向)"""
+    upMove = high - preHigh
+    downMove = preLow - low
+
+    pdm = 0
+    mdm = 0
+    if upMove > 0 and upMove > downMove:
+        pdm = upMove
+    elif downMove > 0 and downMove > upMove:
+        mdm = downMove
+    return pdm, mdm
+
+
+########################################################################
+class RollingWindow(object):
+    """
+    定长滚动窗口，维护窗口内数据的和与平方和
+    求和时先减去基准值（最早的数据），避免价格较大时平方和损失精度；
+    加减累积的浮点误差在每隔一段时间重新求和时消除，均摊后仍为O(1)
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.queue = deque()
+        self.base = None                # 求和的基准值
+        self.sum = 0                    # 窗口内数据减去基准值之和
+        self.sumSquare = 0              # 窗口内数据减去基准值的平方和
+        self.resumInterval = max(period, RESUM_INTERVAL)
+        self.resumCount = 0             # 上次重新求和之后的更新次数
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """窗口内的数据数量"""
+        return len(self.queue)
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据，窗口已满时移出最早的数据"""
+        queue = self.queue
+        if self.base is None:
+            self.base = value
+
+        queue.append(value)
+        d = value - self.base
+        self.sum += d
+        self.sumSquare += d * d
+
+        if len(queue) > self.period:
+            d = queue.popleft() - self.base
+            self.sum -= d
+            self.sumSquare -= d * d
+
+        self.resumCount += 1
+        if self.resumCount >= self.resumInterval:
+            self.resum()
+
+    #----------------------------------------------------------------------
+    def resum(self):
+        """以最早的数据为基准值重新求和"""
+        self.resumCount = 0
+        if not self.queue:
+            return
+
+        base = self.queue[0]
+        s = 0
+        s2 = 0
+        for value in self.queue:
+            d = value - base
+            s += d
+            s2 += d * d
+
+        self.base = base
+        self.sum = s
+        self.sumSquare = s2
+
+    #----------------------------------------------------------------------
+    def isFull(self):
+        """窗口是否已满"""
+        return len(self.queue) >= self.period
+
+    #----------------------------------------------------------------------
+    def getSum(self):
+        """窗口内数据之和"""
+        return self.sum + self.base * len(self.queue) if self.queue else 0
+
+    #----------------------------------------------------------------------
+    def getMean(self):
+        """窗口内数据的平均值"""
+        n = len(self.queue)
+        if not n:
+            return None
+        return self.base + self.sum / n
+
+    #----------------------------------------------------------------------
+    def getStd(self):
+        """窗口内数据的总体标准差，方差小于ZERO_THRESHOLD时为0（和talib.STDDEV一致）"""
+        n = len(self.queue)
+        if not n:
+            return None
+
+        mean = self.sum / n
+        variance = self.sumSquare / n - mean * mean
+        if variance < ZERO_THRESHOLD:
+            return 0
+        return sqrt(variance)
+
+
+########################################################################
+class SmaIndicator(object):
+    """简单移动平均"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.window = RollingWindow(period)
+        self.value = None
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据，返回最新的平均值"""
+        self.window.update(value)
+        if self.window.isFull():
+            self.value = self.window.getMean()
+        return self.value
+
+
+########################################################################
+class EmaIndicator(object):
+    """指数移动平均，以前period个数据的简单平均作为初始值"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.k = 2 / (period + 1)       # 平滑系数
+        self.count = 0
+        self.sum = 0                    # 初始值计算前的数据之和
+        self.value = None
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据，返回最新的EMA"""
+        if self.value is not None:
+            self.value = (value - self.value) * self.k + self.value
+            return self.value
+
+        self.count += 1
+        self.sum += value
+        if self.count >= self.period:
+            self.value = self.sum / self.period
+        return self.value
+
+
+########################################################################
+class BollIndicator(object):
+    """布林带：中轨为简单移动平均，上下轨为中轨加减总体标准差的倍数"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period, stdRate=2):
+        """Constructor"""
+        self.period = period
+        self.stdRate = stdRate
+        self.window = RollingWindow(period)
+
+        self.upper = None
+        self.middle = None
+        self.lower = None
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据，返回(上轨, 中轨, 下轨)，数据不足时返回None"""
+        window = self.window
+        window.update(value)
+        if not window.isFull():
+            return None
+
+        self.middle = window.getMean()
+        width = window.getStd() * self.stdRate
+        self.upper = self.middle + width
+        self.lower = self.middle - width
+        return self.upper, self.middle, self.lower
+
+
+########################################################################
+class RsiIndicator(object):
+    """相对强弱指数，平均涨幅和平均跌幅使用Wilder平滑"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.count = 0                  # 已计算的涨跌数量
+        self.preValue = None
+        self.avgGain = 0                # 平均涨幅（初始值计算前为涨幅之和）
+        self.avgLoss = 0                # 平均跌幅（初始值计算前为跌幅之和）
+        self.value = None
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据，返回最新的RSI"""
+        preValue = self.preValue
+        self.preValue = value
+        if preValue is None:
+            return None
+
+        diff = value - preValue
+        n = self.period
+        self.count += 1
+
+        if self.count <= n:
+            if diff < 0:
+                self.avgLoss -= diff
+            else:
+                self.avgGain += diff
+
+            if self.count < n:
+                return None
+            self.avgGain /= n
+            self.avgLoss /= n
+        else:
+            self.avgGain *= n - 1
+            self.avgLoss *= n - 1
+            if diff < 0:
+                self.avgLoss -= diff
+            else:
+                self.avgGain += diff
+            self.avgGain /= n
+            self.avgLoss /= n
+
+        self.value = getRsi(self.avgGain, self.avgLoss)
+        return self.value
+
+
+#----------------------------------------------------------------------
+def getRsi(avgGain, avgLoss):
+    """根据平均涨幅和平均跌幅计算RSI，两者都为0时RSI为0（和talib一致）"""
+    total = avgGain + avgLoss
+    if isZero(total):
+        return 0
+    return 100 * (avgGain / total)
+
+
+########################################################################
+class AtrIndicator(object):
+    """平均真实波幅，以前period个真实波幅的简单平均作为初始值，之后Wilder平滑"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.count = 0                  # 已计算的真实波幅数量
+        self.preClose = None
+        self.sum = 0                    # 初始值计算前的真实波幅之和
+        self.value = None
+
+    #----------------------------------------------------------------------
+    def update(self, high, low, close):
+        """加入一根K线，返回最新的ATR"""
+        preClose = self.preClose
+        self.preClose = close
+        if preClose is None:
+            return None
+
+        tr = getTrueRange(high, low, preClose)
+        n = self.period
+
+        if self.value is not None:
+            self.value = (self.value * (n - 1) + tr) / n
+            return self.value
+
+        self.count += 1
+        self.sum += tr
+        if self.count >= n:
+            self.value = self.sum / n
+        return self.value
+
+
+########################################################################
+class DmiIndicator(object):
+    """
+    动向指标，上升动向、下降动向和真实波幅使用Wilder平滑
+    pdi和mdi在第period根K线之后有效，adx在第2*period-1根K线之后有效
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.count = 0                  # 已计算的动向数量
+
+        self.preHigh = None
+        self.preLow = None
+        self.preClose = None
+
+        self.sumPdm = 0                 # 平滑后的上升动向
+        self.sumMdm = 0                 # 平滑后的下降动向
+        self.sumTr = 0                  # 平滑后的真实波幅
+        self.sumDx = 0                  # ADX初始值计算前的DX之和
+
+        self.pdi = None                 # 上升动向指标
+        self.mdi = None                 # 下降动向指标
+        self.adx = None                 # 平均趋向指标
+
+    #----------------------------------------------------------------------
+    def update(self, high, low, close):
+        """加入一根K线，返回最新的(pdi, mdi, adx)，数据不足时返回None，adx可能为None"""
+        preHigh = self.preHigh
+        preLow = self.preLow
+        preClose = self.preClose
+        self.preHigh = high
+        self.preLow = low
+        self.preClose = close
+        if preHigh is None:
+            return None
+
+        pdm, mdm = getDirectionalMovement(high, low, preHigh, preLow)
+        tr = getTrueRange(high, low, preClose)
+        n = self.period
+        self.count += 1
+
+        # 前period-1个直接求和
+        if self.count < n:
+            self.sumPdm += pdm
+            self.sumMdm += mdm
+            self.sumTr += tr
+            return None
+
+        self.sumPdm = self.sumPdm - self.sumPdm / n + pdm
+        self.sumMdm = self.sumMdm - self.sumMdm / n + mdm
+        self.sumTr = self.sumTr - self.sumTr / n + tr
+
+        # 真实波幅或者DI之和为0时DX无法计算，ADX保持不变
+        if isZero(self.sumTr):
+            self.pdi = 0
+            self.mdi = 0
+        else:
+            self.pdi = 100 * (self.sumPdm / self.sumTr)
+            self.mdi = 100 * (self.sumMdm / self.sumTr)
+
+            total = self.pdi + self.mdi
+            if not isZero(total):
+                dx = 100 * (abs(self.mdi - self.pdi) / total)
+                if self.adx is not None:
+                    self.adx = (self.adx * (n - 1) + dx) / n
+                else:
+                    self.sumDx += dx
+
+        if self.count == 2 * n - 1:
+            self.adx = self.sumDx / n
+
+        return self.pdi, self.mdi, self.adx
+
+
+########################################################################
+class HighestIndicator(object):
+    """滚动窗口内的最高值，使用单调递减队列"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, period):
+        """Constructor"""
+        self.period = period
+        self.count = 0                  # 已加入的数据数量
+        self.queue = deque()            # (序号, 数据)
+        self.value = None               # 窗口内已有数据的最高值（数据不足period个时也有效）
+
+    #----------------------------------------------------------------------
+    def isBetter(self, value, other):
+        """value是否优于（不差于）other，优于的数据使other不可能再成为结果"""
+        return value >= other
+
+    #----------------------------------------------------------------------
+    def update(self, value):
+        """加入一个数据，返回窗口内的最高值，数据不足period个时返回None"""
+        queue = self.queue
+        isBetter = self.isBetter
+        while queue and isBetter(value, queue[-1][1]):
+            queue.pop()
+
+        queue.append((self.count, value))
+        self.count += 1
+        if queue[0][0] <= self.count - 1 - self.period:
+            queue.popleft()
+
+        self.value = queue[0][1]
+        if self.count < self.period:
+            return None
+        return self.value
+
+    #----------------------------------------------------------------------
+    def isFull(self):
+        """窗口是否已满"""
+        return self.count >= self.period
+
+
+########################################################################
+class LowestIndicator(HighestIndicator):
+    """滚动窗口内的最低值，使用单调递增队列"""
+
+    #----------------------------------------------------------------------
+    def isBetter(self, value, other):
+        """value是否优于（不差于）other"""
+        return value <= other
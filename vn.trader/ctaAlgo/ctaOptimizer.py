@@ -0,0 +1,342 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了参数优化使用的搜索算法。
+
+原先的优化只能遍历全部参数组合（网格搜索），参数较多时组合数量急剧增加。
+这里的搜索算法通过回测引擎提供的评估函数运行回测（串行或者进程池），
+并且都可以设置评估次数和运行时间的上限：
+1. 网格搜索：按顺序遍历参数组合，不再预先生成全部组合的列表
+2. 随机搜索：随机抽取不重复的参数组合
+3. 遗传算法：锦标赛选择、均匀交叉和相邻取值变异，每代保留最优的个体
+4. 逐次减半：先在较短的回测区间上评估全部候选参数，每轮只保留表现最好的1/eta，
+   同时把回测区间延长eta倍，最后一轮使用完整的回测区间
+
+搜索时参数组合用各参数取值的下标元组表示，评估函数的参数为(参数字典列表, 结束日期)，
+结束日期为None时使用完整的回测区间，返回对应的优化目标值列表。
+'''
+
+import random
+from datetime import timedelta
+from itertools import product, islice
+from time import time
+
+
+SEARCH_GRID = 'grid'            # 网格搜索
+SEARCH_RANDOM = 'random'        # 随机搜索
+SEARCH_GENETIC = 'genetic'      # 遗传算法
+SEARCH_HALVING = 'halving'      # 逐次减半
+
+DEFAULT_RANDOM_COUNT = 100      # 随机搜索默认的评估次数
+DEFAULT_HALVING_COUNT = 81      # 逐次减半默认的候选参数数量
+
+
+########################################################################
+class OptimizationSearcher(object):
+    """搜索算法的基类，负责评估次数、运行时间的控制和结果记录"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, optimizationSetting, evaluateFunc, batchSize=1, output=None):
+        """Constructor"""
+        self.evaluateFunc = evaluateFunc        # 评估函数
+        self.batchSize = batchSize              # 每次提交给评估函数的参数数量
+        self.output = output                    # 输出日志的函数
+
+        self.nameList = optimizationSetting.paramDict.keys()
+        self.paramList = optimizationSetting.paramDict.values()
+        self.searchParamDict = optimizationSetting.searchParamDict
+        self.maxEvaluation = optimizationSetting.maxEvaluation     # 评估次数上限，0表示不限
+        self.maxTime = optimizationSetting.maxTime                 # 运行时间上限（秒），0表示不限
+
+        self.random = random.Random(self.searchParamDict.get('seed'))
+
+        self.startTime = time()
+        self.evaluationCount = 0        # 已经运行的回测次数（包括短区间的回测）
+        self.resultDict = {}            # 完整回测区间的结果，key为下标元组，value为优化目标值
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """运行搜索，由子类实现"""
+        raise NotImplementedError
+
+    #----------------------------------------------------------------------
+    def search(self):
+        """运行搜索并返回结果列表[(参数字典, 优化目标值)]，按目标值从大到小排列"""
+        self.run()
+
+        resultList = [(self.getSetting(index), value) for index, value in self.resultDict.items()]
+        resultList.sort(reverse=True, key=lambda result: result[1])
+
+        self.writeLog(u'搜索完成，回测%s次，耗时%.2f秒' % (self.evaluationCount, time() - self.startTime))
+        return resultList
+
+    #----------------------------------------------------------------------
+    def evaluate(self, indexList, endDate=None):
+        """
+        评估参数组合，返回{下标元组: 优化目标值}
+        完整回测区间已经评估过的参数直接使用之前的结果，超出评估次数或者运行时间上限后
+        剩余的参数不再评估（不包含在返回的字典中）
+        """
+        d = {}
+        pendingList = []
+        for index in indexList:
+            if endDate is None and index in self.resultDict:
+                d[index] = self.resultDict[index]
+            elif index not in d and index not in pendingList:
+                pendingList.append(index)
+
+        while pendingList and not self.isFinished():
+            n = self.batchSize
+            if self.maxEvaluation:
+                n = min(n, self.maxEvaluation - self.evaluationCount)
+
+            batch = pendingList[:n]
+            pendingList = pendingList[n:]
+
+            valueList = self.evaluateFunc([self.getSetting(index) for index in batch], endDate)
+            self.evaluationCount += len(batch)
+
+            for index, value in zip(batch, valueList):
+                d[index] = value
+                if endDate is None:
+                    self.resultDict[index] = value
+
+        return d
+
+    #----------------------------------------------------------------------
+    def isFinished(self):
+        """检查是否已经达到评估次数或者运行时间的上限"""
+        if self.maxEvaluation and self.evaluationCount >= self.maxEvaluation:
+            return True
+        if self.maxTime and time() - self.startTime >= self.maxTime:
+            return True
+        return False
+
+    #----------------------------------------------------------------------
+    def getSetting(self, index):
+        """把下标元组转换为参数字典"""
+        return dict([(name, l[i]) for name, l, i in zip(self.nameList, self.paramList, index)])
+
+    #----------------------------------------------------------------------
+    def getSettingCount(self):
+        """参数组合的总数"""
+        count = 1
+        for l in self.paramList:
+            count *= len(l)
+        return count
+
+    #----------------------------------------------------------------------
+    def decodeIndex(self, n):
+        """把参数组合的序号转换为下标元组（和itertools.product的顺序一致）"""
+        index = []
+        for l in reversed(self.paramList):
+            n, i = divmod(n, len(l))
+            index.append(i)
+        index.reverse()
+        return tuple(index)
+
+    #----------------------------------------------------------------------
+    def sampleIndex(self, count):
+        """随机抽取count个不重复的参数组合"""
+        total = self.getSettingCount()
+        count = min(count, total)
+
+        # 组合数量较少时直接抽样序号，否则随机生成并去重
+        if total <= count * 4:
+            return [self.decodeIndex(n) for n in self.random.sample(xrange(total), count)]
+
+        indexSet = set()
+        indexList = []
+        while len(indexList) < count:
+            index = tuple([self.random.randrange(len(l)) for l in self.paramList])
+            if index not in indexSet:
+                indexSet.add(index)
+                indexList.append(index)
+        return indexList
+
+    #----------------------------------------------------------------------
+    def getBestIndexList(self, d, count):
+        """从评估结果中选出优化目标值最大的count个下标元组"""
+        l = sorted(d.items(), reverse=True, key=lambda item: item[1])
+        return [index for index, value in l[:count]]
+
+    #----------------------------------------------------------------------
+    def writeLog(self, content):
+        """输出日志"""
+        if self.output:
+            self.output(content)
+
+
+########################################################################
+class GridSearcher(OptimizationSearcher):
+    """网格搜索，按顺序遍历参数组合"""
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """运行搜索"""
+        indexIter = product(*[range(len(l)) for l in self.paramList])
+
+        while not self.isFinished():
+            batch = list(islice(indexIter, self.batchSize))
+            if not batch:
+                break
+            self.evaluate(batch)
+
+
+########################################################################
+class RandomSearcher(OptimizationSearcher):
+    """
+    随机搜索
+    searchParamDict中的参数：
+    count：评估的参数组合数量，默认为评估次数上限或者DEFAULT_RANDOM_COUNT
+    """
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """运行搜索"""
+        count = self.searchParamDict.get('count', self.maxEvaluation or DEFAULT_RANDOM_COUNT)
+        self.evaluate(self.sampleIndex(count))
+
+
+########################################################################
+class GeneticSearcher(OptimizationSearcher):
+    """
+    遗传算法
+    searchParamDict中的参数：
+    populationSize：种群数量，默认20
+    generationCount：最多进化的代数，默认10
+    mutationRate：每个参数发生变异的概率，默认0.2
+    eliteCount：直接保留到下一代的最优个体数量，默认2
+    tournamentSize：锦标赛选择时每次比较的个体数量，默认3
+    """
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """运行搜索"""
+        populationSize = self.searchParamDict.get('populationSize', 20)
+        generationCount = self.searchParamDict.get('generationCount', 10)
+        eliteCount = self.searchParamDict.get('eliteCount', 2)
+
+        population = self.sampleIndex(populationSize)
+
+        for generation in range(generationCount):
+            d = self.evaluate(population)
+            if not d:
+                break
+
+            bestIndex = self.getBestIndexList(d, 1)[0]
+            self.writeLog(u'第%s代最优参数：%s，优化目标值：%s' % (generation+1,
+                                                           self.getSetting(bestIndex), d[bestIndex]))
+
+            if self.isFinished():
+                break
+
+            # 精英个体直接进入下一代，其余个体通过选择、交叉和变异产生
+            ranked = self.getBestIndexList(d, len(d))
+            nextPopulation = ranked[:eliteCount]
+            for i in range(populationSize * 10):
+                if len(nextPopulation) >= populationSize:
+                    break
+                child = self.mutate(self.crossover(self.select(ranked, d), self.select(ranked, d)))
+                if child not in nextPopulation:
+                    nextPopulation.append(child)
+            population = nextPopulation
+
+    #----------------------------------------------------------------------
+    def select(self, ranked, d):
+        """锦标赛选择"""
+        tournamentSize = min(self.searchParamDict.get('tournamentSize', 3), len(ranked))
+        candidateList = self.random.sample(ranked, tournamentSize)
+        return max(candidateList, key=lambda index: d[index])
+
+    #----------------------------------------------------------------------
+    def crossover(self, parent1, parent2):
+        """均匀交叉，每个参数随机继承父代之一"""
+        return tuple([self.random.choice(pair) for pair in zip(parent1, parent2)])
+
+    #----------------------------------------------------------------------
+    def mutate(self, index):
+        """变异，参数以一定概率移动到相邻的取值"""
+        mutationRate = self.searchParamDict.get('mutationRate', 0.2)
+
+        l = list(index)
+        for n, paramList in enumerate(self.paramList):
+            if len(paramList) > 1 and self.random.random() < mutationRate:
+                i = l[n] + self.random.choice((-1, 1))
+                l[n] = min(max(i, 0), len(paramList)-1)
+        return tuple(l)
+
+
+########################################################################
+class HalvingSearcher(OptimizationSearcher):
+    """
+    逐次减半
+    searchParamDict中的参数：
+    count：初始候选参数数量，默认DEFAULT_HALVING_COUNT
+    eta：每轮保留的比例为1/eta，同时回测区间延长eta倍，默认3
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, optimizationSetting, evaluateFunc, batchSize=1, output=None,
+                 startDate=None, endDate=None):
+        """Constructor，startDate和endDate为完整回测区间（不包括初始化数据）的起止时间"""
+        super(HalvingSearcher, self).__init__(optimizationSetting, evaluateFunc, batchSize, output)
+        self.startDate = startDate
+        self.endDate = endDate
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """运行搜索"""
+        count = self.searchParamDict.get('count', DEFAULT_HALVING_COUNT)
+        eta = self.searchParamDict.get('eta', 3)
+
+        candidateList = self.sampleIndex(count)
+
+        # 计算轮数，每轮候选数量除以eta，直到只剩一个
+        rungCount = 0
+        n = len(candidateList)
+        while n > 1:
+            n //= eta
+            rungCount += 1
+
+        for rung in range(rungCount+1):
+            endDate = self.getRungEndDate(eta ** (rung - rungCount))
+            d = self.evaluate(candidateList, endDate)
+            if not d:
+                break
+
+            self.writeLog(u'第%s轮：候选参数%s个，回测结束日期%s' % (rung+1, len(d), endDate or u'完整区间'))
+
+            if endDate is None or self.isFinished():
+                break
+
+            candidateList = self.getBestIndexList(d, max(len(d) // eta, 1))
+
+    #----------------------------------------------------------------------
+    def getRungEndDate(self, fraction):
+        """计算使用完整区间fraction比例的回测结束日期（YYYYMMDD），完整区间时返回None"""
+        if fraction >= 1 or not self.startDate or not self.endDate:
+            return None
+
+        days = max(int((self.endDate - self.startDate).days * fraction), 1)
+        endDate = self.startDate + timedelta(days)
+        if endDate >= self.endDate:
+            return None
+        return endDate.strftime('%Y%m%d')
+
+
+#----------------------------------------------------------------------
+def createSearcher(optimizationSetting, evaluateFunc, batchSize=1, output=None,
+                   startDate=None, endDate=None):
+    """根据优化设置中的搜索模式创建搜索算法对象"""
+    mode = optimizationSetting.searchMode
+
+    if mode == SEARCH_RANDOM:
+        return RandomSearcher(optimizationSetting, evaluateFunc, batchSize, output)
+    elif mode == SEARCH_GENETIC:
+        return GeneticSearcher(optimizationSetting, evaluateFunc, batchSize, output)
+    elif mode == SEARCH_HALVING:
+        return HalvingSearcher(optimizationSetting, evaluateFunc, batchSize, output,
+                               startDate, endDate)
+    else:
+        return GridSearcher(optimizationSetting, evaluateFunc, batchSize, output)
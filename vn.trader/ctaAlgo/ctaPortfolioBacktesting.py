@@ -0,0 +1,737 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了CTA模块的组合回测引擎。
+
+BacktestingEngine每次只能回测一个策略在一个合约上的表现，而实盘中CtaEngine
+会按照CTA_setting.json同时运行多个合约上的多个策略实例。组合回测引擎的API
+和CTA引擎一致，可以直接载入CTA_setting.json：
+1. 每个合约的数据是一个按时间排列的数据流（本地缓存的内存映射文件分块读取，
+   或者按时间排序的数据库查询指针），回放时用堆对所有数据流做多路归并，
+   按时间顺序逐条推送，内存中只保留每个合约当前的一小块数据
+2. 限价单簿和停止单簿都按合约和价格保存，只撮合当前数据所属合约会成交的委托
+3. 合约大小、手续费和滑点可以按合约分别设置
+4. 回测结果按策略分别统计，同时汇总为整个组合的交易结果和逐日盯市结果
+
+策略只交易自己的vtSymbol（和CTA引擎中的用法一致），逐日结算使用该合约的价格。
+'''
+
+from __future__ import division
+
+import json
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from heapq import heapify, heappop, heapreplace
+
+import pymongo
+
+from ctaBase import *
+from ctaStopOrder import StopOrderBook, LimitOrderBook
+from ctaBarService import BarService
+from ctaHistoryCache import HistoryCache
+from ctaDailyResult import DailySettlement, combineDailyResult
+from ctaBacktesting import matchTrades, calculateTradingStatistics, formatNumber
+from ctaSetting import STRATEGY_CLASS
+
+from vtConstant import *
+from vtGateway import VtOrderData, VtTradeData
+from vtFunction import loadMongoSetting
+
+
+STREAM_CHUNK_SIZE = 1024        # 从内存映射文件读取数据流时每块的数据条数
+CURSOR_BATCH_SIZE = 1024        # 从数据库读取数据流时每批的数据条数
+
+
+########################################################################
+class PortfolioSymbol(object):
+    """组合回测中单个合约的回放状态"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol, size, rate, slippage):
+        """Constructor"""
+        self.vtSymbol = vtSymbol
+        self.size = size                # 合约大小
+        self.rate = rate                # 手续费比例
+        self.slippage = slippage        # 滑点
+
+        self.strategyList = []          # 交易该合约的策略
+        self.barStrategyList = []       # 直接推送K线的策略（没有订阅K线的策略）
+        self.workingLimitOrderDict = OrderedDict()  # 活动限价单字典
+        self.initData = []              # 初始化用的数据
+        self.stream = None              # 回测数据流，按时间逐条生成数据对象
+
+        self.bar = None                 # 最新的K线
+        self.tick = None                # 最新的Tick
+
+
+########################################################################
+class PortfolioBacktestingEngine(object):
+    """
+    CTA组合回测引擎
+    函数接口和策略引擎保持一样，
+    从而实现同一套代码和配置从回测到实盘。
+    """
+
+    TICK_MODE = 'tick'
+    BAR_MODE = 'bar'
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        # 引擎类型为回测
+        self.engineType = ENGINETYPE_BACKTESTING
+
+        self.mode = self.BAR_MODE       # 回测模式，默认为K线
+        self.dbName = ''                # 回测数据库名，为空时按回测模式使用默认数据库
+        self.dataCacheDir = ''          # 本地历史数据缓存目录，为空则直接读取数据库
+        self.dbClient = None            # 数据库客户端
+
+        self.dataStartDate = None       # 回测数据开始日期，datetime对象
+        self.dataEndDate = None         # 回测数据结束日期，datetime对象
+        self.strategyStartDate = None   # 策略启动日期（即前面的数据用于初始化），datetime对象
+
+        # 合约大小、手续费和滑点的默认值，以及按合约的设置
+        self.size = 1
+        self.rate = 0
+        self.slippage = 0
+        self.symbolParamDict = {}       # key为vtSymbol，value为(size, rate, slippage)
+
+        self.strategyDict = OrderedDict()   # 策略对象字典，key为策略名称
+        self.symbolDict = OrderedDict()     # 合约回放状态字典，key为vtSymbol
+        self.historyDataDict = {}           # 直接设置的列式历史数据，key为vtSymbol
+        self.barService = BarService()      # 按合约共享的K线合成和指标计算
+
+        # 委托和成交
+        self.stopOrderCount = 0
+        self.stopOrderDict = {}         # 停止单撤销后不会从本字典中删除
+        self.workingStopOrderDict = {}  # 停止单撤销后会从本字典中删除
+        self.stopOrderBook = StopOrderBook()    # 按合约和价格排列的等待中停止单
+
+        self.limitOrderCount = 0
+        self.limitOrderDict = OrderedDict()     # 限价单字典
+        self.limitOrderBook = LimitOrderBook()  # 按合约和价格排列的活动限价单，用于进行撮合用
+        self.orderStrategyDict = {}     # 限价单对应的策略，key为vtOrderID
+
+        self.tradeCount = 0
+        self.tradeDict = OrderedDict()  # 成交字典
+        self.strategyTradeDict = {}     # 按策略保存的成交列表，key为策略名称
+        self.settlementDict = {}        # 按策略的逐日结算对象，key为策略名称
+
+        self.logList = []               # 日志记录
+
+        self.dt = None                  # 最新的时间
+
+    #----------------------------------------------------------------------
+    def setStartDate(self, startDate='20100416', initDays=10):
+        """设置回测的启动日期"""
+        self.dataStartDate = datetime.strptime(startDate, '%Y%m%d')
+        self.strategyStartDate = self.dataStartDate + timedelta(initDays)
+
+    #----------------------------------------------------------------------
+    def setEndDate(self, endDate=''):
+        """设置回测的结束日期（包含当天）"""
+        if endDate:
+            self.dataEndDate = datetime.strptime(endDate, '%Y%m%d').replace(hour=23, minute=59, second=59)
+        else:
+            self.dataEndDate = None
+
+    #----------------------------------------------------------------------
+    def setBacktestingMode(self, mode):
+        """设置回测模式"""
+        self.mode = mode
+
+    #----------------------------------------------------------------------
+    def setDatabase(self, dbName):
+        """设置历史数据所用的数据库，每个合约的集合名为其vtSymbol"""
+        self.dbName = dbName
+
+    #----------------------------------------------------------------------
+    def setCacheDir(self, cacheDir):
+        """设置本地历史数据缓存目录，数据流从内存映射文件分块读取"""
+        self.dataCacheDir = cacheDir
+
+    #----------------------------------------------------------------------
+    def setSlippage(self, slippage):
+        """设置默认的滑点"""
+        self.slippage = slippage
+
+    #----------------------------------------------------------------------
+    def setRate(self, rate):
+        """设置默认的手续费比例"""
+        self.rate = rate
+
+    #----------------------------------------------------------------------
+    def setSize(self, size):
+        """设置默认的合约大小"""
+        self.size = size
+
+    #----------------------------------------------------------------------
+    def setBarEndLabel(self, endLabel=True):
+        """设置K线模式的回测数据的时间是否为K线结束时间（如9:01表示9:00-9:01），用于订阅K线的合成"""
+        self.barService.setEndLabel(endLabel)
+
+    #----------------------------------------------------------------------
+    def setSymbolParam(self, vtSymbol, size=None, rate=None, slippage=None):
+        """设置单个合约的合约大小、手续费比例和滑点，为None的项使用默认值"""
+        self.symbolParamDict[vtSymbol] = (size, rate, slippage)
+
+    #----------------------------------------------------------------------
+    def getSymbolParam(self, vtSymbol):
+        """获取合约的(合约大小, 手续费比例, 滑点)"""
+        size, rate, slippage = self.symbolParamDict.get(vtSymbol, (None, None, None))
+        if size is None:
+            size = self.size
+        if rate is None:
+            rate = self.rate
+        if slippage is None:
+            slippage = self.slippage
+        return size, rate, slippage
+
+    #----------------------------------------------------------------------
+    def setHistoryData(self, vtSymbol, data):
+        """
+        直接设置合约的列式历史数据（ColumnarData，需包括初始化数据），
+        设置后该合约不再从本地缓存或者数据库载入
+        """
+        self.historyDataDict[vtSymbol] = data
+
+    #----------------------------------------------------------------------
+    def addStrategy(self, strategyClass, setting=None):
+        """添加策略实例，setting中需要包含vtSymbol，返回策略对象"""
+        strategy = strategyClass(self, setting)
+        if not strategy.name:
+            strategy.name = strategy.className
+
+        if strategy.name in self.strategyDict:
+            self.writeCtaLog(u'策略实例重名：%s' % strategy.name)
+            return None
+
+        self.strategyDict[strategy.name] = strategy
+        return strategy
+
+    #----------------------------------------------------------------------
+    def loadSetting(self, fileName):
+        """读取CTA_setting.json格式的策略配置"""
+        with open(fileName) as f:
+            l = json.load(f)
+
+        for setting in l:
+            try:
+                className = setting['className']
+            except Exception, e:
+                self.writeCtaLog(u'载入策略出错：%s' % e)
+                continue
+
+            strategyClass = STRATEGY_CLASS.get(className, None)
+            if not strategyClass:
+                self.writeCtaLog(u'找不到策略类：%s' % className)
+                continue
+
+            self.addStrategy(strategyClass, setting)
+
+    #----------------------------------------------------------------------
+    def getDataClass(self):
+        """根据回测模式获取数据类"""
+        if self.mode == self.BAR_MODE:
+            return CtaBarData
+        return CtaTickData
+
+    #----------------------------------------------------------------------
+    def getDbName(self):
+        """获取回测数据库名"""
+        if self.dbName:
+            return self.dbName
+        if self.mode == self.BAR_MODE:
+            return MINUTE_DB_NAME
+        return TICK_DB_NAME
+
+    #----------------------------------------------------------------------
+    def openSymbol(self, symbol):
+        """载入合约的初始化数据，并打开回测数据流"""
+        vtSymbol = symbol.vtSymbol
+        dataClass = self.getDataClass()
+
+        data = None
+        if vtSymbol in self.historyDataDict:
+            data = self.historyDataDict[vtSymbol].slice(self.dataStartDate, self.dataEndDate)
+        elif self.dataCacheDir:
+            cache = HistoryCache(self.dataCacheDir)
+            data = cache.loadData(self.getDbName(), vtSymbol, dataClass,
+                                  self.dataStartDate, self.dataEndDate)
+            if data is None:
+                self.output(u'%s本地缓存和数据库都不可用' % vtSymbol)
+                symbol.stream = iter([])
+                return
+
+        # 列式数据按时间拆分后分块生成，内存映射的数组只有读取到的部分会进入内存
+        if data is not None:
+            initData, backtestingData = data.split(self.strategyStartDate)
+            symbol.initData = initData.toList()
+            symbol.stream = backtestingData.iterData(STREAM_CHUNK_SIZE)
+            return
+
+        # 直接读取数据库，初始化数据一次性读取，回测数据使用按时间排序的查询指针
+        if not self.dbClient:
+            host, port, logging = loadMongoSetting()
+            self.dbClient = pymongo.MongoClient(host, port)
+        collection = self.dbClient[self.getDbName()][vtSymbol]
+
+        flt = {'datetime': {'$gte': self.dataStartDate, '$lt': self.strategyStartDate}}
+        symbol.initData = list(self.iterCursor(collection.find(flt).sort('datetime', pymongo.ASCENDING),
+                                               dataClass))
+
+        flt = {'datetime': {'$gte': self.strategyStartDate}}
+        if self.dataEndDate:
+            flt['datetime']['$lte'] = self.dataEndDate
+        cursor = collection.find(flt).sort('datetime', pymongo.ASCENDING).batch_size(CURSOR_BATCH_SIZE)
+        symbol.stream = self.iterCursor(cursor, dataClass)
+
+    #----------------------------------------------------------------------
+    def iterCursor(self, cursor, dataClass):
+        """把数据库查询指针中的字典逐条转换为数据对象"""
+        for d in cursor:
+            data = dataClass()
+            data.__dict__ = d
+            yield data
+
+    #----------------------------------------------------------------------
+    def runBacktesting(self):
+        """运行回测"""
+        self.clearBacktestingResult()
+        self.barService.reset()
+
+        # 按策略的合约生成合约回放状态
+        self.symbolDict.clear()
+        for strategy in self.strategyDict.values():
+            if strategy.vtSymbol not in self.symbolDict:
+                size, rate, slippage = self.getSymbolParam(strategy.vtSymbol)
+                self.symbolDict[strategy.vtSymbol] = PortfolioSymbol(strategy.vtSymbol, size, rate, slippage)
+            symbol = self.symbolDict[strategy.vtSymbol]
+            symbol.strategyList.append(strategy)
+
+            self.strategyTradeDict[strategy.name] = []
+            self.settlementDict[strategy.name] = DailySettlement(symbol.size, symbol.rate, symbol.slippage)
+
+        self.output(u'开始载入数据，合约数量：%s' % len(self.symbolDict))
+        start = datetime.now()
+        for symbol in self.symbolDict.values():
+            self.openSymbol(symbol)
+        self.output(u'载入完成，耗时：%s' % (datetime.now() - start))
+
+        # 初始化并启动策略，之后释放初始化数据
+        for strategy in self.strategyDict.values():
+            strategy.inited = True
+            strategy.onInit()
+            strategy.trading = True
+            strategy.onStart()
+        for symbol in self.symbolDict.values():
+            symbol.initData = []
+            symbol.barStrategyList = [strategy for strategy in symbol.strategyList
+                                      if not self.barService.isSubscribed(strategy)]
+        self.output(u'策略初始化完成，策略数量：%s' % len(self.strategyDict))
+
+        self.output(u'开始回放数据')
+        if self.mode == self.BAR_MODE:
+            func = self.newBar
+        else:
+            func = self.newTick
+
+        # 多路归并：堆中为每个合约数据流的下一条数据(时间, 合约序号, 数据, 合约)，
+        # 时间相同时按合约序号排列，保证回放顺序确定
+        heap = []
+        for i, symbol in enumerate(self.symbolDict.values()):
+            data = next(symbol.stream, None)
+            if data is not None:
+                heap.append((data.datetime, i, data, symbol))
+        heapify(heap)
+
+        count = 0
+        while heap:
+            dt, i, data, symbol = heap[0]
+            func(symbol, data)
+            count += 1
+
+            data = next(symbol.stream, None)
+            if data is None:
+                heappop(heap)
+            else:
+                heapreplace(heap, (data.datetime, i, data, symbol))
+
+        for settlement in self.settlementDict.values():
+            settlement.finish()
+
+        self.output(u'数据回放结束，数据量：%s' % count)
+
+    #----------------------------------------------------------------------
+    def newBar(self, symbol, bar):
+        """新的K线"""
+        symbol.bar = bar
+        self.dt = bar.datetime
+
+        for strategy in symbol.strategyList:
+            self.settlementDict[strategy.name].updatePrice(bar.datetime, bar.close)
+
+        self.crossLimitOrder(symbol, bar.low, bar.high, bar.open, bar.open)   # 先撮合限价单
+        self.crossStopOrder(symbol, bar.high, bar.low, bar.open)              # 再撮合停止单
+
+        # 订阅了K线的策略和实盘一样只通过K线合成接收K线
+        self.barService.updateBar(symbol.vtSymbol, bar)
+        for strategy in symbol.barStrategyList:
+            strategy.onBar(bar)
+
+    #----------------------------------------------------------------------
+    def newTick(self, symbol, tick):
+        """新的Tick"""
+        symbol.tick = tick
+        self.dt = tick.datetime
+
+        for strategy in symbol.strategyList:
+            self.settlementDict[strategy.name].updatePrice(tick.datetime, tick.lastPrice)
+
+        self.crossLimitOrder(symbol, tick.askPrice1, tick.bidPrice1, tick.askPrice1, tick.bidPrice1)
+        self.crossStopOrder(symbol, tick.lastPrice, tick.lastPrice, tick.lastPrice)
+
+        self.barService.updateTick(symbol.vtSymbol, tick)
+        for strategy in symbol.strategyList:
+            strategy.onTick(tick)
+
+    #----------------------------------------------------------------------
+    def sendOrder(self, vtSymbol, orderType, price, volume, strategy):
+        """发单"""
+        self.limitOrderCount += 1
+        orderID = str(self.limitOrderCount)
+
+        order = VtOrderData()
+        order.vtSymbol = vtSymbol
+        order.price = price
+        order.totalVolume = volume
+        order.status = STATUS_NOTTRADED  # 刚提交尚未成交
+        order.orderID = orderID
+        order.vtOrderID = orderID
+        order.orderTime = str(self.dt)
+        order.direction, order.offset = getDirectionOffset(orderType)
+
+        # 保存到合约的限价单簿中，没有该合约的数据时委托不会成交
+        if vtSymbol in self.symbolDict:
+            self.symbolDict[vtSymbol].workingLimitOrderDict[orderID] = order
+            self.limitOrderBook.addOrder(order)
+        self.limitOrderDict[orderID] = order
+        self.orderStrategyDict[orderID] = strategy
+
+        return orderID
+
+    #----------------------------------------------------------------------
+    def cancelOrder(self, vtOrderID):
+        """撤单"""
+        order = self.limitOrderDict.get(vtOrderID, None)
+        if not order or order.vtSymbol not in self.symbolDict:
+            return
+
+        workingLimitOrderDict = self.symbolDict[order.vtSymbol].workingLimitOrderDict
+        if vtOrderID in workingLimitOrderDict:
+            order.status = STATUS_CANCELLED
+            order.cancelTime = str(self.dt)
+            del workingLimitOrderDict[vtOrderID]
+            self.limitOrderBook.cancelOrder(order)
+
+    #----------------------------------------------------------------------
+    def sendStopOrder(self, vtSymbol, orderType, price, volume, strategy):
+        """发停止单（本地实现）"""
+        self.stopOrderCount += 1
+        stopOrderID = STOPORDERPREFIX + str(self.stopOrderCount)
+
+        so = StopOrder()
+        so.vtSymbol = vtSymbol
+        so.price = price
+        so.volume = volume
+        so.strategy = strategy
+        so.stopOrderID = stopOrderID
+        so.status = STOPORDER_WAITING
+        so.direction, so.offset = getDirectionOffset(orderType)
+
+        self.stopOrderDict[stopOrderID] = so
+        self.workingStopOrderDict[stopOrderID] = so
+        self.stopOrderBook.addStopOrder(so)
+
+        return stopOrderID
+
+    #----------------------------------------------------------------------
+    def cancelStopOrder(self, stopOrderID):
+        """撤销停止单"""
+        if stopOrderID in self.workingStopOrderDict:
+            so = self.workingStopOrderDict[stopOrderID]
+            so.status = STOPORDER_CANCELLED
+            del self.workingStopOrderDict[stopOrderID]
+            self.stopOrderBook.cancelStopOrder(so)
+
+    #----------------------------------------------------------------------
+    def crossLimitOrder(self, symbol, buyCrossPrice, sellCrossPrice, buyBestCrossPrice, sellBestCrossPrice):
+        """
+        基于合约的最新数据撮合该合约的限价单
+        买入限价单价格高于buyCrossPrice、卖出限价单价格低于sellCrossPrice时成交，
+        成交价不差于委托发出时市场的最优价格（buyBestCrossPrice和sellBestCrossPrice）
+        """
+        for order in self.limitOrderBook.popCrossed(buyCrossPrice, sellCrossPrice, symbol.vtSymbol):
+            # 策略在之前成交的回调中可能已经撤销了该限价单
+            if order.status != STATUS_NOTTRADED:
+                continue
+
+            del symbol.workingLimitOrderDict[order.orderID]
+            strategy = self.orderStrategyDict[order.orderID]
+
+            if order.direction == DIRECTION_LONG:
+                price = min(order.price, buyBestCrossPrice)
+            else:
+                price = max(order.price, sellBestCrossPrice)
+            self.newTrade(strategy, order, price)
+
+            # 推送委托数据
+            order.tradedVolume = order.totalVolume
+            order.status = STATUS_ALLTRADED
+            strategy.onOrder(order)
+
+    #----------------------------------------------------------------------
+    def crossStopOrder(self, symbol, buyCrossPrice, sellCrossPrice, bestCrossPrice):
+        """
+        基于合约的最新数据撮合该合约的停止单
+        买入停止单价格低于buyCrossPrice、卖出停止单价格高于sellCrossPrice时触发，
+        成交价不优于bestCrossPrice
+        """
+        for so in self.stopOrderBook.popTriggered(buyCrossPrice, sellCrossPrice, symbol.vtSymbol):
+            # 策略在之前停止单的回调中可能已经撤销了该停止单
+            if so.status != STOPORDER_WAITING:
+                continue
+
+            self.limitOrderCount += 1
+            orderID = str(self.limitOrderCount)
+
+            order = VtOrderData()
+            order.vtSymbol = so.vtSymbol
+            order.symbol = so.vtSymbol
+            order.orderID = orderID
+            order.vtOrderID = orderID
+            order.direction = so.direction
+            order.offset = so.offset
+            order.price = so.price
+            order.totalVolume = so.volume
+            order.orderTime = str(self.dt)
+
+            if so.direction == DIRECTION_LONG:
+                price = max(bestCrossPrice, so.price)
+            else:
+                price = min(bestCrossPrice, so.price)
+            self.newTrade(so.strategy, order, price)
+
+            # 推送委托数据
+            so.status = STOPORDER_TRIGGERED
+            order.tradedVolume = so.volume
+            order.status = STATUS_ALLTRADED
+            so.strategy.onOrder(order)
+
+            self.limitOrderDict[orderID] = order
+            self.orderStrategyDict[orderID] = so.strategy
+            del self.workingStopOrderDict[so.stopOrderID]
+
+    #----------------------------------------------------------------------
+    def newTrade(self, strategy, order, price):
+        """委托全部成交，更新策略持仓并推送成交数据"""
+        self.tradeCount += 1
+        tradeID = str(self.tradeCount)
+
+        trade = VtTradeData()
+        trade.vtSymbol = order.vtSymbol
+        trade.tradeID = tradeID
+        trade.vtTradeID = tradeID
+        trade.orderID = order.orderID
+        trade.vtOrderID = order.orderID
+        trade.direction = order.direction
+        trade.offset = order.offset
+        trade.price = price
+        trade.volume = order.totalVolume
+        trade.tradeTime = str(self.dt)
+        trade.dt = self.dt
+
+        if trade.direction == DIRECTION_LONG:
+            strategy.pos += trade.volume
+        else:
+            strategy.pos -= trade.volume
+        strategy.onTrade(trade)
+
+        self.tradeDict[tradeID] = trade
+        self.strategyTradeDict[strategy.name].append(trade)
+        self.settlementDict[strategy.name].addTrade(trade.direction, trade.price, trade.volume)
+
+    #----------------------------------------------------------------------
+    def insertData(self, dbName, collectionName, data):
+        """考虑到回测中不允许向数据库插入数据，防止实盘交易中的一些代码出错"""
+        pass
+
+    #----------------------------------------------------------------------
+    def loadBar(self, dbName, collectionName, days):
+        """返回合约初始化数据列表中的Bar"""
+        if collectionName in self.symbolDict:
+            return self.symbolDict[collectionName].initData
+        return []
+
+    #----------------------------------------------------------------------
+    def loadTick(self, dbName, collectionName, days):
+        """返回合约初始化数据列表中的Tick"""
+        return self.loadBar(dbName, collectionName, days)
+
+    #----------------------------------------------------------------------
+    def subscribeBar(self, strategy, vtSymbol, period, func, indicatorList):
+        """订阅合约K线，同一合约、周期和指标参数在多个策略之间共享，返回BarFeed对象"""
+        return self.barService.subscribe(strategy, vtSymbol, period, func, indicatorList)
+
+    #----------------------------------------------------------------------
+    def updateHistoryBar(self, strategy, vtSymbol, barList):
+        """用初始化数据预热策略订阅的K线和指标（Tick模式下初始化数据为Tick）"""
+        self.barService.warmUp(strategy, vtSymbol, barList, self.mode != self.BAR_MODE)
+
+    #----------------------------------------------------------------------
+    def writeCtaLog(self, content):
+        """记录日志"""
+        log = str(self.dt) + ' ' + content
+        self.logList.append(log)
+
+    #----------------------------------------------------------------------
+    def putStrategyEvent(self, name):
+        """回测中没有界面需要更新"""
+        pass
+
+    #----------------------------------------------------------------------
+    def output(self, content):
+        """输出内容"""
+        print str(datetime.now()) + "\t" + content
+
+    #----------------------------------------------------------------------
+    def clearBacktestingResult(self):
+        """清空之前回测的委托、成交和结算结果"""
+        self.stopOrderCount = 0
+        self.stopOrderDict.clear()
+        self.workingStopOrderDict.clear()
+        self.stopOrderBook.clear()
+
+        self.limitOrderCount = 0
+        self.limitOrderDict.clear()
+        self.limitOrderBook.clear()
+        self.orderStrategyDict.clear()
+
+        self.tradeCount = 0
+        self.tradeDict.clear()
+        self.strategyTradeDict.clear()
+        self.settlementDict.clear()
+
+        self.logList = []
+        self.dt = None
+
+    #----------------------------------------------------------------------
+    def matchStrategyTrades(self, name):
+        """把策略的成交按合约配对为开平仓交易，返回按平仓时间排列的TradingResult列表"""
+        symbolTradeDict = OrderedDict()
+        for trade in self.strategyTradeDict.get(name, []):
+            symbolTradeDict.setdefault(trade.vtSymbol, []).append(trade)
+
+        resultList = []
+        for vtSymbol, tradeList in symbolTradeDict.items():
+            size, rate, slippage = self.getSymbolParam(vtSymbol)
+            resultList.extend(matchTrades(tradeList, rate, slippage, size))
+
+        if len(symbolTradeDict) > 1:
+            resultList.sort(key=lambda result: result.exitDt)
+        return resultList
+
+    #----------------------------------------------------------------------
+    def calculatePortfolioResult(self):
+        """
+        计算组合回测结果，返回字典：
+        strategyResultDict：各策略的交易结果（和BacktestingEngine.calculateBacktestingResult相同）
+        strategyDailyDict：各策略的逐日结算结果
+        portfolioResult：全部策略的交易合并后的交易结果
+        portfolioDaily：全部策略按日期汇总的逐日结算结果
+        """
+        self.output(u'计算组合回测结果')
+
+        strategyResultDict = OrderedDict()
+        strategyDailyDict = OrderedDict()
+        portfolioResultList = []
+
+        for name in self.strategyDict.keys():
+            resultList = self.matchStrategyTrades(name)
+            if resultList:
+                strategyResultDict[name] = calculateTradingStatistics(resultList)
+            else:
+                strategyResultDict[name] = {}
+            portfolioResultList.extend(resultList)
+
+            if name in self.settlementDict:
+                strategyDailyDict[name] = self.settlementDict[name].getResult()
+            else:
+                strategyDailyDict[name] = {}
+
+        d = {}
+        d['strategyResultDict'] = strategyResultDict
+        d['strategyDailyDict'] = strategyDailyDict
+        d['portfolioResult'] = {}
+        if portfolioResultList:
+            portfolioResultList.sort(key=lambda result: result.exitDt)
+            d['portfolioResult'] = calculateTradingStatistics(portfolioResultList)
+        d['portfolioDaily'] = combineDailyResult(strategyDailyDict.values())
+        return d
+
+    #----------------------------------------------------------------------
+    def showPortfolioResult(self):
+        """显示组合回测结果"""
+        d = self.calculatePortfolioResult()
+
+        self.output('-' * 30)
+        for name, result in d['strategyResultDict'].items():
+            daily = d['strategyDailyDict'][name]
+            if not result and not daily:
+                self.output(u'%s：无交易结果' % name)
+                continue
+            self.output(u'%s：平仓盈亏%s，交易%s次，胜率%s%%，逐日净盈亏%s，最大回撤%s' % (
+                name, formatNumber(result.get('capital', 0)), result.get('totalResult', 0),
+                formatNumber(result.get('winningRate', 0)), formatNumber(daily.get('totalNetPnl', 0)),
+                formatNumber(daily.get('maxDrawdown', 0))))
+
+        result = d['portfolioResult']
+        daily = d['portfolioDaily']
+        if not daily:
+            self.output(u'组合无交易结果')
+            return
+
+        self.output('-' * 30)
+        self.output(u'组合总交易次数：\t%s' % formatNumber(result.get('totalResult', 0)))
+        self.output(u'组合平仓盈亏：\t%s' % formatNumber(result.get('capital', 0)))
+        self.output(u'组合逐日净盈亏：\t%s' % formatNumber(daily['totalNetPnl']))
+        self.output(u'组合最大回撤: \t%s' % formatNumber(daily['maxDrawdown']))
+        self.output(u'组合总手续费：\t%s' % formatNumber(daily['totalCommission']))
+        self.output(u'组合总滑点：\t%s' % formatNumber(daily['totalSlippage']))
+        self.output(u'组合夏普比率：\t%s' % formatNumber(daily['sharpeRatio']))
+
+        # 绘图
+        import matplotlib.pyplot as plt
+
+        pCapital = plt.subplot(2, 1, 1)
+        pCapital.set_ylabel("capital")
+        pCapital.plot(daily['dateList'], daily['capitalArray'])
+
+        pDD = plt.subplot(2, 1, 2)
+        pDD.set_ylabel("DD")
+        pDD.fill_between(daily['dateList'], daily['drawdownArray'], 0)
+
+        plt.show()
+
+
+#----------------------------------------------------------------------
+def getDirectionOffset(orderType):
+    """CTA委托类型映射为(方向, 开平)"""
+    if orderType == CTAORDER_BUY:
+        return DIRECTION_LONG, OFFSET_OPEN
+    elif orderType == CTAORDER_SELL:
+        return DIRECTION_SHORT, OFFSET_CLOSE
+    elif orderType == CTAORDER_SHORT:
+        return DIRECTION_SHORT, OFFSET_OPEN
+    else:
+        return DIRECTION_LONG, OFFSET_CLOSE
@@ -0,0 +1,122 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了回测K线模式中指标预计算使用的向量化函数。
+
+策略通常在每根K线到来时对最近bufferSize根K线的窗口调用talib，取结果的最后一个
+数值，每根K线的计算量和窗口长度成正比。回测时全部K线预先已知，可以一次性计算出
+每根K线对应的指标数值（即指标列），策略在onBar中直接读取当前K线的那一行。
+
+注意RSI、ATR等递推指标的数值和计算起点有关，对整个序列调用一次talib的结果和对
+每个窗口分别调用的结果并不相同。本文件中的window函数按talib的计算步骤，对所有
+窗口同时递推（每一步都是对全部窗口的一次数组运算，循环次数等于窗口长度，和K线数量
+无关），结果和逐个窗口调用talib取最后一个数值完全一致：
+1. 窗口w中第j个数据对所有窗口构成的数组为values[j:j+窗口数量]，不需要复制数据
+2. 加减乘除的顺序和talib的C代码一致，保证浮点结果逐位相同
+3. 返回的数组长度和输入相同，第i项为以第i个数据结尾的窗口的指标值，窗口不完整
+   或者窗口中含有NaN时为NaN
+
+策略本身使用整个序列计算指标时（不截取窗口），直接对整个数组调用talib即可。
+'''
+
+import numpy as np
+
+from ctaIndicator import ZERO_THRESHOLD
+
+
+#----------------------------------------------------------------------
+def getWindowColumn(array, window, j):
+    """获取所有窗口中的第j个数据组成的数组（第k个窗口为array[k:k+window]）"""
+    return array[j:len(array) - window + 1 + j]
+
+
+#----------------------------------------------------------------------
+def makeResult(array, window, value):
+    """生成和输入等长的结果数组，value为各个窗口的指标值，不完整的窗口为NaN"""
+    result = np.empty(len(array))
+    result.fill(np.nan)
+    if len(value):
+        result[window - 1:] = value
+    return result
+
+
+#----------------------------------------------------------------------
+def windowSma(values, period, window):
+    """对每个窗口计算talib.SMA(窗口, period)[-1]（talib.MA默认也是SMA）"""
+    values = np.asarray(values, dtype=float)
+    if len(values) < window:
+        return makeResult(values, window, [])
+
+    # talib先累加前period-1个数据，之后每次加上新数据、记录结果、再减去最早的数据
+    total = np.zeros(len(values) - window + 1)
+    for j in range(period - 1):
+        total = total + getWindowColumn(values, window, j)
+
+    for j in range(period - 1, window):
+        total = total + getWindowColumn(values, window, j)
+        value = total
+        total = total - getWindowColumn(values, window, j - period + 1)
+
+    return makeResult(values, window, value / period)
+
+
+#----------------------------------------------------------------------
+def windowAtr(high, low, close, period, window):
+    """对每个窗口计算talib.ATR(最高, 最低, 收盘, period)[-1]"""
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    if len(close) < window:
+        return makeResult(close, window, [])
+
+    #----------------------------------------------------------------------
+    def getTrueRange(j):
+        """所有窗口中第j个数据的真实波幅（和talib.TRANGE的比较顺序一致）"""
+        h = getWindowColumn(high, window, j)
+        l = getWindowColumn(low, window, j)
+        c = getWindowColumn(close, window, j - 1)
+        return np.maximum(np.maximum(h - l, np.abs(c - h)), np.abs(c - l))
+
+    if period <= 1:
+        return makeResult(close, window, getTrueRange(window - 1))
+
+    # 第一个数值为前period个真实波幅的简单平均，之后为Wilder平滑递推
+    total = getTrueRange(1)
+    for j in range(2, period + 1):
+        total = total + getTrueRange(j)
+    atr = total / period
+
+    for j in range(period + 1, window):
+        atr = (atr * (period - 1) + getTrueRange(j)) / period
+
+    return makeResult(close, window, atr)
+
+
+#----------------------------------------------------------------------
+def windowRsi(close, period, window):
+    """对每个窗口计算talib.RSI(收盘, period)[-1]"""
+    close = np.asarray(close, dtype=float)
+    if len(close) < window:
+        return makeResult(close, window, [])
+
+    # 前period个涨跌的累计值取平均，之后为Wilder平滑递推
+    gain = np.zeros(len(close) - window + 1)
+    loss = np.zeros(len(close) - window + 1)
+    for j in range(1, period + 1):
+        diff = getWindowColumn(close, window, j) - getWindowColumn(close, window, j - 1)
+        loss = loss - np.minimum(diff, 0)
+        gain = gain + np.maximum(diff, 0)
+    loss = loss / period
+    gain = gain / period
+
+    for j in range(period + 1, window):
+        diff = getWindowColumn(close, window, j) - getWindowColumn(close, window, j - 1)
+        loss = (loss * (period - 1) - np.minimum(diff, 0)) / period
+        gain = (gain * (period - 1) + np.maximum(diff, 0)) / period
+
+    # 涨跌合计为0时talib的结果为0
+    total = gain + loss
+    zero = np.abs(total) < ZERO_THRESHOLD
+    rsi = 100.0 * (gain / np.where(zero, 1.0, total))
+    rsi[zero] = 0.0
+    return makeResult(close, window, rsi)
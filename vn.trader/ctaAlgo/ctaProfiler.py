@@ -0,0 +1,208 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了回测引擎的性能分析工具。
+
+回测很慢时需要知道时间花在哪里：数据库读取和解码、限价单撮合、停止单撮合、
+策略回调（如其中的talib计算）还是日志格式化。性能分析工具：
+1. 把需要计时的函数替换为带计时的包装函数（只替换对象自身的属性，关闭时删除，
+   未启用时回测没有任何额外开销）
+2. 每个阶段记录调用次数、总耗时、最大耗时，以及按2的幂次（微秒）划分的耗时
+   直方图，用于估计中位数和99%分位数
+3. 可选地只在策略回调期间启用cProfile，输出策略代码内部的函数耗时
+'''
+
+from __future__ import division
+
+import cProfile
+import pstats
+from collections import OrderedDict
+from timeit import default_timer
+
+
+HISTOGRAM_SIZE = 32             # 直方图的区间数量，第i个区间为[2^(i-1), 2^i)微秒
+STRATEGY_CALLBACK_LIST = ['onPrecompute', 'onInit', 'onStart', 'onBar', 'onTick', 'onOrder', 'onTrade']
+
+
+########################################################################
+class PhaseTimer(object):
+    """单个阶段的耗时统计"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, name):
+        """Constructor"""
+        self.name = name
+        self.count = 0                  # 调用次数
+        self.total = 0                  # 总耗时（秒）
+        self.max = 0                    # 最大耗时（秒）
+        self.histogram = [0] * HISTOGRAM_SIZE
+
+    #----------------------------------------------------------------------
+    def add(self, elapsed):
+        """记录一次耗时"""
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+        i = int(elapsed * 1000000).bit_length()
+        if i >= HISTOGRAM_SIZE:
+            i = HISTOGRAM_SIZE - 1
+        self.histogram[i] += 1
+
+    #----------------------------------------------------------------------
+    def getPercentile(self, percent):
+        """根据直方图估计分位数（秒），返回所在区间的上限"""
+        if not self.count:
+            return 0
+
+        target = self.count * percent / 100
+        n = 0
+        for i, count in enumerate(self.histogram):
+            n += count
+            if n >= target:
+                return min(2 ** i / 1000000, self.max)
+        return self.max
+
+
+########################################################################
+class BacktestingProfiler(object):
+    """回测性能分析"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, profileStrategy=False):
+        """Constructor，profileStrategy为True时在策略回调期间启用cProfile"""
+        self.timerDict = OrderedDict()
+        self.profile = None
+        if profileStrategy:
+            self.profile = cProfile.Profile()
+
+        self.wrappedList = []           # 被替换的(对象, 属性名)
+
+    #----------------------------------------------------------------------
+    def getTimer(self, name):
+        """获取阶段的计时对象，不存在则创建"""
+        try:
+            return self.timerDict[name]
+        except KeyError:
+            timer = PhaseTimer(name)
+            self.timerDict[name] = timer
+            return timer
+
+    #----------------------------------------------------------------------
+    def wrap(self, obj, attrName, name=None, profile=False):
+        """把对象的方法替换为带计时的包装函数，profile为True时同时在调用期间启用cProfile"""
+        func = getattr(obj, attrName)
+        timer = self.getTimer(name or attrName)
+        add = timer.add
+        clock = default_timer
+        prof = self.profile if profile else None
+
+        if prof:
+            def wrapper(*args, **kwargs):
+                start = clock()
+                prof.enable()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    prof.disable()
+                    add(clock() - start)
+        else:
+            # 抛出异常时回测已经中断，不需要计时
+            def wrapper(*args, **kwargs):
+                start = clock()
+                result = func(*args, **kwargs)
+                add(clock() - start)
+                return result
+
+        setattr(obj, attrName, wrapper)
+        self.wrappedList.append((obj, attrName))
+
+    #----------------------------------------------------------------------
+    def wrapStrategy(self, strategy):
+        """替换策略的回调函数，计时名称为strategy.回调名"""
+        for attrName in STRATEGY_CALLBACK_LIST:
+            if hasattr(strategy, attrName):
+                self.wrap(strategy, attrName, 'strategy.' + attrName, True)
+
+    #----------------------------------------------------------------------
+    def unwrap(self, obj=None):
+        """恢复被替换的方法（删除对象自身的属性），obj为None时恢复全部"""
+        l = []
+        for wrappedObj, attrName in self.wrappedList:
+            if obj is None or wrappedObj is obj:
+                try:
+                    delattr(wrappedObj, attrName)
+                except AttributeError:
+                    pass
+            else:
+                l.append((wrappedObj, attrName))
+        self.wrappedList = l
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空统计结果"""
+        self.timerDict.clear()
+        if self.profile:
+            self.profile = cProfile.Profile()
+
+    #----------------------------------------------------------------------
+    def getReport(self, totalName=None):
+        """
+        获取统计结果列表，每项为字典（名称、次数、总耗时、占比、平均、中位数、
+        99%分位数和最大耗时，时间单位为秒），占比相对于totalName阶段的总耗时
+        """
+        total = 0
+        if totalName in self.timerDict:
+            total = self.timerDict[totalName].total
+
+        l = []
+        for timer in self.timerDict.values():
+            d = OrderedDict()
+            d['name'] = timer.name
+            d['count'] = timer.count
+            d['total'] = timer.total
+            d['percent'] = timer.total / total * 100 if total else 0
+            d['average'] = timer.total / timer.count if timer.count else 0
+            d['p50'] = timer.getPercentile(50)
+            d['p99'] = timer.getPercentile(99)
+            d['max'] = timer.max
+            l.append(d)
+        return l
+
+    #----------------------------------------------------------------------
+    def printReport(self, output, totalName=None, extraList=None):
+        """
+        通过output函数输出统计表格（不显示没有调用过的阶段），extraList为额外的
+        (名称, 总耗时)列表（如由多个阶段相减得到的耗时），显示在表格末尾
+        """
+        report = self.getReport(totalName)
+        total = 0
+        if totalName in self.timerDict:
+            total = self.timerDict[totalName].total
+
+        output(u'%-28s%10s%10s%8s%12s%12s%12s%12s' % (u'阶段', u'次数', u'总耗时(s)', u'占比%',
+                                                     u'平均(us)', u'中位数(us)', u'P99(us)', u'最大(us)'))
+        for d in report:
+            if not d['count']:
+                continue
+            output(u'%-28s%10d%10.3f%8.1f%12.1f%12.1f%12.1f%12.1f' % (
+                d['name'], d['count'], d['total'], d['percent'], d['average'] * 1000000,
+                d['p50'] * 1000000, d['p99'] * 1000000, d['max'] * 1000000))
+
+        for name, elapsed in extraList or []:
+            percent = elapsed / total * 100 if total else 0
+            output(u'%-28s%10s%10.3f%8.1f' % (name, '-', elapsed, percent))
+
+    #----------------------------------------------------------------------
+    def printStats(self, sortKey='cumulative', count=30):
+        """打印策略回调期间cProfile统计的耗时最多的函数"""
+        if self.profile:
+            stats = pstats.Stats(self.profile)
+            stats.sort_stats(sortKey).print_stats(count)
+
+    #----------------------------------------------------------------------
+    def dumpStats(self, fileName):
+        """把策略回调期间的cProfile统计结果保存到文件（可用pstats或者snakeviz查看）"""
+        if self.profile:
+            self.profile.dump_stats(fileName)
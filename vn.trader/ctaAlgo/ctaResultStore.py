@@ -0,0 +1,171 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了回测结果的持久化缓存。
+
+调整参数优化的范围后，之前已经回测过的参数组合会被重复运行。结果缓存以
+下列内容的哈希作为key保存calculateBacktestingResult返回的结果字典：
+1. 策略类（及其父类）的源代码
+2. 策略参数
+3. 回测引擎的设置（模式、滑点、手续费、合约大小、策略启动日期）
+4. 回测数据的指纹（由回测引擎计算）
+策略代码、参数、设置或者数据任何一项改变都会得到不同的key，不会误用旧结果。
+
+缓存目录结构：缓存目录/策略类名/key.pkl，并行优化的多个进程可以同时读写。
+缓存文件数量超过上限时按最近使用时间删除最旧的结果。
+'''
+
+import os
+import shutil
+import hashlib
+import inspect
+import cPickle
+
+from ctaHistoryCache import replaceFile
+
+
+EVICT_CHECK_INTERVAL = 100      # 每写入多少个结果检查一次缓存数量
+
+
+########################################################################
+class BacktestResultStore(object):
+    """回测结果缓存"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, storeDir, maxCount=10000):
+        """Constructor"""
+        self.storeDir = storeDir
+        self.maxCount = maxCount        # 缓存结果数量上限，0表示不限
+
+        self.sourceHashDict = {}        # 策略类源代码的哈希，key为策略类
+        self.putCount = 0
+        self.hitCount = 0               # 命中次数
+        self.missCount = 0              # 未命中次数
+
+    #----------------------------------------------------------------------
+    def getSourceHash(self, strategyClass):
+        """计算策略类及其父类源代码的哈希，无法获取源代码时使用类名"""
+        try:
+            return self.sourceHashDict[strategyClass]
+        except KeyError:
+            pass
+
+        h = hashlib.sha1()
+        for cls in inspect.getmro(strategyClass):
+            if cls is object:
+                continue
+            try:
+                source = inspect.getsource(cls)
+            except (IOError, TypeError):
+                source = '%s.%s' % (cls.__module__, cls.__name__)
+            if isinstance(source, unicode):
+                source = source.encode('utf-8')
+            h.update(source)
+
+        sourceHash = h.hexdigest()
+        self.sourceHashDict[strategyClass] = sourceHash
+        return sourceHash
+
+    #----------------------------------------------------------------------
+    def makeKey(self, strategyClass, setting, engineSetting, fingerprint):
+        """
+        生成结果的key
+        setting为策略参数字典，engineSetting为回测引擎设置的字典，fingerprint为数据指纹
+        """
+        h = hashlib.sha1()
+        h.update(self.getSourceHash(strategyClass))
+        h.update(repr(sorted((setting or {}).items())))
+        h.update(repr(sorted(engineSetting.items())))
+        h.update(fingerprint)
+        return h.hexdigest()
+
+    #----------------------------------------------------------------------
+    def getPath(self, strategyClass, key):
+        """获取结果文件的路径"""
+        return os.path.join(self.storeDir, strategyClass.__name__, key + '.pkl')
+
+    #----------------------------------------------------------------------
+    def get(self, strategyClass, key):
+        """读取结果，不存在时返回None"""
+        fileName = self.getPath(strategyClass, key)
+        try:
+            with open(fileName, 'rb') as f:
+                d = cPickle.load(f)
+        except Exception:
+            self.missCount += 1
+            return None
+
+        # 更新文件时间，淘汰时按最近使用时间排序
+        try:
+            os.utime(fileName, None)
+        except OSError:
+            pass
+
+        self.hitCount += 1
+        return d
+
+    #----------------------------------------------------------------------
+    def put(self, strategyClass, key, d):
+        """保存结果（先写入临时文件再替换，防止其他进程读到不完整的内容）"""
+        fileName = self.getPath(strategyClass, key)
+        path = os.path.dirname(fileName)
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                pass        # 其他进程已经创建
+
+        tempFile = fileName + '.tmp%s' % os.getpid()
+        with open(tempFile, 'wb') as f:
+            cPickle.dump(d, f, cPickle.HIGHEST_PROTOCOL)
+        replaceFile(tempFile, fileName)
+
+        self.putCount += 1
+        if self.putCount % EVICT_CHECK_INTERVAL == 0:
+            self.evict()
+
+    #----------------------------------------------------------------------
+    def evict(self):
+        """缓存数量超过上限时删除最近最少使用的结果，返回删除的数量"""
+        if not self.maxCount or not os.path.exists(self.storeDir):
+            return 0
+
+        l = []
+        for path, dirList, fileList in os.walk(self.storeDir):
+            for name in fileList:
+                if name.endswith('.pkl'):
+                    fileName = os.path.join(path, name)
+                    try:
+                        l.append((os.path.getmtime(fileName), fileName))
+                    except OSError:
+                        pass
+
+        count = len(l) - self.maxCount
+        if count <= 0:
+            return 0
+
+        l.sort()
+        for mtime, fileName in l[:count]:
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+        return count
+
+    #----------------------------------------------------------------------
+    def invalidate(self, strategyClass=None):
+        """删除缓存的结果，strategyClass为None时删除全部结果"""
+        if strategyClass is None:
+            path = self.storeDir
+            self.sourceHashDict.clear()
+        else:
+            path = os.path.join(self.storeDir, strategyClass.__name__)
+            self.sourceHashDict.pop(strategyClass, None)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    #----------------------------------------------------------------------
+    def getStats(self):
+        """获取命中统计，返回(命中次数, 未命中次数)"""
+        return self.hitCount, self.missCount
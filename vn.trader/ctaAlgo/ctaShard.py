@@ -0,0 +1,482 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了多进程分片运行的CTA策略引擎。
+
+单进程模式下所有策略都运行在同一个事件引擎线程中，某个策略的onBar较慢
+（例如调用talib计算大量指标）时会拖慢所有其他策略。分片模式下：
+
+1. 主进程中的ShardedCtaEngine读取CTA_setting.json，把策略分配到若干个
+   工作进程中（交易同一个vtSymbol的策略尽量放在同一个进程，减少行情转发）
+2. 主进程把EVENT_TICK按照vtSymbol转发给对应的工作进程，EVENT_ORDER、
+   EVENT_TRADE、EVENT_POSITION广播给所有工作进程（由工作进程中的CtaEngine
+   根据委托号和合约自行过滤）
+3. 工作进程中运行独立的EventEngine2和CtaEngine，策略代码无需修改；
+   CtaEngine对mainEngine的调用（查询合约、订阅、发单、撤单、读写数据库）
+   通过本地管道转发回主进程执行，因此发单依然经过MainEngine.sendOrder
+   和RmEngine.checkRisk的风控检查
+4. 策略日志和状态更新事件转发回主进程的事件引擎，界面显示保持不变
+5. 工作进程载入策略后通过ctlConn返回载入成功的策略名称，主进程收到后才登记
+   这些策略并开始转发行情，载入失败或者工作进程没有响应的策略不会登记
+
+进程间通信使用multiprocessing的Queue和Pipe（Linux下为Unix socket，
+Windows下为命名管道），每个工作进程使用三条通道：
+eventQueue：主进程到工作进程的事件推送（单向，非阻塞写入）
+rpcConn：工作进程到主进程的mainEngine调用请求（请求-应答）
+ctlConn：主进程到工作进程的策略管理调用（初始化、启动、停止、查询参数变量）
+'''
+
+import json
+import multiprocessing
+import traceback
+from collections import OrderedDict
+from threading import Thread, Lock
+
+from ctaBase import *
+from ctaSetting import STRATEGY_CLASS
+from ctaEngine import CtaEngine
+from eventEngine import *
+from vtGateway import VtLogData
+
+
+# 工作进程可以调用的mainEngine函数
+SHARD_RPC_FUNCTIONS = ['getContract', 'getOrder', 'subscribe', 'sendOrder',
+                       'cancelOrder', 'dbInsert', 'dbQuery']
+
+# 主进程可以调用的工作进程CtaEngine函数
+SHARD_CTL_FUNCTIONS = ['initStrategy', 'startStrategy', 'stopStrategy',
+                       'getStrategyVar', 'getStrategyParam']
+
+# 等待工作进程载入策略的超时秒数
+SHARD_START_TIMEOUT = 60
+
+
+########################################################################
+class ShardedCtaEngine(object):
+    """多进程分片运行的CTA策略引擎（运行在主进程中）"""
+    settingFileName = CtaEngine.settingFileName
+
+    #----------------------------------------------------------------------
+    def __init__(self, mainEngine, eventEngine, shardCount):
+        """Constructor"""
+        self.mainEngine = mainEngine
+        self.eventEngine = eventEngine
+
+        self.shardCount = max(int(shardCount), 1)     # 工作进程数量
+
+        # 保存策略名称和工作进程编号映射的字典
+        # key为策略名称，value为工作进程编号
+        self.strategyDict = OrderedDict()
+
+        # 保存vtSymbol和工作进程映射的字典（用于转发tick数据）
+        # key为vtSymbol，value为工作进程编号的集合
+        self.tickShardDict = {}
+
+        # 工作进程字典，key为工作进程编号，value为CtaShard对象
+        self.shardDict = OrderedDict()
+
+        # 调用mainEngine时使用的锁，保证各个工作进程的请求串行执行
+        self.rpcLock = Lock()
+
+        # 注册事件监听
+        self.registerEvent()
+
+    #----------------------------------------------------------------------
+    def loadSetting(self):
+        """读取策略配置，分配到工作进程并启动"""
+        if self.shardDict:
+            self.writeCtaLog(u'分片引擎已经启动，请勿重复加载策略')
+            return
+
+        with open(self.settingFileName) as f:
+            l = json.load(f)
+
+        settingListDict = self.assignShard(l)
+
+        # 先启动所有工作进程，工作进程载入策略时查询合约等请求由各自的线程处理
+        shardList = []
+        for shardID in range(self.shardCount):
+            settingList = settingListDict[shardID]
+            if not settingList:
+                continue
+
+            shard = CtaShard(shardID, settingList)
+            shard.start()
+            shardList.append((shard, settingList))
+
+            # 启动处理该工作进程请求的线程
+            thread = Thread(target=self.serveShard, args=(shard,))
+            thread.daemon = True
+            thread.start()
+
+        # 工作进程确认载入成功的策略才登记到引擎中
+        for shard, settingList in shardList:
+            nameList = shard.waitReady()
+            if nameList is None:
+                self.writeCtaLog(u'CTA工作进程%s启动失败，策略：%s'
+                                 %(shard.shardID, u','.join([s['name'] for s in settingList])))
+                shard.stop()
+                continue
+
+            for setting in settingList:
+                if setting['name'] in nameList:
+                    self.registerStrategy(shard.shardID, setting)
+                else:
+                    self.writeCtaLog(u'CTA工作进程%s载入策略失败：%s' %(shard.shardID, setting['name']))
+
+            # 没有载入成功的策略时关闭工作进程
+            if not nameList:
+                shard.stop()
+                continue
+
+            self.shardDict[shard.shardID] = shard
+            self.writeCtaLog(u'CTA工作进程%s启动，策略：%s'
+                             %(shard.shardID, u','.join(nameList)))
+
+    #----------------------------------------------------------------------
+    def assignShard(self, l):
+        """
+        把策略配置分配到工作进程，返回key为工作进程编号，value为配置列表的字典
+        配置中可以用shard字段指定工作进程，否则按照vtSymbol分组后
+        分配给当前策略数量最少的工作进程
+        """
+        settingListDict = dict([(i, []) for i in range(self.shardCount)])
+        symbolDict = OrderedDict()      # key为vtSymbol，value为未指定工作进程的配置列表
+        nameSet = set()                 # 已分配的策略名称
+
+        for setting in l:
+            try:
+                name = setting['name']
+                className = setting['className']
+            except Exception, e:
+                self.writeCtaLog(u'载入策略出错：%s' %e)
+                continue
+
+            if className not in STRATEGY_CLASS:
+                self.writeCtaLog(u'找不到策略类：%s' %className)
+                continue
+
+            if name in nameSet:
+                self.writeCtaLog(u'策略实例重名：%s' %name)
+                continue
+            nameSet.add(name)
+
+            if 'shard' in setting:
+                settingListDict[int(setting['shard']) % self.shardCount].append(setting)
+            else:
+                symbolDict.setdefault(setting.get('vtSymbol', EMPTY_STRING), []).append(setting)
+
+        # 策略数量多的合约优先分配
+        for vtSymbol, settingList in sorted(symbolDict.items(), key=lambda item: -len(item[1])):
+            shardID = min(settingListDict, key=lambda i: len(settingListDict[i]))
+            settingListDict[shardID].extend(settingList)
+
+        return settingListDict
+
+    #----------------------------------------------------------------------
+    def registerStrategy(self, shardID, setting):
+        """登记工作进程中载入成功的策略，并开始转发该策略合约的行情"""
+        self.strategyDict[setting['name']] = shardID
+        self.tickShardDict.setdefault(setting.get('vtSymbol', EMPTY_STRING), set()).add(shardID)
+
+    #----------------------------------------------------------------------
+    def serveShard(self, shard):
+        """处理工作进程的mainEngine调用请求（运行在单独线程中）"""
+        conn = shard.rpcConn
+
+        while True:
+            try:
+                funcName, args, needReply = conn.recv()
+            except (EOFError, IOError):
+                break
+
+            result = None
+            try:
+                if funcName == 'putEvent':
+                    self.eventEngine.put(args[0])
+                elif funcName in SHARD_RPC_FUNCTIONS:
+                    with self.rpcLock:
+                        result = getattr(self.mainEngine, funcName)(*args)
+
+                    # 数据库查询指针无法跨进程传递，转换为列表
+                    if funcName == 'dbQuery' and result is not None:
+                        result = list(result)
+                else:
+                    self.writeCtaLog(u'CTA工作进程%s调用了不支持的函数：%s' %(shard.shardID, funcName))
+            except Exception:
+                self.writeCtaLog(u'CTA工作进程%s调用%s出错：\n%s'
+                                 %(shard.shardID, funcName, traceback.format_exc()))
+
+            if needReply:
+                conn.send(result)
+
+    #----------------------------------------------------------------------
+    def processTickEvent(self, event):
+        """转发行情推送到交易该合约的工作进程"""
+        tick = event.dict_['data']
+
+        if tick.vtSymbol in self.tickShardDict:
+            for shardID in self.tickShardDict[tick.vtSymbol]:
+                if shardID in self.shardDict:
+                    self.shardDict[shardID].put(event)
+
+    #----------------------------------------------------------------------
+    def processBroadcastEvent(self, event):
+        """广播委托、成交、持仓推送到所有工作进程"""
+        for shard in self.shardDict.values():
+            shard.put(event)
+
+    #----------------------------------------------------------------------
+    def registerEvent(self):
+        """注册事件监听"""
+        self.eventEngine.register(EVENT_TICK, self.processTickEvent)
+        self.eventEngine.register(EVENT_ORDER, self.processBroadcastEvent)
+        self.eventEngine.register(EVENT_TRADE, self.processBroadcastEvent)
+        self.eventEngine.register(EVENT_POSITION, self.processBroadcastEvent)
+
+    #----------------------------------------------------------------------
+    def callShard(self, name, funcName, *args):
+        """调用策略所在工作进程中CtaEngine的函数"""
+        shardID = self.strategyDict.get(name, None)
+        if shardID not in self.shardDict:
+            self.writeCtaLog(u'策略实例不存在：%s' %name)
+            return None
+
+        return self.shardDict[shardID].call(funcName, name, *args)
+
+    #----------------------------------------------------------------------
+    def initStrategy(self, name):
+        """初始化策略"""
+        self.callShard(name, 'initStrategy')
+
+    #----------------------------------------------------------------------
+    def startStrategy(self, name):
+        """启动策略"""
+        self.callShard(name, 'startStrategy')
+
+    #----------------------------------------------------------------------
+    def stopStrategy(self, name):
+        """停止策略"""
+        self.callShard(name, 'stopStrategy')
+
+    #----------------------------------------------------------------------
+    def getStrategyVar(self, name):
+        """获取策略当前的变量字典"""
+        return self.callShard(name, 'getStrategyVar')
+
+    #----------------------------------------------------------------------
+    def getStrategyParam(self, name):
+        """获取策略的参数字典"""
+        return self.callShard(name, 'getStrategyParam')
+
+    #----------------------------------------------------------------------
+    def writeCtaLog(self, content):
+        """快速发出CTA模块日志事件"""
+        log = VtLogData()
+        log.logContent = content
+        event = Event(type_=EVENT_CTA_LOG)
+        event.dict_['data'] = log
+        self.eventEngine.put(event)
+
+    #----------------------------------------------------------------------
+    def stop(self):
+        """停止所有工作进程"""
+        for shard in self.shardDict.values():
+            shard.stop()
+        self.shardDict.clear()
+
+
+########################################################################
+class CtaShard(object):
+    """工作进程的句柄（运行在主进程中）"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, shardID, settingList):
+        """Constructor"""
+        self.shardID = shardID
+
+        self.eventQueue = multiprocessing.Queue()
+        self.rpcConn, self.rpcChildConn = multiprocessing.Pipe()
+        self.ctlConn, self.ctlChildConn = multiprocessing.Pipe()
+        self.ctlLock = Lock()
+
+        self.process = multiprocessing.Process(target=runShardWorker,
+                                               args=(shardID, settingList, self.eventQueue,
+                                                     self.rpcChildConn, self.ctlChildConn))
+        self.process.daemon = True
+
+    #----------------------------------------------------------------------
+    def start(self):
+        """启动工作进程，之后关闭主进程中的子进程管道端，工作进程退出时管道读取会立即返回"""
+        self.process.start()
+        self.rpcChildConn.close()
+        self.ctlChildConn.close()
+
+    #----------------------------------------------------------------------
+    def waitReady(self, timeout=SHARD_START_TIMEOUT):
+        """等待工作进程载入策略，返回载入成功的策略名称列表，超时或者工作进程退出时返回None"""
+        with self.ctlLock:
+            try:
+                if not self.ctlConn.poll(timeout):
+                    return None
+                return self.ctlConn.recv()
+            except (EOFError, IOError):
+                return None
+
+    #----------------------------------------------------------------------
+    def put(self, event):
+        """推送事件到工作进程，multiprocessing.Queue在后台线程写入，不会阻塞"""
+        self.eventQueue.put(event)
+
+    #----------------------------------------------------------------------
+    def call(self, funcName, *args):
+        """调用工作进程中CtaEngine的函数并等待返回"""
+        with self.ctlLock:
+            self.ctlConn.send((funcName, args))
+            return self.ctlConn.recv()
+
+    #----------------------------------------------------------------------
+    def stop(self):
+        """停止工作进程"""
+        self.eventQueue.put(None)
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+########################################################################
+class ShardMainEngineProxy(object):
+    """
+    工作进程中的主引擎代理
+    实现CtaEngine用到的mainEngine函数，通过管道转发到主进程执行
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, rpcConn):
+        """Constructor"""
+        self.rpcConn = rpcConn
+        self.rpcLock = Lock()       # 事件线程和管理线程都可能发出请求
+
+        self.contractDict = {}      # 合约缓存，key为vtSymbol
+
+    #----------------------------------------------------------------------
+    def call(self, funcName, args, needReply=True):
+        """发出调用请求"""
+        with self.rpcLock:
+            self.rpcConn.send((funcName, args, needReply))
+            if needReply:
+                return self.rpcConn.recv()
+
+    #----------------------------------------------------------------------
+    def getContract(self, vtSymbol):
+        """查询合约，查询成功后缓存在本地"""
+        contract = self.contractDict.get(vtSymbol, None)
+        if not contract:
+            contract = self.call('getContract', (vtSymbol,))
+            if contract:
+                self.contractDict[vtSymbol] = contract
+        return contract
+
+    #----------------------------------------------------------------------
+    def getOrder(self, vtOrderID):
+        """查询委托"""
+        return self.call('getOrder', (vtOrderID,))
+
+    #----------------------------------------------------------------------
+    def subscribe(self, subscribeReq, gatewayName):
+        """订阅行情"""
+        self.call('subscribe', (subscribeReq, gatewayName), False)
+
+    #----------------------------------------------------------------------
+    def sendOrder(self, orderReq, gatewayName):
+        """发单，需要等待主进程返回委托号"""
+        return self.call('sendOrder', (orderReq, gatewayName))
+
+    #----------------------------------------------------------------------
+    def cancelOrder(self, cancelOrderReq, gatewayName):
+        """撤单"""
+        self.call('cancelOrder', (cancelOrderReq, gatewayName), False)
+
+    #----------------------------------------------------------------------
+    def dbInsert(self, dbName, collectionName, d):
+        """插入数据库"""
+        self.call('dbInsert', (dbName, collectionName, d), False)
+
+    #----------------------------------------------------------------------
+    def dbQuery(self, dbName, collectionName, d):
+        """查询数据库，返回数据列表"""
+        return self.call('dbQuery', (dbName, collectionName, d))
+
+    #----------------------------------------------------------------------
+    def putEvent(self, event):
+        """把事件推送到主进程的事件引擎"""
+        self.call('putEvent', (event,), False)
+
+
+########################################################################
+class ShardCtaEngine(CtaEngine):
+    """工作进程中的CTA引擎，日志和策略状态事件转发到主进程"""
+
+    #----------------------------------------------------------------------
+    def writeCtaLog(self, content):
+        """发出CTA模块日志事件到主进程"""
+        log = VtLogData()
+        log.logContent = content
+        event = Event(type_=EVENT_CTA_LOG)
+        event.dict_['data'] = log
+        self.mainEngine.putEvent(event)
+
+    #----------------------------------------------------------------------
+    def putStrategyEvent(self, name):
+        """触发策略状态变化事件到主进程"""
+        event = Event(EVENT_CTA_STRATEGY+name)
+        self.mainEngine.putEvent(event)
+
+
+#----------------------------------------------------------------------
+def runShardWorker(shardID, settingList, eventQueue, rpcConn, ctlConn):
+    """工作进程的入口函数"""
+    eventEngine = EventEngine2()
+    mainEngine = ShardMainEngineProxy(rpcConn)
+    ctaEngine = ShardCtaEngine(mainEngine, eventEngine)
+    eventEngine.start()
+
+    for setting in settingList:
+        try:
+            ctaEngine.loadStrategy(setting)
+        except Exception:
+            ctaEngine.writeCtaLog(u'载入策略出错：\n%s' %traceback.format_exc())
+
+    # 通知主进程载入成功的策略
+    ctlConn.send(ctaEngine.strategyDict.keys())
+
+    # 管理调用在单独线程中处理，和单进程模式下界面线程直接调用CtaEngine一致
+    def serveCtl():
+        while True:
+            try:
+                funcName, args = ctlConn.recv()
+            except (EOFError, IOError):
+                break
+
+            result = None
+            if funcName in SHARD_CTL_FUNCTIONS:
+                try:
+                    result = getattr(ctaEngine, funcName)(*args)
+                except Exception:
+                    ctaEngine.writeCtaLog(traceback.format_exc())
+            ctlConn.send(result)
+
+    thread = Thread(target=serveCtl)
+    thread.daemon = True
+    thread.start()
+
+    # 主循环接收主进程推送的事件，收到None时退出
+    while True:
+        event = eventQueue.get()
+        if event is None:
+            break
+        eventEngine.put(event)
+
+    for name in ctaEngine.strategyDict.keys():
+        ctaEngine.stopStrategy(name)
+    eventEngine.stop()
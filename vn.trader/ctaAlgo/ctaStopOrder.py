@@ -0,0 +1,216 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了CTA引擎和回测引擎共用的本地停止单簿，以及回测引擎撮合用的限价单簿。
+
+停止单簿按合约分别保存多头和空头停止单的价格堆：
+1. 多头停止单在价格上涨到停止价时触发，按停止价从低到高排列
+2. 空头停止单在价格下跌到停止价时触发，按停止价从高到低排列
+限价单簿的排列方向相反：
+1. 买入限价单在价格下跌到委托价时成交，按委托价从高到低排列
+2. 卖出限价单在价格上涨到委托价时成交，按委托价从低到高排列
+每次行情只需要从堆顶取出被触发的委托，不再遍历所有等待中的委托。
+
+撤销的委托不会立即从堆中删除，而是在到达堆顶或者数量过多时再清理。
+'''
+
+from heapq import heappush, heappop, heapify
+
+from ctaBase import *
+from vtConstant import STATUS_NOTTRADED
+
+
+########################################################################
+class StopOrderHeap(object):
+    """单个方向的委托价格堆，堆中元素为(排序价格, 序号, 委托)"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, waitingStatus=STOPORDER_WAITING):
+        """Constructor，waitingStatus为等待中委托的状态，其余状态视为已撤销"""
+        self.heap = []
+        self.waitingStatus = waitingStatus
+        self.orderSet = set()           # 堆中的委托（包括已撤销但尚未清理的）
+        self.cancelledCount = 0         # 堆中已撤销但尚未清理的委托数量
+
+    #----------------------------------------------------------------------
+    def push(self, key, seq, so):
+        """加入停止单"""
+        heappush(self.heap, (key, seq, so))
+        self.orderSet.add(so)
+
+    #----------------------------------------------------------------------
+    def popTriggered(self, crossKey, l):
+        """取出排序价格小于等于crossKey的等待中委托，加入列表l"""
+        heap = self.heap
+        waitingStatus = self.waitingStatus
+        while heap and heap[0][0] <= crossKey:
+            key, seq, so = heappop(heap)
+            self.orderSet.discard(so)
+            if so.status == waitingStatus:
+                l.append((seq, so))
+            else:
+                self.cancelledCount -= 1
+
+    #----------------------------------------------------------------------
+    def cancel(self, so):
+        """
+        记录一个委托被撤销，已撤销的数量超过一半时重建堆，
+        已经从堆中取出的委托（如同一批触发的其他委托的回调中撤销）不计数
+        """
+        if so not in self.orderSet:
+            return
+
+        self.cancelledCount += 1
+        if self.cancelledCount * 2 > len(self.heap):
+            self.heap = [item for item in self.heap if item[2].status == self.waitingStatus]
+            heapify(self.heap)
+            self.orderSet = set([item[2] for item in self.heap])
+            self.cancelledCount = 0
+
+
+########################################################################
+class StopOrderBook(object):
+    """本地停止单簿"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.longHeapDict = {}      # 多头停止单，key为vtSymbol，value为按停止价排列的堆
+        self.shortHeapDict = {}     # 空头停止单，key为vtSymbol，value为按停止价取负排列的堆
+        self.seq = 0                # 加入顺序，价格相同时先加入的停止单先触发
+
+    #----------------------------------------------------------------------
+    def addStopOrder(self, so):
+        """加入等待中的停止单"""
+        self.seq += 1
+        if so.direction == DIRECTION_LONG:
+            self.getHeap(self.longHeapDict, so.vtSymbol).push(so.price, self.seq, so)
+        else:
+            self.getHeap(self.shortHeapDict, so.vtSymbol).push(-so.price, self.seq, so)
+
+    #----------------------------------------------------------------------
+    def cancelStopOrder(self, so):
+        """停止单已被撤销（状态已经不是等待中）"""
+        if so.direction == DIRECTION_LONG:
+            heapDict = self.longHeapDict
+        else:
+            heapDict = self.shortHeapDict
+
+        if so.vtSymbol in heapDict:
+            heapDict[so.vtSymbol].cancel(so)
+
+    #----------------------------------------------------------------------
+    def popTriggered(self, buyCrossPrice, sellCrossPrice, vtSymbol=None):
+        """
+        取出被触发的停止单，按加入顺序排列
+        多头停止单在停止价小于等于buyCrossPrice时触发，
+        空头停止单在停止价大于等于sellCrossPrice时触发，
+        vtSymbol为None时检查所有合约
+        """
+        l = []
+
+        if vtSymbol is None:
+            for heap in self.longHeapDict.values():
+                heap.popTriggered(buyCrossPrice, l)
+            for heap in self.shortHeapDict.values():
+                heap.popTriggered(-sellCrossPrice, l)
+        else:
+            if vtSymbol in self.longHeapDict:
+                self.longHeapDict[vtSymbol].popTriggered(buyCrossPrice, l)
+            if vtSymbol in self.shortHeapDict:
+                self.shortHeapDict[vtSymbol].popTriggered(-sellCrossPrice, l)
+
+        if len(l) > 1:
+            l.sort()
+        return [so for seq, so in l]
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空停止单簿"""
+        self.longHeapDict.clear()
+        self.shortHeapDict.clear()
+        self.seq = 0
+
+    #----------------------------------------------------------------------
+    def getHeap(self, heapDict, vtSymbol):
+        """获取合约对应的堆，不存在则创建"""
+        try:
+            return heapDict[vtSymbol]
+        except KeyError:
+            heap = StopOrderHeap()
+            heapDict[vtSymbol] = heap
+            return heap
+
+
+########################################################################
+class LimitOrderBook(object):
+    """回测撮合用的限价单簿，委托撤销或者成交前状态为STATUS_NOTTRADED"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.longHeapDict = {}      # 买入限价单，key为vtSymbol，value为按委托价取负排列的堆
+        self.shortHeapDict = {}     # 卖出限价单，key为vtSymbol，value为按委托价排列的堆
+        self.seq = 0                # 加入顺序，撮合时按加入顺序推送
+
+    #----------------------------------------------------------------------
+    def addOrder(self, order):
+        """加入等待中的限价单"""
+        self.seq += 1
+        if order.direction == DIRECTION_LONG:
+            self.getHeap(self.longHeapDict, order.vtSymbol).push(-order.price, self.seq, order)
+        else:
+            self.getHeap(self.shortHeapDict, order.vtSymbol).push(order.price, self.seq, order)
+
+    #----------------------------------------------------------------------
+    def cancelOrder(self, order):
+        """限价单已被撤销（状态已经不是STATUS_NOTTRADED）"""
+        if order.direction == DIRECTION_LONG:
+            heapDict = self.longHeapDict
+        else:
+            heapDict = self.shortHeapDict
+
+        if order.vtSymbol in heapDict:
+            heapDict[order.vtSymbol].cancel(order)
+
+    #----------------------------------------------------------------------
+    def popCrossed(self, buyCrossPrice, sellCrossPrice, vtSymbol=None):
+        """
+        取出可以成交的限价单，按加入顺序排列
+        买入限价单在委托价大于等于buyCrossPrice时成交，
+        卖出限价单在委托价小于等于sellCrossPrice时成交，
+        vtSymbol为None时检查所有合约
+        """
+        l = []
+
+        if vtSymbol is None:
+            for heap in self.longHeapDict.values():
+                heap.popTriggered(-buyCrossPrice, l)
+            for heap in self.shortHeapDict.values():
+                heap.popTriggered(sellCrossPrice, l)
+        else:
+            if vtSymbol in self.longHeapDict:
+                self.longHeapDict[vtSymbol].popTriggered(-buyCrossPrice, l)
+            if vtSymbol in self.shortHeapDict:
+                self.shortHeapDict[vtSymbol].popTriggered(sellCrossPrice, l)
+
+        if len(l) > 1:
+            l.sort()
+        return [order for seq, order in l]
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空限价单簿"""
+        self.longHeapDict.clear()
+        self.shortHeapDict.clear()
+        self.seq = 0
+
+    #----------------------------------------------------------------------
+    def getHeap(self, heapDict, vtSymbol):
+        """获取合约对应的堆，不存在则创建"""
+        try:
+            return heapDict[vtSymbol]
+        except KeyError:
+            heap = StopOrderHeap(STATUS_NOTTRADED)
+            heapDict[vtSymbol] = heap
+            return heap
@@ -32,6 +32,7 @@ class CtaTemplate(object):
     inited = False                 # 是否进行了初始化
     trading = False                # 是否启动交易，由引擎管理
     pos = 0                        # 持仓情况
+    precomputeDict = None          # 回测中预计算的指标数组，由引擎设置，为None时逐根K线计算
 
     # 参数列表，保存了参数的名称
     paramList = ['name',
@@ -95,6 +96,16 @@ class CtaTemplate(object):
         """收到Bar推送（必须由用户继承实现）"""
         raise NotImplementedError
 
+    #----------------------------------------------------------------------
+    def onPrecompute(self, arrayDict):
+        """
+        回测K线模式中一次性计算全部K线的指标（可选实现，回测引擎开启预计算模式时调用）
+        arrayDict为全部K线（先初始化数据后回测数据）的open、high、low、close、volume数组，
+        返回{名称: 指标数组}，数组的第i项对应策略收到的第i根K线，引擎将其保存在precomputeDict中，
+        返回None表示不使用预计算
+        """
+        return None
+
     #----------------------------------------------------------------------
     def buy(self, price, volume, stop=False):
         """买开"""
@@ -161,6 +172,26 @@ class CtaTemplate(object):
         """读取bar数据"""
         return self.ctaEngine.loadBar(self.barDbName, self.vtSymbol, days)
 
+    #----------------------------------------------------------------------
+    def subscribeBar(self, period=1, func=None, indicatorList=None):
+        """
+        订阅本合约的K线，K线和指标由引擎按合约统一合成和计算，多个策略实例之间共享
+        period为分钟数（如1、5、15、30）、PERIOD_DAILY、K线结束时间的元组或者(BAR_TICK, 100)
+        这样的(类型, 大小)，func为K线回调函数（默认为onBar），
+        indicatorList为指标列表，每项为(名称, 参数...)，如[('ema', 20), ('atr', 14)]
+        返回BarFeed对象，通过getIndicator(名称, 参数...)获取指标对象
+        订阅了K线的策略在回测的K线模式中也只通过订阅接收K线，和实盘一致
+        """
+        return self.ctaEngine.subscribeBar(self, self.vtSymbol, period, func, indicatorList)
+
+    #----------------------------------------------------------------------
+    def initBarFeed(self, days):
+        """
+        载入历史1分钟K线，用于初始化订阅的K线和指标（在onInit中调用）
+        历史K线只重放给本策略和尚未预热的指标，不影响实盘中正在合成的K线和其他策略
+        """
+        self.ctaEngine.updateHistoryBar(self, self.vtSymbol, self.loadBar(days))
+
     #----------------------------------------------------------------------
     def writeCtaLog(self, content):
         """记录CTA日志"""
@@ -0,0 +1,253 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了回测使用的Tick文件数据源。
+
+Tick模式回测原先只能从MongoDB的Tick数据库逐条读取，速度很慢。Tick文件数据源
+按大块读取文件，每块解码为NumPy结构化数组后再逐条生成CtaTickData，内存占用
+只和块大小有关，和文件大小无关。支持两种文件格式（文件名以.gz结尾时为gzip压缩）：
+1. 二进制Tick文件（.tick）：第一行为格式标识，第二行为JSON格式的描述信息
+   （数据类、字段列表、合约代码），之后是按时间排列的结构化数组记录，
+   可以由数据记录引擎在收到行情时直接写入
+2. CSV文件（.csv）：第一行为字段名（和CtaTickData的字段名相同），时间使用
+   datetime列（如2016-01-04 09:00:00.500000），或者date（如20160104）和time列
+
+一个合约一段时间的Tick可以保存为多个文件（如每天一个），按时间顺序依次回放。
+'''
+
+import os
+import csv
+import gzip
+import json
+from itertools import islice
+
+import numpy as np
+
+from ctaBase import *
+from ctaDataLoader import ColumnarData, getDtype
+
+
+TICK_FILE_MAGIC = 'VNTICK1\n'       # 二进制Tick文件的格式标识
+TICK_FILE_BLOCK_SIZE = 20000        # 读取文件时每块的数据条数（约5MB）
+TICK_WRITER_BUFFER_SIZE = 1000      # 写入文件时缓存的数据条数
+
+
+#----------------------------------------------------------------------
+def openFile(fileName, mode='rb'):
+    """打开文件，文件名以.gz结尾时使用gzip压缩"""
+    if fileName.endswith('.gz'):
+        return gzip.open(fileName, mode)
+    return open(fileName, mode)
+
+
+########################################################################
+class TickFileWriter(object):
+    """
+    二进制Tick文件的写入对象
+    文件已存在时（如程序重启）在末尾追加，数据先缓存在内存中，达到一定数量后批量写入
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, fileName, vtSymbol=EMPTY_STRING, symbol=EMPTY_STRING, exchange=EMPTY_STRING,
+                 dataClass=CtaTickData, bufferSize=TICK_WRITER_BUFFER_SIZE):
+        """Constructor，合约代码保存在文件的描述信息中（数组中不保存代码字段）"""
+        self.fileName = fileName
+        self.dtype = getDtype(dataClass)
+        self.nameList = self.dtype.names
+        self.bufferSize = bufferSize
+        self.buffer = []
+
+        exists = os.path.exists(fileName) and os.path.getsize(fileName) > 0
+        if exists:
+            exists = self.checkFile()
+
+        self.f = openFile(fileName, 'ab')
+        if not exists:
+            info = {'dataClass': dataClass.__name__,
+                    'fieldList': list(self.nameList),
+                    'vtSymbol': vtSymbol,
+                    'symbol': symbol or vtSymbol,
+                    'exchange': exchange}
+            self.f.write(TICK_FILE_MAGIC)
+            self.f.write(json.dumps(info) + '\n')
+
+    #----------------------------------------------------------------------
+    def checkFile(self):
+        """
+        检查已存在的文件并准备追加：写入中断时末尾可能有不完整的记录，截断到整数条记录，
+        否则之后追加的记录都会错位。描述信息不完整（写入描述信息时中断）时清空文件，
+        返回文件中是否有完整的描述信息
+        """
+        if self.fileName.endswith('.gz'):
+            raise ValueError(u'不能在已存在的gzip压缩Tick文件末尾追加：%s' % self.fileName)
+
+        with open(self.fileName, 'r+b') as f:
+            magic = f.readline()
+            if magic != TICK_FILE_MAGIC[:len(magic)]:
+                raise ValueError(u'不是二进制Tick文件：%s' % self.fileName)
+
+            line = f.readline()
+            if magic != TICK_FILE_MAGIC or not line.endswith('\n'):
+                f.truncate(0)
+                return False
+
+            info = json.loads(line)
+            if info['fieldList'] != list(self.nameList):
+                raise ValueError(u'Tick文件的字段和写入的数据不一致：%s' % self.fileName)
+
+            headerSize = f.tell()
+            size = os.path.getsize(self.fileName)
+            validSize = headerSize + (size - headerSize) // self.dtype.itemsize * self.dtype.itemsize
+            if validSize != size:
+                f.truncate(validSize)
+
+        return True
+
+    #----------------------------------------------------------------------
+    def append(self, data):
+        """加入一条数据（CtaTickData或者字段相同的对象）"""
+        self.buffer.append(tuple([getattr(data, name) for name in self.nameList]))
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    #----------------------------------------------------------------------
+    def flush(self):
+        """把缓存的数据写入文件"""
+        if self.buffer:
+            self.f.write(np.array(self.buffer, dtype=self.dtype).tostring())
+            self.buffer = []
+        self.f.flush()
+
+    #----------------------------------------------------------------------
+    def close(self):
+        """写入剩余的数据并关闭文件"""
+        self.flush()
+        self.f.close()
+
+
+#----------------------------------------------------------------------
+def writeTickFile(fileName, data):
+    """把ColumnarData保存为二进制Tick文件（覆盖已存在的文件）"""
+    info = {'dataClass': data.dataClass.__name__,
+            'fieldList': list(data.array.dtype.names),
+            'vtSymbol': data.vtSymbol,
+            'symbol': data.symbol,
+            'exchange': data.exchange}
+
+    with openFile(fileName, 'wb') as f:
+        f.write(TICK_FILE_MAGIC)
+        f.write(json.dumps(info) + '\n')
+        f.write(data.array.tostring())
+
+
+#----------------------------------------------------------------------
+def iterBinaryBlock(fileName, dataClass, blockSize=TICK_FILE_BLOCK_SIZE):
+    """按块读取二进制Tick文件，逐块生成ColumnarData"""
+    with openFile(fileName) as f:
+        if f.readline() != TICK_FILE_MAGIC:
+            raise ValueError(u'不是二进制Tick文件：%s' % fileName)
+        info = json.loads(f.readline())
+
+        dtype = getDtype(dataClass)
+        if info['fieldList'] != list(dtype.names):
+            raise ValueError(u'Tick文件的字段和%s不一致：%s' % (dataClass.__name__, fileName))
+
+        vtSymbol = info.get('vtSymbol', EMPTY_STRING)
+        symbol = info.get('symbol', vtSymbol)
+        exchange = info.get('exchange', EMPTY_STRING)
+
+        blockBytes = blockSize * dtype.itemsize
+        while True:
+            s = f.read(blockBytes)
+            # 写入中断时末尾可能有不完整的记录，直接忽略
+            count = len(s) // dtype.itemsize
+            if not count:
+                break
+
+            data = ColumnarData(dataClass, np.frombuffer(s, dtype, count))
+            data.vtSymbol = vtSymbol
+            data.symbol = symbol
+            data.exchange = exchange
+            yield data
+
+            if count < blockSize:
+                break
+
+
+#----------------------------------------------------------------------
+def iterCsvBlock(fileName, dataClass, blockSize=TICK_FILE_BLOCK_SIZE):
+    """按块读取CSV文件，每块的各列一次性转换为数组后逐块生成ColumnarData"""
+    dtype = getDtype(dataClass)
+
+    with openFile(fileName) as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader)]
+        indexDict = dict([(name, i) for i, name in enumerate(header)])
+
+        # 合约代码取第一条数据的值
+        vtSymbol = symbol = exchange = EMPTY_STRING
+
+        while True:
+            rowList = list(islice(reader, blockSize))
+            if not rowList:
+                break
+            columnList = zip(*rowList)
+
+            if not vtSymbol:
+                row = rowList[0]
+                if 'vtSymbol' in indexDict:
+                    vtSymbol = row[indexDict['vtSymbol']]
+                if 'symbol' in indexDict:
+                    symbol = row[indexDict['symbol']]
+                if 'exchange' in indexDict:
+                    exchange = row[indexDict['exchange']]
+
+            array = np.zeros(len(rowList), dtype)
+            for name in dtype.names:
+                if name in indexDict:
+                    array[name] = columnList[indexDict[name]]
+
+            # 没有datetime列时由date和time列生成
+            if 'datetime' not in indexDict:
+                dateList = columnList[indexDict['date']]
+                timeList = columnList[indexDict['time']]
+                array['datetime'] = ['%s-%s-%s %s' % (date[:4], date[4:6], date[6:8], time)
+                                     for date, time in zip(dateList, timeList)]
+
+            data = ColumnarData(dataClass, array)
+            data.vtSymbol = vtSymbol
+            data.symbol = symbol or vtSymbol
+            data.exchange = exchange
+            yield data
+
+
+#----------------------------------------------------------------------
+def iterTickFileBlock(fileList, dataClass=CtaTickData, startDate=None, endDate=None,
+                      blockSize=TICK_FILE_BLOCK_SIZE):
+    """
+    按文件顺序逐块读取Tick文件（单个文件名或者文件名列表），生成[startDate, endDate]
+    之间的ColumnarData块，None表示不限
+    """
+    if isinstance(fileList, basestring):
+        fileList = [fileList]
+
+    for fileName in fileList:
+        if fileName.endswith('.csv') or fileName.endswith('.csv.gz'):
+            blockIter = iterCsvBlock(fileName, dataClass, blockSize)
+        else:
+            blockIter = iterBinaryBlock(fileName, dataClass, blockSize)
+
+        for data in blockIter:
+            if startDate or endDate:
+                data = data.slice(startDate, endDate)
+            if len(data):
+                yield data
+
+
+#----------------------------------------------------------------------
+def iterTickFile(fileList, dataClass=CtaTickData, startDate=None, endDate=None,
+                 blockSize=TICK_FILE_BLOCK_SIZE):
+    """逐条生成Tick文件中[startDate, endDate]之间的数据对象"""
+    for data in iterTickFileBlock(fileList, dataClass, startDate, endDate, blockSize):
+        for tick in data.iterData(blockSize):
+            yield tick
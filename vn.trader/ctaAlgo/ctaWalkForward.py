@@ -0,0 +1,263 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了CTA回测的滚动优化（Walk-Forward）功能。
+
+把回测区间划分为连续的窗口：在N个月的样本内区间上优化参数，再用最优参数
+回测紧接着的M个月样本外区间，然后整体向后滚动M个月。各窗口样本外的交易
+结果按时间拼接为一条资金曲线，用于评估参数优化方法本身的稳定性。
+
+全部历史数据只在主进程中载入一次，各窗口在进程池中并行运行，工作进程
+通过内存映射共享数据并在内存中截取各自的窗口（和并行优化相同）。
+'''
+
+from __future__ import division
+
+import os
+import multiprocessing
+from datetime import datetime, timedelta
+from time import time
+
+from ctaBase import *
+import ctaBacktesting
+from ctaBacktesting import initOptimizeWorker, formatNumber
+from ctaOptimizer import createSearcher
+
+
+########################################################################
+class WalkForwardRunner(object):
+    """滚动优化"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, engine):
+        """
+        Constructor
+        engine为设置好回测日期、数据库、滑点和手续费等参数的BacktestingEngine，
+        回测日期即为滚动优化的完整区间
+        """
+        self.engine = engine
+
+        self.inSampleMonths = 6         # 样本内区间的月数
+        self.outSampleMonths = 1        # 样本外区间的月数
+        self.processes = 0              # 进程池的进程数，0表示CPU核心数量
+
+    #----------------------------------------------------------------------
+    def setWindow(self, inSampleMonths, outSampleMonths):
+        """设置样本内和样本外区间的月数"""
+        self.inSampleMonths = inSampleMonths
+        self.outSampleMonths = outSampleMonths
+
+    #----------------------------------------------------------------------
+    def setProcesses(self, processes):
+        """设置进程池的进程数"""
+        self.processes = processes
+
+    #----------------------------------------------------------------------
+    def generateWindow(self):
+        """
+        生成窗口列表[(样本内开始, 样本外开始, 样本外结束)]，均为datetime的日期，
+        区间包含开始日期，不包含结束日期，最后一个窗口的样本外区间可能不足M个月
+        """
+        engine = self.engine
+        start = engine.strategyStartDate
+        end = engine.getDataEndDate()
+        end = datetime(end.year, end.month, end.day) + timedelta(1)
+
+        l = []
+        while True:
+            outSampleStart = addMonths(start, self.inSampleMonths)
+            if outSampleStart >= end:
+                break
+            outSampleEnd = min(addMonths(outSampleStart, self.outSampleMonths), end)
+            l.append((start, outSampleStart, outSampleEnd))
+            start = addMonths(start, self.outSampleMonths)
+        return l
+
+    #----------------------------------------------------------------------
+    def run(self, strategyClass, optimizationSetting):
+        """运行滚动优化，返回结果字典"""
+        engine = self.engine
+
+        if not optimizationSetting.paramDict or not optimizationSetting.optimizeTarget:
+            engine.output(u'优化设置有问题，请检查')
+
+        start = time()
+
+        # 先载入完整区间的数据，才能确定未设置结束日期时的窗口
+        d, dataFile = engine.prepareWorkerData()
+
+        windowList = self.generateWindow()
+        if not windowList:
+            engine.output(u'回测区间不足一个窗口')
+            if dataFile:
+                os.remove(dataFile)
+            return {}
+
+        processes = self.processes or multiprocessing.cpu_count()
+        processes = min(processes, len(windowList))
+        pool = multiprocessing.Pool(processes, initOptimizeWorker, (d,))
+
+        try:
+            l = []
+            for window in windowList:
+                l.append(pool.apply_async(runWalkForwardWindow, (strategyClass, optimizationSetting,
+                                                                  window, engine.initDays)))
+            windowResultList = [res.get() for res in l]
+        finally:
+            pool.close()
+            pool.join()
+
+            if dataFile:
+                os.remove(dataFile)
+
+        engine.output(u'滚动优化完成，窗口%s个，耗时%.2f秒' % (len(windowList), time() - start))
+        return combineWindowResult(windowResultList)
+
+    #----------------------------------------------------------------------
+    def showResult(self, d):
+        """显示滚动优化结果"""
+        engine = self.engine
+        if not d:
+            engine.output(u'无交易结果')
+            return
+
+        engine.output('-' * 30)
+        for window in d['windowList']:
+            engine.output(u'样本内%s至%s，样本外至%s：参数%s，样本内目标值%s，样本外盈亏%s，交易%s次' % (
+                window['inSampleStart'].strftime('%Y%m%d'), window['outSampleStart'].strftime('%Y%m%d'),
+                window['outSampleEnd'].strftime('%Y%m%d'), window['setting'],
+                formatNumber(window['inSampleTarget']), formatNumber(window['capital']),
+                window['totalResult']))
+
+        engine.output('-' * 30)
+        engine.output(u'样本外总交易次数：\t%s' % formatNumber(d['totalResult']))
+        engine.output(u'样本外总盈亏：\t%s' % formatNumber(d['capital']))
+        engine.output(u'样本外最大回撤：\t%s' % formatNumber(min(d['drawdownList'] or [0])))
+        engine.output(u'样本外胜率：\t%s%%' % formatNumber(d['winningRate']))
+
+        # 绘图
+        import matplotlib.pyplot as plt
+
+        pCapital = plt.subplot(2, 1, 1)
+        pCapital.set_ylabel("capital")
+        pCapital.plot(d['capitalList'])
+
+        pDD = plt.subplot(2, 1, 2)
+        pDD.set_ylabel("DD")
+        pDD.bar(range(len(d['drawdownList'])), d['drawdownList'])
+
+        plt.show()
+
+
+#----------------------------------------------------------------------
+def addMonths(dt, months):
+    """日期加上若干个月，日超过当月天数时取当月最后一天"""
+    month = dt.month - 1 + months
+    year = dt.year + month // 12
+    month = month % 12 + 1
+
+    day = dt.day
+    while True:
+        try:
+            return dt.replace(year=year, month=month, day=day)
+        except ValueError:
+            day -= 1
+
+
+#----------------------------------------------------------------------
+def runWalkForwardWindow(strategyClass, optimizationSetting, window, initDays):
+    """
+    在工作进程中运行一个窗口：先在样本内区间优化参数，再用最优参数回测样本外区间，
+    返回窗口结果字典
+    """
+    engine = ctaBacktesting.optimizeEngine
+    inSampleStart, outSampleStart, outSampleEnd = window
+    targetName = optimizationSetting.optimizeTarget
+
+    # 回测结束日期包含当天，因此使用区间结束的前一天
+    inSampleEndDate = (outSampleStart - timedelta(1)).strftime('%Y%m%d')
+    outSampleEndDate = (outSampleEnd - timedelta(1)).strftime('%Y%m%d')
+
+    # 样本内优化
+    engine.setStartDate((inSampleStart - timedelta(initDays)).strftime('%Y%m%d'), initDays)
+    engine.setEndDate(inSampleEndDate)
+
+    def evaluate(settingList, endDate=None):
+        engine.setEndDate(endDate or inSampleEndDate)
+        return [engine.evaluateSetting(strategyClass, setting, targetName) for setting in settingList]
+
+    searcher = createSearcher(optimizationSetting, evaluate, 1, None,
+                              engine.strategyStartDate, engine.getDataEndDate())
+    resultList = searcher.search()
+
+    d = {}
+    d['inSampleStart'] = inSampleStart
+    d['outSampleStart'] = outSampleStart
+    d['outSampleEnd'] = outSampleEnd
+    d['setting'] = {}
+    d['inSampleTarget'] = 0
+    d['timeList'] = []
+    d['pnlList'] = []
+    d['capital'] = 0
+    d['totalResult'] = 0
+
+    if not resultList:
+        return d
+    setting, targetValue = resultList[0]
+    d['setting'] = setting
+    d['inSampleTarget'] = targetValue
+
+    # 样本外回测
+    engine.setStartDate((outSampleStart - timedelta(initDays)).strftime('%Y%m%d'), initDays)
+    engine.setEndDate(outSampleEndDate)
+    engine.clearBacktestingResult()
+    engine.initStrategy(strategyClass, setting)
+    engine.runBacktesting()
+
+    result = engine.calculateBacktestingResult()
+    if result:
+        d['timeList'] = result['timeList']
+        d['pnlList'] = result['pnlList']
+        d['capital'] = result['capital']
+        d['totalResult'] = result['totalResult']
+    return d
+
+
+#----------------------------------------------------------------------
+def combineWindowResult(windowResultList):
+    """按时间拼接各窗口样本外的交易结果，计算整体的资金曲线和回撤"""
+    windowResultList = sorted(windowResultList, key=lambda window: window['outSampleStart'])
+
+    capital = 0
+    maxCapital = 0
+    winningResult = 0
+
+    timeList = []
+    pnlList = []
+    capitalList = []
+    drawdownList = []
+
+    for window in windowResultList:
+        for dt, pnl in zip(window['timeList'], window['pnlList']):
+            capital += pnl
+            maxCapital = max(capital, maxCapital)
+
+            timeList.append(dt)
+            pnlList.append(pnl)
+            capitalList.append(capital)
+            drawdownList.append(capital - maxCapital)
+
+            if pnl >= 0:
+                winningResult += 1
+
+    d = {}
+    d['windowList'] = windowResultList
+    d['capital'] = capital
+    d['maxCapital'] = maxCapital
+    d['totalResult'] = len(pnlList)
+    d['timeList'] = timeList
+    d['pnlList'] = pnlList
+    d['capitalList'] = capitalList
+    d['drawdownList'] = drawdownList
+    d['winningRate'] = winningResult / len(pnlList) * 100 if pnlList else 0
+    return d
@@ -11,9 +11,9 @@
 
 from ctaBase import *
 from ctaTemplate import CtaTemplate
+from ctaBarSeries import BarSeries
 
 import talib
-import numpy as np
 import  math
 import copy
 
@@ -40,11 +40,7 @@ class Rb5MinsBreakoutStrategy(CtaTemplate):
     barMinute = EMPTY_STRING    # K线当前的分钟
 
     bufferSize = 100                    # 需要缓存的数据的大小
-    bufferCount = 0                     # 目前已经缓存了的数据的计数
-    highArray = np.zeros(bufferSize)    # K线最高价的数组
-    lowArray = np.zeros(bufferSize)     # K线最低价的数组
-    closeArray = np.zeros(bufferSize)   # K线收盘价的数组
-    openArray = np.zeros(bufferSize)    # K线开盘价的数组
+    barSeries = None                    # K线开盘价、最高价、最低价、收盘价的序列
 
 
     ma1 = 0
@@ -92,6 +88,7 @@ class Rb5MinsBreakoutStrategy(CtaTemplate):
         # 否则会出现多个策略实例之间数据共享的情况，有可能导致潜在的策略逻辑错误风险，
         # 策略类中的这些可变对象属性可以选择不写，全都放在__init__下面，写主要是为了阅读
         # 策略时方便（更多是个编程习惯的选择）
+        self.barSeries = BarSeries(self.bufferSize, ['open', 'high', 'low', 'close'])
 
 
         self.isPrePosHaved = False
@@ -198,24 +195,20 @@ class Rb5MinsBreakoutStrategy(CtaTemplate):
         self.orderList = []
 
         # 保存K线数据
-        self.closeArray[0:self.bufferSize-1] = self.closeArray[1:self.bufferSize]
-        self.highArray[0:self.bufferSize-1] = self.highArray[1:self.bufferSize]
-        self.lowArray[0:self.bufferSize-1] = self.lowArray[1:self.bufferSize]
-        self.openArray[0:self.bufferSize - 1] = self.openArray[1:self.bufferSize]
-        self.closeArray[-1] = bar.close
-        self.highArray[-1] = bar.high
-        self.lowArray[-1] = bar.low
-        self.openArray[-1] = bar.open
-
-        self.bufferCount += 1
-        if self.bufferCount < self.bufferSize:
+        self.barSeries.update(bar)
+        if not self.barSeries.isFull():
             return
 
-        self.npHigh = talib.MAX(self.highArray, self.length)[-1]
-        self.npHigh1 = talib.MAX(self.highArray[:-2],self.length - 1)[-1]
-        self.npLow = talib.MIN(self.lowArray, self.length)[-1]
-        self.npLow1 = talib.MIN(self.lowArray[:-2],self.length - 1)[-1]
-        self.ma1 = talib.MA(self.closeArray[:-2], self.length1)[-1]
+        openArray = self.barSeries.getArray('open')
+        highArray = self.barSeries.getArray('high')
+        lowArray = self.barSeries.getArray('low')
+        closeArray = self.barSeries.getArray('close')
+
+        self.npHigh = talib.MAX(highArray, self.length)[-1]
+        self.npHigh1 = talib.MAX(highArray[:-2],self.length - 1)[-1]
+        self.npLow = talib.MIN(lowArray, self.length)[-1]
+        self.npLow1 = talib.MIN(lowArray[:-2],self.length - 1)[-1]
+        self.ma1 = talib.MA(closeArray[:-2], self.length1)[-1]
 
         if bar.high == self.npHigh:
             self.breakUp = True
@@ -236,35 +229,35 @@ class Rb5MinsBreakoutStrategy(CtaTemplate):
             self.intraTradeHigh = bar.high
             self.intraTradeLow = bar.low
 
-            if bar.high > self.ma1 and self.breakUp and bar.open > self.lowArray[-2] and \
-                self.openArray[-2] > self.lowArray[-3] and \
-                self.openArray[-2] < self.closeArray[-2]:
+            if bar.high > self.ma1 and self.breakUp and bar.open > lowArray[-2] and \
+                openArray[-2] > lowArray[-3] and \
+                openArray[-2] < closeArray[-2]:
                 self.buy(max(max(self.npHigh1, bar.open), self.ma1) + self.zjd, self.fixedSize)
-            if bar.low < self.ma1 and self.breakDown and bar.open < self.highArray[-2] and \
-                self.openArray[-2] < self.highArray[-3] and \
-                self.openArray[-2] > self.closeArray[-2]:
+            if bar.low < self.ma1 and self.breakDown and bar.open < highArray[-2] and \
+                openArray[-2] < highArray[-3] and \
+                openArray[-2] > closeArray[-2]:
                 self.short(min(min(self.npLow1, bar.open), self.ma1) - self.zjd, self.fixedSize)
 
         # 持有多头仓位
         elif self.pos == 1:
 
-            if self.closeArray[-2] < self.ma1 and self.lowArray[-2] < self.lowArray[-3]:
+            if closeArray[-2] < self.ma1 and lowArray[-2] < lowArray[-3]:
                 orderID = self.sell(bar.open - self.zjd, self.fixedSize)
                 self.orderList.append(orderID)
-            if bar.low < self.ma1 and self.breakDown and bar.open < self.highArray[-2] and \
-                self.openArray[-2] < self.highArray[-3] and \
-                self.openArray[-2] > self.closeArray[-2]:
+            if bar.low < self.ma1 and self.breakDown and bar.open < highArray[-2] and \
+                openArray[-2] < highArray[-3] and \
+                openArray[-2] > closeArray[-2]:
                 self.short(min(min(self.npLow1, bar.open), self.ma1) - self.zjd, self.fixedSize)
 
         # 持有空头仓位
         elif self.pos == -1:
 
-            if self.closeArray[-2] > self.ma1 and self.highArray[-2] > self.highArray[-3]:
+            if closeArray[-2] > self.ma1 and highArray[-2] > highArray[-3]:
                 orderID = self.cover(bar.open + self.zjd, self.fixedSize)
                 self.orderList.append(orderID)
-            if bar.high > self.ma1 and self.breakUp and bar.open > self.lowArray[-2] and \
-                self.openArray[-2] > self.lowArray[-3] and \
-                self.openArray[-2] < self.closeArray[-2]:
+            if bar.high > self.ma1 and self.breakUp and bar.open > lowArray[-2] and \
+                openArray[-2] > lowArray[-3] and \
+                openArray[-2] < closeArray[-2]:
                 self.buy(max(max(self.npHigh1, bar.open), self.ma1) + self.zjd, self.fixedSize)
         # 发出状态更新事件
         self.putEvent()
@@ -11,9 +11,9 @@
 
 from ctaBase import *
 from ctaTemplate import CtaTemplate
+from ctaBarSeries import BarSeries
 from datetime import datetime
 import talib
-import numpy as np
 
 
 ########################################################################
@@ -38,12 +38,7 @@ class RbDualThrustStrategy(CtaTemplate):
     barMinute = EMPTY_STRING    # K线当前的分钟
 
     bufferSize = 20                    # 需要缓存的数据的大小
-    bufferCount = 0                     # 目前已经缓存了的数据的计数
-
-    highArray = np.zeros(bufferSize)    # K线最高价的数组
-    lowArray = np.zeros(bufferSize)     # K线最低价的数组
-    closeArray = np.zeros(bufferSize)   # K线收盘价的数组
-    openArray = np.zeros(bufferSize)    # K线开盘价的数组
+    barSeries = None                    # K线最高价、最低价、收盘价的序列
 
     HHValue = 0                         # N天最高价的最高价
     HCValue = 0                         # N天收盘价的最高价
@@ -90,6 +85,7 @@ class RbDualThrustStrategy(CtaTemplate):
         # 否则会出现多个策略实例之间数据共享的情况，有可能导致潜在的策略逻辑错误风险，
         # 策略类中的这些可变对象属性可以选择不写，全都放在__init__下面，写主要是为了阅读
         # 策略时方便（更多是个编程习惯的选择）
+        self.barSeries = BarSeries(self.bufferSize, ['high', 'low', 'close'])
 
 
         self.isPrePosHaved = False
@@ -236,33 +232,28 @@ class RbDualThrustStrategy(CtaTemplate):
 
 
         # 保存K线数据
-        self.closeArray[0:self.bufferSize-1] = self.closeArray[1:self.bufferSize]
-        self.highArray[0:self.bufferSize-1] = self.highArray[1:self.bufferSize]
-        self.lowArray[0:self.bufferSize-1] = self.lowArray[1:self.bufferSize]
-        self.openArray[0:self.bufferSize-1] = self.openArray[1:self.bufferSize]
-        self.closeArray[-1] = bar.close
-        self.highArray[-1] = bar.high
-        self.lowArray[-1] = bar.low
-        self.openArray[-1] = bar.open
-
-        self.bufferCount += 1
-        if self.bufferCount < self.bufferSize:
+        self.barSeries.update(bar)
+        if not self.barSeries.isFull():
             return
 
+        highArray = self.barSeries.getArray('high')
+        lowArray = self.barSeries.getArray('low')
+        closeArray = self.barSeries.getArray('close')
+
         # 计算指标数值
-        self.HHValue = talib.MAX(self.highArray, self.pN)[-1]
-        self.HCValue = talib.MAX(self.closeArray, self.pN)[-1]
-        self.LLValue = talib.MIN(self.lowArray, self.pN)[-1]
-        self.LCValue = talib.MIN(self.closeArray, self.pN)[-1]
+        self.HHValue = talib.MAX(highArray, self.pN)[-1]
+        self.HCValue = talib.MAX(closeArray, self.pN)[-1]
+        self.LLValue = talib.MIN(lowArray, self.pN)[-1]
+        self.LCValue = talib.MIN(closeArray, self.pN)[-1]
 
         self.RangeValue = max(self.HHValue - self.LCValue, self.HCValue - self.LLValue)
 
-        self.BuyLine = self.openArray[-1] + self.Ks * self.RangeValue
-        self.SellLine = self.openArray[-1] - self.Kx * self.RangeValue
+        self.BuyLine = bar.open + self.Ks * self.RangeValue
+        self.SellLine = bar.open - self.Kx * self.RangeValue
 
-        # self.AtrValue = talib.ATR(self.highArray,
-        #                           self.lowArray,
-        #                           self.closeArray,
+        # self.AtrValue = talib.ATR(highArray,
+        #                           lowArray,
+        #                           closeArray,
         #                           self.atrLength)[-1]
 
         # 发出状态更新事件
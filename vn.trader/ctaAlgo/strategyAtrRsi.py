@@ -6,14 +6,17 @@
 1. 作者不对交易盈利做任何保证，策略代码仅供参考
 2. 本策略需要用到talib，没有安装的用户请先参考www.vnpy.org上的教程安装
 3. 将IF0000_1min.csv用ctaHistoryData.py导入MongoDB后，直接运行本文件即可回测策略
+4. 回测时可以开启引擎的指标预计算模式（setPrecomputeMode），结果不变，速度更快
 """
 
+from math import isnan
 
 from ctaBase import *
 from ctaTemplate import CtaTemplate
+from ctaBarSeries import BarSeries, ArraySeries
+from ctaPrecompute import windowSma, windowAtr, windowRsi
 
 import talib
-import numpy as np
 
 
 ########################################################################
@@ -39,13 +42,10 @@ class AtrRsiStrategy(CtaTemplate):
     barMinute = EMPTY_STRING    # K线当前的分钟
 
     bufferSize = 100                    # 需要缓存的数据的大小
-    bufferCount = 0                     # 目前已经缓存了的数据的计数
-    highArray = np.zeros(bufferSize)    # K线最高价的数组
-    lowArray = np.zeros(bufferSize)     # K线最低价的数组
-    closeArray = np.zeros(bufferSize)   # K线收盘价的数组
+    barSeries = None                    # K线最高价、最低价、收盘价的序列
 
-    atrCount = 0                        # 目前已经缓存了的ATR的计数
-    atrArray = np.zeros(bufferSize)     # ATR指标的数组
+    atrSeries = None                    # ATR指标的序列
+    barCount = 0                        # 已经收到的K线数量，预计算模式中为指标数组的下标
     atrValue = 0                        # 最新的ATR指标数值
     atrMa = 0                           # ATR移动平均的数值
 
@@ -90,6 +90,8 @@ class AtrRsiStrategy(CtaTemplate):
         # 否则会出现多个策略实例之间数据共享的情况，有可能导致潜在的策略逻辑错误风险，
         # 策略类中的这些可变对象属性可以选择不写，全都放在__init__下面，写主要是为了阅读
         # 策略时方便（更多是个编程习惯的选择）
+        self.barSeries = BarSeries(self.bufferSize, ['high', 'low', 'close'])
+        self.atrSeries = ArraySeries(self.bufferSize)
 
 
         self.isPrePosHaved = False
@@ -164,36 +166,13 @@ class AtrRsiStrategy(CtaTemplate):
             self.cancelOrder(orderID)
         self.orderList = []
 
-        # 保存K线数据
-        self.closeArray[0:self.bufferSize-1] = self.closeArray[1:self.bufferSize]
-        self.highArray[0:self.bufferSize-1] = self.highArray[1:self.bufferSize]
-        self.lowArray[0:self.bufferSize-1] = self.lowArray[1:self.bufferSize]
-
-        self.closeArray[-1] = bar.close
-        self.highArray[-1] = bar.high
-        self.lowArray[-1] = bar.low
-
-        self.bufferCount += 1
-        if self.bufferCount < self.bufferSize:
-            return
-
-        # 计算指标数值
-        self.atrValue = talib.ATR(self.highArray,
-                                  self.lowArray,
-                                  self.closeArray,
-                                  self.atrLength)[-1]
-        self.atrArray[0:self.bufferSize-1] = self.atrArray[1:self.bufferSize]
-        self.atrArray[-1] = self.atrValue
-
-        self.atrCount += 1
-        if self.atrCount < self.bufferSize:
+        # 计算指标数值，数据不足时不进行交易
+        if self.precomputeDict:
+            if not self.loadIndicator():
+                return
+        elif not self.updateIndicator(bar):
             return
 
-        self.atrMa = talib.MA(self.atrArray,
-                              self.atrMaLength)[-1]
-        self.rsiValue = talib.RSI(self.closeArray,
-                                  self.rsiLength)[-1]
-
         # 判断是否要进行交易
 
         # 当前无仓位
@@ -236,6 +215,63 @@ class AtrRsiStrategy(CtaTemplate):
         self.putEvent()
 
 
+    #----------------------------------------------------------------------
+    def updateIndicator(self, bar):
+        """缓存K线并用talib计算指标，返回数据是否足够"""
+        # 保存K线数据
+        self.barSeries.update(bar)
+        if not self.barSeries.isFull():
+            return False
+
+        closeArray = self.barSeries.getArray('close')
+        self.atrValue = talib.ATR(self.barSeries.getArray('high'),
+                                  self.barSeries.getArray('low'),
+                                  closeArray,
+                                  self.atrLength)[-1]
+
+        self.atrSeries.update(self.atrValue)
+        if not self.atrSeries.isFull():
+            return False
+
+        self.atrMa = talib.MA(self.atrSeries.getArray(),
+                              self.atrMaLength)[-1]
+        self.rsiValue = talib.RSI(closeArray,
+                                  self.rsiLength)[-1]
+        return True
+
+    #----------------------------------------------------------------------
+    def onPrecompute(self, arrayDict):
+        """回测中一次性计算全部K线的指标，和updateIndicator中对缓存窗口调用talib的结果一致"""
+        self.barCount = 0
+
+        atr = windowAtr(arrayDict['high'], arrayDict['low'], arrayDict['close'],
+                        self.atrLength, self.bufferSize)
+
+        d = {}
+        d['atr'] = atr
+        d['atrMa'] = windowSma(atr, self.atrMaLength, self.bufferSize)
+        d['rsi'] = windowRsi(arrayDict['close'], self.rsiLength, self.bufferSize)
+        return d
+
+    #----------------------------------------------------------------------
+    def loadIndicator(self):
+        """读取当前K线预计算的指标，返回数据是否足够"""
+        i = self.barCount
+        self.barCount += 1
+
+        d = self.precomputeDict
+        atrValue = d['atr'][i]
+        if isnan(atrValue):
+            return False
+        self.atrValue = atrValue
+
+        atrMa = d['atrMa'][i]
+        if isnan(atrMa):
+            return False
+        self.atrMa = atrMa
+        self.rsiValue = d['rsi'][i]
+        return True
+
     #----------------------------------------------------------------------
     def onOrder(self, order):
         """收到委托变化推送（必须由用户继承实现）"""
@@ -285,6 +321,9 @@ if __name__ == '__main__':
     # 设置使用的历史数据库
     engine.setDatabase(MINUTE_DB_NAME, 'ag1612')
 
+    # 开启指标预计算，策略一次性计算全部K线的指标
+    engine.setPrecomputeMode()
+
     ## 在引擎中创建策略对象
     # d = {'atrLength': 11}
     # engine.initStrategy(AtrRsiStrategy, d)
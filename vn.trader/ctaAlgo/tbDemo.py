@@ -2,7 +2,6 @@
 
 import talib as ta
 import numpy as np
-import copy
 
 from ctaBase import *
 from ctaTemplate import CtaTemplate
@@ -22,13 +21,6 @@ class TalibDoubleSmaDemo(CtaTemplate):
     initDays = 30       # 初始化数据所用的天数
 
     # 策略变量
-    bar = None
-    barMinute = EMPTY_STRING
-
-    customBar = None
-    nextBegin = True
-    firstvolumes = 0
-
     closeHistory = []       # 缓存K线收盘价的数组
     maxHistory = 30        # 最大缓存数量
 
@@ -61,20 +53,19 @@ class TalibDoubleSmaDemo(CtaTemplate):
         """Constructor"""
         super(TalibDoubleSmaDemo, self).__init__(ctaEngine, setting)
 
-
+        # K线由引擎按交易时段合成，配置了times时使用在这些时间结束的自定义K线，否则使用1分钟K线
+        timesDict = getattr(self, 'timesDict', None)
+        if timesDict:
+            self.subscribeBar(tuple(timesDict))
+        else:
+            self.subscribeBar(1)
 
     # ----------------------------------------------------------------------
     def onInit(self):
         """初始化策略（必须由用户继承实现）"""
         self.writeCtaLog(u'双SMA演示策略初始化')
 
-        initData = self.loadBar(self.initDays)
-
-        for bar in initData:
-            if self.timesDict:
-                self.procecssCustomBar(bar)
-            else:
-                self.onBar(bar)
+        self.initBarFeed(self.initDays)
 
         self.putEvent()
 
@@ -93,51 +84,8 @@ class TalibDoubleSmaDemo(CtaTemplate):
     # ----------------------------------------------------------------------
     def onTick(self, tick):
         """收到行情TICK推送（必须由用户继承实现）"""
-        # 计算K线
-        tickMinute = tick.datetime.minute
-
-        if tickMinute != self.barMinute:
-            if self.bar:
-                newBar = copy.copy(self.bar)
-                newBar.datetime = tick.datetime.replace(second=0, microsecond=0)
-                newBar.date = tick.date
-                newBar.time = tick.time
-                if self.timesDict:
-                    self.procecssCustomBar(newBar)
-                else:
-                    self.onBar(newBar)
-
-            bar = CtaBarData()
-            bar.vtSymbol = tick.vtSymbol
-            bar.symbol = tick.symbol
-            bar.exchange = tick.exchange
-
-            bar.open = tick.lastPrice
-            bar.high = tick.lastPrice
-            bar.low = tick.lastPrice
-            bar.close = tick.lastPrice
-
-            bar.date = tick.date
-            bar.time = tick.time
-            bar.datetime = tick.datetime  # K线的时间设为第一个Tick的时间
-
-            # 实盘中用不到的数据可以选择不算，从而加快速度
-
-            #self.firstvolumes = tick.volume
-            #bar.openInterest = tick.openInterest
-
-            self.bar = bar  # 这种写法为了减少一层访问，加快速度
-            self.barMinute = tickMinute  # 更新当前的分钟
-
-        else:  # 否则继续累加新的K线
-            bar = self.bar  # 写法同样为了加快速度
-
-            bar.high = max(bar.high, tick.lastPrice)
-            bar.low = min(bar.low, tick.lastPrice)
-            bar.close = tick.lastPrice
-            # 实盘中用不到的数据可以选择不算，从而加快速度
-            #bar.volume = tick.volume - self.firstvolumes  # 最后一个tick的成交量和第一个tick的成交量的差是一分钟的成交量
-            #bar.openInterest = tick.openInterest  # 持仓量直接更新
+        # K线由引擎合成后推送到onBar
+        pass
 
     # ----------------------------------------------------------------------
     def onBar(self, bar):
@@ -212,50 +160,3 @@ class TalibDoubleSmaDemo(CtaTemplate):
                 self.pos = -1 * pos.position
             self.lastEntryPrice = pos.price
             self.isPrePosHaved = True
-
-    # -----------------------------------------------------------------------
-    def barInTime(self, d):
-        inTime = False
-        if self.timesDict:
-            for time in self.timesDict:
-                if time == d.time:
-                    inTime = True
-        return inTime
-
-   #----------------------------------------------------------------------------
-    def procecssCustomBar(self,bar):
-
-        if self.nextBegin:
-            customBar = CtaBarData()
-            customBar.vtSymbol = bar.vtSymbol
-            customBar.symbol = bar.vtSymbol
-            customBar.exchange = bar.exchange
-            customBar.open = bar.open
-            customBar.high = bar.high
-            customBar.low = bar.low
-            customBar.close = bar.close
-            customBar.date = bar.date
-            customBar.time = bar.time
-            customBar.datetime = bar.datetime
-            #customBar.volume = int(float(bar.volume))
-            #customBar.openInterest = bar.openInterest
-            self.customBar = customBar
-            self.nextBegin = False
-        else:
-            customBar = self.customBar
-            customBar.high = max(customBar.high, bar.high)
-            customBar.low = min(customBar.low, bar.low)
-            customBar.close = bar.close
-            #customBar.volume = customBar.volume + int(float(bar.volume))
-            #customBar.openInterest = bar.openInterest
-        if self.barInTime(bar):
-            customBar.datetime = bar.datetime.replace(second=0,microsecond=0)
-            customBar.date = bar.date
-            customBar.time = bar.time
-            self.nextBegin = True
-            self.onBar(customBar)
-
-
-
-
-
@@ -7,14 +7,27 @@ from vtConstant import *
 from ctaBase import *
 
 from datetime import datetime
+from collections import deque
 
-import talib as ta
-import numpy
-import copy,csv
+import csv
+
+from vtTime import getSessionTable
+from ctaIndicator import RollingWindow, HighestIndicator, LowestIndicator, \
+    getTrueRange, getDirectionalMovement, getRsi
 
 
 DEBUGCTALOG = True
 
+class LineBarData(CtaBarData):
+    """CTA K线中使用的K线数据，在CtaBarData的基础上增加颜色字段"""
+    __slots__ = ('color',)
+
+    def __init__(self):
+        """Constructor"""
+        super(LineBarData, self).__init__()
+        self.color = EMPTY_STRING       # K线颜色
+
+
 class CtaLineBar(object):
     """CTA K线"""
     """ 使用方法:
@@ -95,12 +108,15 @@ class CtaLineBar(object):
         # 当前的Tick
         self.curTick = None
 
+        # 品种的交易时段表格，收到第一个Tick时按shortSymbol获取
+        self.sessionTable = None
+
         # K 线服务的策略
         self.strategy = strategy
 
         # K线保存数据
         self.bar = None                # K线数据对象
-        self.lineBar = []              # K线缓存数据队列
+        self.lineBar = deque(maxlen=60 * 8 + 1)     # K线缓存数据队列，只保留8交易小时的数据
         self.barFirstTick =False       # K线的第一条Tick数据
 
         # K 线的相关计算结果数据
@@ -168,6 +184,25 @@ class CtaLineBar(object):
         self.lineMiddleBand = []           # 中线
         self.lineLowerBand = []            # 下轨
 
+        # 流式指标的状态，窗口只包含已完成的K线，每根K线完成时O(1)更新
+        self.indicatorInited = False
+        self.lastCompletedBar = None    # 最近一根已完成的K线
+
+        self.preHighWindow = None       # 前inputPreLen根K线的最高价
+        self.preLowWindow = None        # 前inputPreLen根K线的最低价
+        self.ema1Window = None          # 前inputEma1Len根K线的收盘价
+        self.ema2Window = None          # 前inputEma2Len根K线的收盘价
+        self.dmiTrWindow = None         # 前inputDmiLen根K线的真实波幅
+        self.dmiPdmWindow = None        # 前inputDmiLen根K线的上升动向
+        self.dmiMdmWindow = None        # 前inputDmiLen根K线的下降动向
+        self.dxSum = EMPTY_FLOAT        # lineDx之和
+        self.volWindow = None           # 前inputVolLen根K线的成交量
+        self.rsiGainWindow = None       # 前inputRsiLen个收盘价的涨幅
+        self.rsiLossWindow = None       # 前inputRsiLen个收盘价的跌幅
+        self.cmiHighWindow = None       # 前inputCmiLen-1根K线收盘价的最高值
+        self.cmiLowWindow = None        # 前inputCmiLen-1根K线收盘价的最低值
+        self.bollWindow = None          # 前inputBollLen根K线的收盘价
+
         if setting:
             self.setParam(setting)
 
@@ -188,8 +223,13 @@ class CtaLineBar(object):
         #    self.writeCtaLog(u'无效的tick时间:{0}'.format(tick.datetime))
         #    return
 
-        if tick.datetime.hour == 8 or tick.datetime.hour == 20:
-            self.writeCtaLog(u'竞价排名tick时间:{0}'.format(tick.datetime))
+        if self.sessionTable is None:
+            self.sessionTable = getSessionTable(self.shortSymbol)
+
+        # 集合竞价（时段开始前一分钟）和非交易时段的Tick不参与K线合成
+        offset = self.sessionTable.tickOffsetList[tick.datetime.hour * 60 + tick.datetime.minute]
+        if offset is None or offset > 0:
+            self.writeCtaLog(u'集合竞价或非交易时段的tick时间:{0}'.format(tick.datetime))
             return
 
         self.curTick = tick
@@ -199,6 +239,12 @@ class CtaLineBar(object):
 
     def addBar(self,bar):
         """予以外部初始化程序增加bar"""
+        # CtaBarData使用__slots__，无法增加颜色字段，转换为LineBarData
+        if not isinstance(bar, LineBarData):
+            lineBarData = LineBarData()
+            lineBarData.copyFrom(bar, CtaBarData.getFieldList())
+            bar = lineBarData
+
         l1 = len(self.lineBar)
 
         if l1 == 0:
@@ -223,6 +269,12 @@ class CtaLineBar(object):
 
     def onBar(self, bar):
         """OnBar事件"""
+        # 新的K线推入lineBar时，前一根K线已经完成，更新流式指标
+        if not self.indicatorInited:
+            self.__initIndicator()
+        if len(self.lineBar) > 1:
+            self.__updateIndicator(self.lineBar[-2])
+
         # 计算相关数据
         self.__recountPreHighLow()
         self.__recountEma()
@@ -238,9 +290,81 @@ class CtaLineBar(object):
         self.onBarFunc(bar)
 
 
+    # ----------------------------------------------------------------------
+    def __initIndicator(self):
+        """按照参数创建流式指标（参数为0的指标不计算）"""
+        if self.inputPreLen > 0:
+            self.preHighWindow = HighestIndicator(self.inputPreLen)
+            self.preLowWindow = LowestIndicator(self.inputPreLen)
+
+        if self.inputEma1Len > 0:
+            self.ema1Window = RollingWindow(self.inputEma1Len)
+        if self.inputEma2Len > 0:
+            self.ema2Window = RollingWindow(self.inputEma2Len)
+
+        if self.inputDmiLen > 0:
+            self.dmiTrWindow = RollingWindow(self.inputDmiLen)
+            self.dmiPdmWindow = RollingWindow(self.inputDmiLen)
+            self.dmiMdmWindow = RollingWindow(self.inputDmiLen)
+
+        if self.inputVolLen > 0:
+            self.volWindow = RollingWindow(self.inputVolLen)
+
+        if self.inputRsiLen > 0:
+            self.rsiGainWindow = RollingWindow(self.inputRsiLen)
+            self.rsiLossWindow = RollingWindow(self.inputRsiLen)
+
+        if self.inputCmiLen > 1:
+            self.cmiHighWindow = HighestIndicator(self.inputCmiLen - 1)
+            self.cmiLowWindow = LowestIndicator(self.inputCmiLen - 1)
+
+        if self.inputBollLen > 0:
+            self.bollWindow = RollingWindow(self.inputBollLen)
+
+        self.indicatorInited = True
+
+    # ----------------------------------------------------------------------
+    def __updateIndicator(self, bar):
+        """一根K线完成时，把它加入各指标的窗口"""
+        if self.preHighWindow is not None:
+            self.preHighWindow.update(bar.high)
+            self.preLowWindow.update(bar.low)
+
+        if self.ema1Window is not None:
+            self.ema1Window.update(bar.close)
+        if self.ema2Window is not None:
+            self.ema2Window.update(bar.close)
+
+        if self.volWindow is not None:
+            self.volWindow.update(bar.volume)
+
+        if self.cmiHighWindow is not None:
+            self.cmiHighWindow.update(bar.close)
+            self.cmiLowWindow.update(bar.close)
+
+        if self.bollWindow is not None:
+            self.bollWindow.update(bar.close)
+
+        # 动向和涨跌需要前一根已完成的K线
+        preBar = self.lastCompletedBar
+        self.lastCompletedBar = bar
+        if preBar is None:
+            return
+
+        if self.dmiTrWindow is not None:
+            pdm, mdm = getDirectionalMovement(bar.high, bar.low, preBar.high, preBar.low)
+            self.dmiTrWindow.update(getTrueRange(bar.high, bar.low, preBar.close))
+            self.dmiPdmWindow.update(pdm)
+            self.dmiMdmWindow.update(mdm)
+
+        if self.rsiGainWindow is not None:
+            diff = bar.close - preBar.close
+            self.rsiGainWindow.update(max(diff, 0))
+            self.rsiLossWindow.update(max(-diff, 0))
+
     def __firstTick(self,tick):
         """ K线的第一个Tick数据"""
-        self.bar = CtaBarData()                  # 创建新的K线
+        self.bar = LineBarData()                 # 创建新的K线
 
         self.bar.vtSymbol = tick.vtSymbol
         self.bar.symbol = tick.symbol
@@ -275,10 +399,6 @@ class CtaLineBar(object):
             self.onBar(self.bar)
             return
 
-        # 清除8交易小时前的数据，
-        if l1 > 60 * 8:
-            del self.lineBar[0]
-
         # 与最后一个BAR的时间比对，判断是否超过5分钟
         lastBar = self.lineBar[-1]
 
@@ -304,7 +424,8 @@ class CtaLineBar(object):
 
                 # 生成砖块递增K线,减小ATR变动
                 for i in range(0, jumpBars, 1):
-                    upbar = copy.deepcopy(lastBar)
+                    upbar = LineBarData()
+                    upbar.copyFrom(lastBar)
                     upbar.open = priceInYesterday + float(i * priceInBar)
                     upbar.low = upbar.open
                     upbar.close = priceInYesterday + float((i+1) * priceInBar)
@@ -318,7 +439,8 @@ class CtaLineBar(object):
                 # 生成递减K线,减小ATR变动
                 for i in range(0, jumpBars, 1):
 
-                    downbar = copy.deepcopy(lastBar)
+                    downbar = LineBarData()
+                    downbar.copyFrom(lastBar)
                     downbar.open = priceInYesterday - float(i * priceInBar)
                     downbar.high = downbar.open
                     downbar.close = priceInYesterday - float((i+1) * priceInBar)
@@ -330,7 +452,8 @@ class CtaLineBar(object):
 
             # 生成平移K线，减小Pdi，Mdi、ADX变动
             for i in range(0, jumpBars*2, 1):
-                equalbar=copy.deepcopy(self.lineBar[-1])
+                equalbar = LineBarData()
+                equalbar.copyFrom(self.lineBar[-1])
                 equalbar.volume = 0
                 self.lineBar.append(equalbar)
                 self.onBar(equalbar)
@@ -338,23 +461,9 @@ class CtaLineBar(object):
             # 重新指定为最后一个Bar
             lastBar = self.lineBar[-1]
 
-        # 处理日内的间隔时段最后一个tick，如10:15分，11:30分，15:00 和 2:30分
-        endtick = False
-        if (tick.datetime.hour == 10 and tick.datetime.minute == 15 ) \
-            or (tick.datetime.hour == 11 and tick.datetime.minute == 30 ) \
-            or (tick.datetime.hour == 15 and tick.datetime.minute == 00 ) \
-            or (tick.datetime.hour == 2 and tick.datetime.minute == 30 ):
-            endtick = True
-
-        if self.shortSymbol in NIGHT_MARKET_SQ2 and tick.datetime.hour == 1 and tick.datetime.minute == 00:
-            endtick = True
-
-        if self.shortSymbol in NIGHT_MARKET_SQ3 and tick.datetime.hour == 23 and tick.datetime.minute == 00:
-            endtick = True
-
-        if self.shortSymbol in NIGHT_MARKET_ZZ or self.shortSymbol in NIGHT_MARKET_DL:
-            if tick.datetime.hour == 23 and tick.datetime.minute == 30:
-                endtick = True
+        # 处理交易时段结束时的最后一个tick（如10:15分，11:30分，15:00和各品种夜盘的收盘），
+        # 由品种的交易时段表格确定，收盘tick归入最后一根K线
+        endtick = self.sessionTable.tickOffsetList[tick.datetime.hour * 60 + tick.datetime.minute] == -1
 
         # 满足时间要求
         if (tick.datetime-lastBar.datetime).seconds >= self.barTimeInterval and not endtick:
@@ -395,17 +504,15 @@ class CtaLineBar(object):
                              format(len(self.lineBar), self.inputPreLen))
             return
 
-        # 2.计算前inputPreLen周期内(不包含当前周期）的Bar高点和低点
-        preHigh = EMPTY_FLOAT
-        preLow = EMPTY_FLOAT
+        # 2.前inputPreLen周期内(不包含当前周期）的Bar高点和低点
+        preHigh = self.preHighWindow.value
+        preLow = self.preLowWindow.value
 
-        for i in range(len(self.lineBar)-2, len(self.lineBar)-2-self.inputPreLen, -1):
-
-            if self.lineBar[i].high > preHigh or preHigh == EMPTY_FLOAT:
-                preHigh = self.lineBar[i].high    # 前InputPreLen周期高点
-
-            if self.lineBar[i].low < preLow or preLow == EMPTY_FLOAT:
-                preLow = self.lineBar[i].low     # 前InputPreLen周期低点
+        # 已完成的K线不足inputPreLen根时，和原先按序号向前取K线一样包含当前周期
+        if not self.preHighWindow.isFull():
+            bar = self.lineBar[-1]
+            preHigh = bar.high if preHigh is None else max(preHigh, bar.high)
+            preLow = bar.low if preLow is None else min(preLow, bar.low)
 
         # 保存
         if len(self.preHigh) > self.inputPreLen * 8:
@@ -422,28 +529,17 @@ class CtaLineBar(object):
 
     def __recountEma(self):
         """计算K线的EMA1 和EMA2"""
-        l = len(self.lineBar)
-
         # 1、lineBar满足长度才执行计算
         if len(self.lineBar) < max(7, self.inputEma1Len, self.inputEma2Len)+2:
             self.debugCtaLog(u'数据未充分,当前Bar数据数量：{0}，计算EMA需要：{1}'.
                              format(len(self.lineBar), max(7, self.inputEma1Len, self.inputEma2Len)+2))
             return
 
+        # 前InputN周期(不包含当前周期）收盘价的EMA，数据长度等于周期，即以简单平均作为EMA的初始值
+
         # 计算第一条EMA均线
         if self.inputEma1Len > 0:
-
-            if self.inputEma1Len > l:
-                ema1Len = l
-            else:
-                ema1Len = self.inputEma1Len
-
-            # 3、获取前InputN周期(不包含当前周期）的自适应均线
-            listClose=[x.close for x in self.lineBar[-ema1Len - 1:-1]]
-
-            barEma1 = ta.EMA(numpy.array(listClose, dtype=float), ema1Len)[-1]
-
-            barEma1 = round(float(barEma1), 3)
+            barEma1 = round(self.ema1Window.getMean(), 3)
 
             if len(self.lineEma1) > self.inputEma1Len*8:
                 del self.lineEma1[0]
@@ -451,17 +547,7 @@ class CtaLineBar(object):
 
         # 计算第二条EMA均线
         if self.inputEma2Len > 0:
-
-            if self.inputEma2Len > l:
-                ema2Len = l
-            else:
-                ema2Len = self.inputEma2Len
-
-            # 3、获取前InputN周期(不包含当前周期）的自适应均线
-            listClose=[x.close for x in self.lineBar[-ema2Len - 1:-1]]
-            barEma2 = ta.EMA(numpy.array(listClose, dtype=float), ema2Len)[-1]
-
-            barEma2 = round(float(barEma2), 3)
+            barEma2 = round(self.ema2Window.getMean(), 3)
 
             if len(self.lineEma2) > self.inputEma1Len*8:
                 del self.lineEma2[0]
@@ -480,37 +566,19 @@ class CtaLineBar(object):
             return
 
 
-        # 2、根据当前High，Low，(不包含当前周期）重新计算TR1，PDM，MDM和ATR
-        barTr1 = EMPTY_FLOAT      # 获取InputP周期内的价差最大值之和
-        barPdm = EMPTY_FLOAT      # InputP周期内的做多价差之和
-        barMdm = EMPTY_FLOAT      # InputP周期内的做空价差之和
+        # 2、前inputDmiLen周期(不包含当前周期）的TR1，PDM，MDM之和
+        barTr1 = float(self.dmiTrWindow.getSum())       # InputP周期内的价差最大值之和
+        barPdm = self.dmiPdmWindow.getSum()             # InputP周期内的做多价差之和
+        barMdm = self.dmiMdmWindow.getSum()             # InputP周期内的做空价差之和
 
-        for i in range(len(self.lineBar)-2, len(self.lineBar)-2-self.inputDmiLen, -1):  # 周期 inputDmiLen
-            # 3.1、计算TR1
-
-            # 当前周期最高与最低的价差
-            high_low_spread = self.lineBar[i].high - self.lineBar[i].low
-            # 当前周期最高与昨收价的价差
-            high_preclose_spread = abs(self.lineBar[i].high - self.lineBar[i - 1].close)
-            # 当前周期最低与昨收价的价差
-            low_preclose_spread = abs(self.lineBar[i].low - self.lineBar[i - 1].close)
-
-            # 最大价差
-            max_spread = max(high_low_spread, high_preclose_spread, low_preclose_spread)
-            barTr1 = barTr1 + float(max_spread)
-
-            # 今高与昨高的价差
-            high_prehigh_spread = self.lineBar[i].high - self.lineBar[i - 1].high
-            # 昨低与今低的价差
-            low_prelow_spread = self.lineBar[i - 1].low - self.lineBar[i].low
-
-            # 3.2、计算周期内的做多价差之和
-            if high_prehigh_spread > 0 and high_prehigh_spread > low_prelow_spread:
-                barPdm = barPdm + high_prehigh_spread
-
-            # 3.3、计算周期内的做空价差之和
-            if low_prelow_spread > 0 and low_prelow_spread > high_prehigh_spread:
-                barMdm = barMdm + low_prelow_spread
+        # 已完成的K线只有inputDmiLen根时，最早一根和原先按序号向前取K线一样以当前周期作为前一根
+        if not self.dmiTrWindow.isFull():
+            bar = self.lineBar[0]
+            preBar = self.lineBar[-1]
+            pdm, mdm = getDirectionalMovement(bar.high, bar.low, preBar.high, preBar.low)
+            barTr1 += getTrueRange(bar.high, bar.low, preBar.close)
+            barPdm += pdm
+            barMdm += mdm
 
         # 6、计算上升动向指标，即做多的比率
         if barTr1 == 0:
@@ -541,15 +609,21 @@ class CtaLineBar(object):
         self.lineMdi.append(self.barMdi)
 
         if len(self.lineDx) > self.inputDmiLen+1:
+            self.dxSum -= self.lineDx[0]
             del self.lineDx[0]
 
         self.lineDx.append(dx)
+        self.dxSum += dx
 
-        # 平均趋向指标，MA计算
+        # 平均趋向指标，lineDx的EMA：前inputDmiLen个的平均作为初始值，之后递推
         if len(self.lineDx) < self.inputDmiLen+1:
             self.barAdx = dx
         else:
-            self.barAdx = ta.EMA(numpy.array(self.lineDx, dtype=float), self.inputDmiLen)[-1]
+            n = len(self.lineDx) - self.inputDmiLen
+            k = 2.0 / (self.inputDmiLen + 1)
+            self.barAdx = (self.dxSum - sum(self.lineDx[-n:])) / self.inputDmiLen
+            for value in self.lineDx[-n:]:
+                self.barAdx = (value - self.barAdx) * k + self.barAdx
 
         # 保存Adx值
         if len(self.lineAdx) > self.inputDmiLen+1:
@@ -707,9 +781,8 @@ class CtaLineBar(object):
                              format(len(self.lineBar), self.inputVolLen+1))
             return
 
-        listVol = [x.volume for x in self.lineBar[-self.inputVolLen-1: -1]]
-
-        sumVol = ta.SUM(numpy.array(listVol, dtype=float), timeperiod=self.inputVolLen)[-1]
+        # 前inputVolLen周期(不包含当前周期）的成交量之和
+        sumVol = float(self.volWindow.getSum())
 
         avgVol = round(sumVol/self.inputVolLen, 0)
 
@@ -728,9 +801,18 @@ class CtaLineBar(object):
             return
 
         # 3、inputRsiLen(包含当前周期）的相对强弱
-        listClose=[x.close for x in self.lineBar[-self.inputRsiLen - 2:]]
-        barRsi = ta.RSI(numpy.array(listClose, dtype=float), self.inputRsiLen)[-1]
-        barRsi = round(float(barRsi), 3)
+        # 前inputRsiLen个涨跌(不包含当前周期）的平均作为初始值，再加入当前周期的涨跌做一次Wilder平滑
+        n = self.inputRsiLen
+        avgGain = self.rsiGainWindow.getSum() / float(n) * (n - 1)
+        avgLoss = self.rsiLossWindow.getSum() / float(n) * (n - 1)
+
+        diff = self.lineBar[-1].close - self.lineBar[-2].close
+        if diff < 0:
+            avgLoss -= diff
+        else:
+            avgGain += diff
+
+        barRsi = round(getRsi(avgGain / n, avgLoss / n), 3)
 
         l = len(self.lineRsi)
         if l > self.inputRsiLen*8:
@@ -787,9 +869,13 @@ class CtaLineBar(object):
                              format(len(self.lineBar), self.inputCmiLen))
             return
 
-        listClose =[x.close for x in self.lineBar[-self.inputCmiLen:]]
-        hhv = max(listClose)
-        llv = min(listClose)
+        # inputCmiLen周期(包含当前周期）收盘价的最高和最低
+        close = self.lineBar[-1].close
+        if self.cmiHighWindow is not None:
+            hhv = max(self.cmiHighWindow.value, close)
+            llv = min(self.cmiLowWindow.value, close)
+        else:
+            hhv = llv = close
 
         if hhv==llv:
             cmi = 100
@@ -805,7 +891,7 @@ class CtaLineBar(object):
 
     def __recountBoll(self):
         """布林特线"""
-        if self.inputBollLen < EMPTY_INT: return
+        if self.inputBollLen <= EMPTY_INT: return
 
         l = len(self.lineBar)
 
@@ -814,21 +900,13 @@ class CtaLineBar(object):
                              format(len(self.lineBar), min(7, self.inputBollLen)+1))
             return
 
-        if l < self.inputBollLen+2:
-            bollLen = l-1
-        else:
-            bollLen = self.inputBollLen
-
-        # 不包含当前最新的Bar
-        listClose=[x.close for x in self.lineBar[-bollLen - 1:-1]]
-        #
-        upper, middle, lower = ta.BBANDS(numpy.array(listClose, dtype=float),
-                                         timeperiod=bollLen, nbdevup=self.inputBollStdRate,
-                                         nbdevdn=self.inputBollStdRate, matype=0)
-
-        self.lineUpperBand.append(upper[-1])
-        self.lineMiddleBand.append(middle[-1])
-        self.lineLowerBand.append(lower[-1])
+        # 前inputBollLen周期（不足时为全部已完成的K线，不包含当前最新的Bar）收盘价的均值和总体标准差
+        middle = self.bollWindow.getMean()
+        width = self.bollWindow.getStd() * self.inputBollStdRate
+
+        self.lineUpperBand.append(middle + width)
+        self.lineMiddleBand.append(middle)
+        self.lineLowerBand.append(middle - width)
 
 
     # ----------------------------------------------------------------------
@@ -0,0 +1,230 @@
+# encoding: UTF-8
+
+'''
+Tick数据内存占用和转换开销测试脚本。
+
+从行情记录引擎保存的TICK数据库中读取某个合约一天的tick（数据库不可用或
+没有数据时使用合成数据），分别用原先基于__dict__的数据类（VtTickData之后
+再复制为CtaTickData和DrTickData）以及现在基于__slots__、直接共享VtTickData
+的方式回放，统计每个tick的内存占用、创建的对象数量和转换耗时。
+
+用法：python dataBenchmark.py [合约代码] [日期YYYYMMDD]
+'''
+
+import sys
+import gc
+from datetime import datetime, timedelta
+from time import time
+
+from vtGateway import VtTickData
+from ctaAlgo.ctaBase import CtaTickData
+from dataRecorder.drBase import DrTickData, TICK_DB_NAME
+from vtFunction import loadMongoSetting
+from vtTime import parseTickDatetime
+
+
+# gateway回调时需要填充的字段
+FILL_FIELD_LIST = [name for name in VtTickData.getFieldList()
+                   if name not in ('gatewayName', 'rawData', 'datetime')]
+
+
+########################################################################
+class LegacyData(object):
+    """原先使用__dict__保存字段的数据类，字段和默认值取自对应的__slots__数据类"""
+    templateClass = None
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        template = self.templateClass()
+        for name in self.templateClass.getFieldList():
+            setattr(self, name, getattr(template, name))
+
+
+########################################################################
+class LegacyVtTickData(LegacyData):
+    """原VtTickData"""
+    templateClass = VtTickData
+
+
+########################################################################
+class LegacyCtaTickData(LegacyData):
+    """原CtaTickData"""
+    templateClass = CtaTickData
+
+
+########################################################################
+class LegacyDrTickData(LegacyData):
+    """原DrTickData"""
+    templateClass = DrTickData
+
+
+#----------------------------------------------------------------------
+def loadTicks(vtSymbol, date):
+    """从数据库读取某个合约一天的tick数据，返回字典列表"""
+    try:
+        import pymongo
+        host, port, logging = loadMongoSetting()
+        client = pymongo.MongoClient(host, port, serverSelectionTimeoutMS=1000)
+        client.server_info()
+        collection = client[TICK_DB_NAME][vtSymbol]
+        return list(collection.find({'date': date}))
+    except Exception, e:
+        print u'读取数据库失败：%s' % e
+        return []
+
+
+#----------------------------------------------------------------------
+def generateTicks(vtSymbol, date, count=60000):
+    """生成合成的tick数据（每0.5秒一个tick），返回字典列表"""
+    start = datetime.strptime(date + ' 09:00:00', '%Y%m%d %H:%M:%S')
+    step = timedelta(milliseconds=500)
+
+    l = []
+    price = 3400.0
+    for i in xrange(count):
+        dt = start + step * i
+        price += (i % 7 - 3) * 0.2
+        d = {}
+        d['vtSymbol'] = vtSymbol
+        d['symbol'] = vtSymbol
+        d['exchange'] = 'CFFEX'
+        d['date'] = date
+        d['time'] = dt.strftime('%H:%M:%S.%f')[:10]
+        d['lastPrice'] = price
+        d['volume'] = i
+        d['openInterest'] = 50000
+        d['bidPrice1'] = price - 0.2
+        d['askPrice1'] = price + 0.2
+        d['bidVolume1'] = 5
+        d['askVolume1'] = 5
+        l.append(d)
+    return l
+
+
+#----------------------------------------------------------------------
+def fillTick(tick, d):
+    """模拟gateway回调中逐个字段赋值"""
+    for name in FILL_FIELD_LIST:
+        if name in d:
+            setattr(tick, name, d[name])
+
+
+#----------------------------------------------------------------------
+def legacyPipeline(rawList):
+    """原先的处理方式：VtTickData复制为CtaTickData和DrTickData"""
+    out = []
+    for d in rawList:
+        tick = LegacyVtTickData()
+        fillTick(tick, d)
+
+        # CtaEngine.processTickEvent
+        ctaTick = LegacyCtaTickData()
+        dd = ctaTick.__dict__
+        for key in dd.keys():
+            if key != 'datetime':
+                dd[key] = tick.__getattribute__(key)
+        ctaTick.datetime = datetime.strptime(' '.join([tick.date, tick.time]), '%Y%m%d %H:%M:%S.%f')
+
+        # DrEngine.procecssTickEvent
+        drTick = LegacyDrTickData()
+        dd = drTick.__dict__
+        for key in dd.keys():
+            if key != 'datetime':
+                dd[key] = tick.__getattribute__(key)
+        drTick.datetime = datetime.strptime(' '.join([tick.date, tick.time]), '%Y%m%d %H:%M:%S.%f')
+        dbDict = drTick.__dict__
+
+        out.append((tick, ctaTick, drTick))
+    return out
+
+
+#----------------------------------------------------------------------
+def slotsPipeline(rawList):
+    """现在的处理方式：各引擎直接共享VtTickData"""
+    drFieldList = DrTickData.getFieldList()
+
+    out = []
+    for d in rawList:
+        tick = VtTickData()
+        fillTick(tick, d)
+
+        # CtaEngine.processTickEvent
+        if tick.datetime is None:
+            tick.datetime = parseTickDatetime(tick.date, tick.time)
+
+        # DrEngine.procecssTickEvent
+        if tick.datetime is None:
+            tick.datetime = parseTickDatetime(tick.date, tick.time)
+        dbDict = tick.toDict(drFieldList)
+
+        out.append((tick,))
+    return out
+
+
+#----------------------------------------------------------------------
+def getObjectSize(obj):
+    """计算对象本身及其__dict__的字节数（__slots__对象的__dict__是临时生成的，不计入）"""
+    size = sys.getsizeof(obj)
+    if not hasattr(type(obj), '__slots__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+#----------------------------------------------------------------------
+def runPipeline(func, rawList):
+    """运行处理流程，返回（耗时，每个tick的GC对象数，每个tick常驻的字节数）"""
+    gc.collect()
+    gc.disable()
+    count0 = len(gc.get_objects())
+    start = time()
+    out = func(rawList)
+    cost = time() - start
+    count1 = len(gc.get_objects())
+    gc.enable()
+
+    size = 0
+    for objTuple in out:
+        for obj in objTuple:
+            size += getObjectSize(obj)
+            if obj.datetime is not None:
+                size += sys.getsizeof(obj.datetime)
+
+    n = len(rawList)
+    return cost, float(count1 - count0 - 1) / n, float(size) / n
+
+
+#----------------------------------------------------------------------
+def benchmark(vtSymbol='IF0000', date=None):
+    """对比两种处理方式的内存占用和转换开销"""
+    if not date:
+        date = (datetime.today() - timedelta(days=1)).strftime('%Y%m%d')
+
+    rawList = loadTicks(vtSymbol, date)
+    if rawList:
+        print u'从数据库读取%s在%s的tick数据，共%s个' % (vtSymbol, date, len(rawList))
+    else:
+        rawList = generateTicks(vtSymbol, date)
+        print u'数据库中没有%s在%s的tick数据，使用%s个合成数据' % (vtSymbol, date, len(rawList))
+
+    print u'单个对象字节数：原VtTickData %s，原CtaTickData %s，原DrTickData %s，现VtTickData %s' % (
+        getObjectSize(LegacyVtTickData()), getObjectSize(LegacyCtaTickData()),
+        getObjectSize(LegacyDrTickData()), getObjectSize(VtTickData()))
+
+    pipelineList = [(u'原__dict__复制方式', legacyPipeline),
+                    (u'__slots__共享方式', slotsPipeline)]
+
+    baseline = None
+    for name, func in pipelineList:
+        cost, objects, size = runPipeline(func, rawList)
+        if baseline is None:
+            baseline = (cost, size)
+        print u'%s：耗时%.2f秒，每个tick耗时%.2f微秒，GC对象%.1f个，常驻内存%.0f字节（耗时为原方式的%.0f%%，内存为原方式的%.0f%%）' % (
+            name, cost, cost / len(rawList) * 1000000, objects, size,
+            cost / baseline[0] * 100, size / baseline[1] * 100)
+
+
+if __name__ == '__main__':
+    vtSymbol = sys.argv[1] if len(sys.argv) > 1 else 'IF0000'
+    date = sys.argv[2] if len(sys.argv) > 2 else None
+    benchmark(vtSymbol, date)
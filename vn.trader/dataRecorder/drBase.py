@@ -22,11 +22,16 @@ MINUTE5_DB_NAME = 'VnTrader_5Min_Db'
 
 # CTA引擎中涉及的数据类定义
 from vtConstant import EMPTY_UNICODE, EMPTY_STRING, EMPTY_FLOAT, EMPTY_INT
+from vtGateway import VtSlotsData
 
 
 ########################################################################
-class DrBarData(object):
+class DrBarData(VtSlotsData):
     """K线数据"""
+    __slots__ = ('vtSymbol', 'symbol', 'exchange',
+                 'open', 'high', 'low', 'close',
+                 'date', 'time', 'datetime',
+                 'volume', 'openInterest')
 
     #----------------------------------------------------------------------
     def __init__(self):
@@ -49,8 +54,16 @@ class DrBarData(object):
 
 
 ########################################################################
-class DrTickData(object):
+class DrTickData(VtSlotsData):
     """Tick数据"""
+    __slots__ = ('vtSymbol', 'symbol', 'exchange',
+                 'lastPrice', 'openPrice', 'highPrice', 'lowPrice', 'volume', 'openInterest',
+                 'upperLimit', 'lowerLimit',
+                 'date', 'time', 'datetime',
+                 'bidPrice1', 'bidPrice2', 'bidPrice3', 'bidPrice4', 'bidPrice5',
+                 'askPrice1', 'askPrice2', 'askPrice3', 'askPrice4', 'askPrice5',
+                 'bidVolume1', 'bidVolume2', 'bidVolume3', 'bidVolume4', 'bidVolume5',
+                 'askVolume1', 'askVolume2', 'askVolume3', 'askVolume4', 'askVolume5')
 
     #----------------------------------------------------------------------
     def __init__(self):
@@ -8,7 +8,6 @@
 
 import json
 import os
-import copy
 from collections import OrderedDict
 from datetime import datetime, timedelta
 from threading import Thread
@@ -18,6 +17,9 @@ from eventEngine import *
 from vtGateway import VtSubscribeReq, VtLogData
 from drBase import *
 from vtFunction import todayDate
+from vtTime import parseTickDatetime, getMinuteOfDay, compileSession, getSessionTable
+from ctaTickFile import TickFileWriter
+from ctaBarAggregator import BarGenerator
 
 
 ########################################################################
@@ -43,9 +45,8 @@ class DrEngine(object):
         # Tick对象字典
         self.tickDict = {}
         
-        # K线对象字典
-        self.barDict = {}
-        self.m5barDict = {}
+        # K线合成对象字典，key为合约代码，value为BarGenerator（按交易时段合成1分钟和5分钟K线）
+        self.barGeneratorDict = {}
         self.daybarDict = {}
 
         #负责执行数据库插入的单独线程相关
@@ -55,9 +56,13 @@ class DrEngine(object):
 
         # 交易时间字典
         self.timeDict = {}
+        
+        # 交易时段的分钟位图字典，key为合约代码，value为compileSession生成的位图
+        self.tickSessionDict = {}       # 记录tick和日线的时段（包含开始时间）
 
-        # 每分钟的的第一个tick的成交量
-        self.firstvolumes ={}
+        # Tick文件目录，不为空时同时把Tick写入二进制Tick文件（用于回测）
+        self.tickFileDir = ''
+        self.tickWriterDict = {}        # key为合约代码，value为(日期, TickFileWriter)
 
         # 载入设置，订阅行情
         self.loadSetting()
@@ -77,8 +82,8 @@ class DrEngine(object):
                 l = setting['tick']
                 
                 for symbol, gatewayName in l:
-                    drTick = DrTickData()           # 该tick实例可以用于缓存部分数据（目前未使用）
-                    self.tickDict[symbol] = drTick
+                    tick = DrTickData()           # 该tick实例可以用于缓存部分数据（目前未使用）
+                    self.tickDict[symbol] = tick
 
                     req = VtSubscribeReq()
                     req.symbol = symbol
@@ -88,10 +93,7 @@ class DrEngine(object):
                 l = setting['bar']
                 
                 for symbol, gatewayName in l:
-                    bar = DrBarData()
-                    self.barDict[symbol] = bar
-                    m5bar = DrBarData()
-                    self.m5barDict[symbol] = m5bar
+                    self.barGeneratorDict[symbol] = None        # 读取交易时段之后再创建
                     daybar = DrBarData()
                     self.daybarDict[symbol] = daybar
                     
@@ -105,8 +107,21 @@ class DrEngine(object):
                 for activeSymbol, symbol in d.items():
                     self.activeSymbolDict[symbol] = activeSymbol
 
+            if 'tickFileDir' in setting:
+                self.tickFileDir = setting['tickFileDir']
+
             if 'time' in setting:
                 self.timeDict = setting['time']
+                
+                for symbol, times in self.timeDict.items():
+                    self.tickSessionDict[symbol] = compileSession(times)
+
+            # 创建K线合成对象，配置了交易时段的合约使用配置的时段，否则使用品种默认的时段
+            for symbol in self.barGeneratorDict.keys():
+                sessionTable = getSessionTable(symbol, self.timeDict.get(symbol))
+                generator = BarGenerator(symbol, self.getBarCallback(symbol), sessionTable)
+                generator.addPeriod(5)
+                self.barGeneratorDict[symbol] = generator
             
             #启动数据插入线程
             self.start()
@@ -120,87 +135,47 @@ class DrEngine(object):
         tick = event.dict_['data']
         vtSymbol = tick.vtSymbol
 
-        # 转化Tick格式
-        drTick = DrTickData()
-        d = drTick.__dict__
-        for key in d.keys():
-            if key != 'datetime':
-                d[key] = tick.__getattribute__(key)
-        drTick.datetime = datetime.strptime(' '.join([tick.date, tick.time]), '%Y%m%d %H:%M:%S.%f')            
+        # VtTickData已包含DrTickData的全部字段，直接使用，不再复制
+        # 若CTA引擎已解析过datetime则直接复用
+        if tick.datetime is None:
+            tick.datetime = parseTickDatetime(tick.date, tick.time)
         
         # 更新Tick数据
         if vtSymbol in self.tickDict and self.tickInTime(tick):
-            self.insertData(TICK_DB_NAME, vtSymbol, drTick)
+            # 只插入DrTickData中定义的字段，保持数据库中的格式不变
+            d = tick.toDict(DrTickData.getFieldList())
+            self.insertData(TICK_DB_NAME, vtSymbol, d)
+            if self.tickFileDir:
+                self.writeTickFile(vtSymbol, tick)
             
             if vtSymbol in self.activeSymbolDict:
                 activeSymbol = self.activeSymbolDict[vtSymbol]
-                self.insertData(TICK_DB_NAME, activeSymbol, drTick)
+                self.insertData(TICK_DB_NAME, activeSymbol, d)
+                if self.tickFileDir:
+                    self.writeTickFile(activeSymbol, tick)
             
             # 发出日志
             self.writeDrLog(u'记录Tick数据%s，时间:%s, last:%s, bid:%s, ask:%s' 
-                            %(drTick.vtSymbol, drTick.time, drTick.lastPrice, drTick.bidPrice1, drTick.askPrice1))
+                            %(tick.vtSymbol, tick.time, tick.lastPrice, tick.bidPrice1, tick.askPrice1))
             
-        # 更新分钟线数据
-        if vtSymbol in self.barDict :
-            bar = self.barDict[vtSymbol]
-            #if bar.datetime  and bar.datetime - drTick.datetime > timedelta(0,600) \
-            #       and datetime.strptime(drTick.time,"%H:%M:%S.%f").replace(second=0,microsecond=0) != \
-            #              datetime.strptime("00:00","%H:%M"):
-            #   bar.vtSymbol = None
-            #   bar.datetime = None
-            # 如果第一个TICK或者新的一分钟
-            if not bar.datetime or bar.datetime.minute != drTick.datetime.minute:
-                if bar.vtSymbol and self.barInTime(tick):
-                    newBar = copy.copy(bar)
-                    newBar.datetime = drTick.datetime.replace(second=0, microsecond=0)
-                    newBar.date = drTick.date
-                    newBar.time = drTick.time
-                    self.insertData(MINUTE_DB_NAME, vtSymbol, newBar)
-
-                    if vtSymbol in self.activeSymbolDict:
-                        activeSymbol = self.activeSymbolDict[vtSymbol]
-                        self.insertData(MINUTE_DB_NAME, activeSymbol, newBar)
-
-                    self.writeDrLog(u'记录分钟线数据%s，时间:%s, O:%s, H:%s, L:%s, C:%s'
-                                        % (newBar.vtSymbol, newBar.time, newBar.open, newBar.high,
-                                           newBar.low, newBar.close))
-                    #self.procecssBar(newBar)
-
-                bar.vtSymbol = drTick.vtSymbol
-                bar.symbol = drTick.symbol
-                bar.exchange = drTick.exchange
-                
-                bar.open = drTick.lastPrice
-                bar.high = drTick.lastPrice
-                bar.low = drTick.lastPrice
-                bar.close = drTick.lastPrice
-                
-                bar.date = drTick.date
-                bar.time = drTick.time
-                bar.datetime = drTick.datetime
-                self.firstvolumes[vtSymbol] = drTick.volume
-                bar.openInterest = drTick.openInterest        
-            # 否则继续累加新的K线
-            else:                               
-                bar.high = max(bar.high, drTick.lastPrice)
-                bar.low = min(bar.low, drTick.lastPrice)
-                bar.close = drTick.lastPrice
-                bar.volume = drTick.volume - self.firstvolumes[vtSymbol]  #最后一个tick的成交量和第一个tick的成交量的差是一分钟的成交量
-                bar.openInterest = drTick.openInterest    # 持仓量直接更新
+        # 更新分钟线数据，K线的切分规则见ctaBarAggregator
+        if vtSymbol in self.barGeneratorDict:
+            self.barGeneratorDict[vtSymbol].updateTick(tick)
+
         #更新日线数据
         if vtSymbol in self.daybarDict and self.tickInTime(tick):
-            if datetime.strptime(tick.time,"%H:%M:%S.%f").replace(second=0,microsecond=0) == datetime.strptime("15:00","%H:%M"):
+            if tick.datetime.hour == 15 and tick.datetime.minute == 0:
                 daybar = self.daybarDict[vtSymbol]
-                daybar.datetime = drTick.datetime.replace(hour=0,minute=0,second=0,microsecond=0)
-                daybar.date = drTick.date
-                daybar.time = drTick.time
-                daybar.exchange = drTick.exchange
-                daybar.open = drTick.openPrice
-                daybar.high = drTick.highPrice
-                daybar.low = drTick.lowPrice
-                daybar.close = drTick.lastPrice
-                daybar.volume = drTick.volume
-                daybar.openInterest = drTick.openInterest
+                daybar.datetime = tick.datetime.replace(hour=0,minute=0,second=0,microsecond=0)
+                daybar.date = tick.date
+                daybar.time = tick.time
+                daybar.exchange = tick.exchange
+                daybar.open = tick.openPrice
+                daybar.high = tick.highPrice
+                daybar.low = tick.lowPrice
+                daybar.close = tick.lastPrice
+                daybar.volume = tick.volume
+                daybar.openInterest = tick.openInterest
                 self.insertData(DAILY_DB_NAME, vtSymbol, daybar)
 
                 if vtSymbol in self.activeSymbolDict:
@@ -211,50 +186,37 @@ class DrEngine(object):
                                    daybar.low, daybar.close))
 
     #----------------------------------------------------------------------
-    def procecssBar(self,bar):
-        vtSymbol = bar.vtSymbol
-        if vtSymbol in self.m5barDict :
-            m5bar = self.m5barDict[vtSymbol]
-            if not  m5bar.datetime or bar.datetime.minute % 5 == 1:
-                m5bar.vtSymbol = bar.vtSymbol
-                m5bar.symbol = bar.vtSymbol
-                m5bar.exchange = bar.exchange
-
-                m5bar.open = bar.open
-                m5bar.high = bar.high
-                m5bar.low = bar.low
-                m5bar.close = bar.close
-                m5bar.date = bar.date
-                m5bar.time = bar.time
-                m5bar.datetime = bar.datetime
-                m5bar.volume = bar.volume
-                m5bar.openInterest = bar.openInterest
-            else:
-                m5bar.high = max(m5bar.high, bar.high)
-                m5bar.low = min(m5bar.low, bar.low)
-                m5bar.close = bar.close
-                m5bar.volume = m5bar.volume + bar.volume
-                m5bar.openInterest = bar.openInterest
-
-            if bar.datetime.minute % 5 == 0:
-                newBar = copy.copy(m5bar)
-                newBar.datetime = bar.datetime.replace(second=0,microsecond=0)
-                newBar.date = bar.date
-                newBar.time = bar.time
-                self.insertData(MINUTE5_DB_NAME, vtSymbol, newBar)
-
-                if vtSymbol in self.activeSymbolDict:
-                    activeSymbol = self.activeSymbolDict[vtSymbol]
-                    self.insertData(MINUTE5_DB_NAME, activeSymbol, newBar)
-
-                self.writeDrLog(u'记录5分钟线数据%s，时间:%s, O:%s, H:%s, L:%s, C:%s'
-                                    %(newBar.vtSymbol, newBar.time, newBar.open, newBar.high,
-                                      newBar.low, newBar.close))
-
-
-
+    def getBarCallback(self, vtSymbol):
+        """生成合约K线合成的回调函数"""
+        def onBar(period, bar):
+            self.processBar(vtSymbol, period, bar)
 
+        return onBar
 
+    #----------------------------------------------------------------------
+    def processBar(self, vtSymbol, period, bar):
+        """记录合成完成的1分钟或者5分钟K线"""
+        if period == 1:
+            dbName = MINUTE_DB_NAME
+            name = u'分钟线'
+        else:
+            dbName = MINUTE5_DB_NAME
+            name = u'%s分钟线' %period
+
+        # 合成的K线时间为开始时间，数据库中的K线时间为结束时间（如9:01表示9:00-9:01），保持格式不变
+        d = bar.toDict()
+        end = bar.datetime + timedelta(minutes=period)
+        d['datetime'] = end
+        d['date'] = end.strftime('%Y%m%d')
+        d['time'] = end.strftime('%H:%M:%S')
+        self.insertData(dbName, vtSymbol, d)
+
+        if vtSymbol in self.activeSymbolDict:
+            activeSymbol = self.activeSymbolDict[vtSymbol]
+            self.insertData(dbName, activeSymbol, d)
+
+        self.writeDrLog(u'记录%s数据%s，时间:%s, O:%s, H:%s, L:%s, C:%s'
+                        % (name, vtSymbol, d['time'], bar.open, bar.high, bar.low, bar.close))
 
     #----------------------------------------------------------------------
     def registerEvent(self):
@@ -263,9 +225,30 @@ class DrEngine(object):
  
     #----------------------------------------------------------------------
     def insertData(self, dbName, collectionName, data):
-        """插入数据到数据库（这里的data可以是CtaTickData或者CtaBarData）"""
+        """插入数据到数据库（这里的data可以是DrTickData、DrBarData或者已经转换好的字典）"""
        # self.mainEngine.dbInsert(dbName, collectionName, data.__dict__)
-        self.queue.put((dbName,collectionName,data.__dict__))
+        if not isinstance(data, dict):
+            data = data.__dict__
+        self.queue.put((dbName,collectionName,data))
+
+    #----------------------------------------------------------------------
+    def writeTickFile(self, symbol, tick):
+        """把Tick写入二进制Tick文件，每个合约每天一个文件：Tick文件目录/合约代码/日期.tick"""
+        if symbol in self.tickWriterDict:
+            date, writer = self.tickWriterDict[symbol]
+            if date != tick.date:
+                writer.close()
+                del self.tickWriterDict[symbol]
+
+        if symbol not in self.tickWriterDict:
+            path = os.path.join(self.tickFileDir, symbol)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            writer = TickFileWriter(os.path.join(path, tick.date + '.tick'),
+                                    symbol, tick.symbol, tick.exchange)
+            self.tickWriterDict[symbol] = (tick.date, writer)
+
+        self.tickWriterDict[symbol][1].append(tick)
 
     #-----------------------------------------------------------------------
     def run(self):
@@ -289,6 +272,10 @@ class DrEngine(object):
         if self.active:
             self.active = False
             self.thread.join()
+
+        for date, writer in self.tickWriterDict.values():
+            writer.close()
+        self.tickWriterDict.clear()
   
     #----------------------------------------------------------------------
 
@@ -302,34 +289,9 @@ class DrEngine(object):
 
     #-----------------------------------------------------------------------
     def tickInTime(self,d):
-        isSymbol = False
-        isTime = False
-        for symbol, times in self.timeDict.items():
-            if symbol == d.vtSymbol:
-                isSymbol = True
-            for time in times:
-                start = datetime.strptime(time[0],"%H:%M")
-                end = datetime.strptime(time[1],"%H:%M")
-                time1 = datetime.strptime(d.time,"%H:%M:%S.%f").replace(second=0,microsecond=0)
-                if time1 >= start and time1 <=end :
-                    isTime = True
-        if isSymbol and isTime:
-                return True
-       
-       
-       #-----------------------------------------------------------------------
-    def barInTime(self,d):
-        isSymbol = False
-        isTime = False
-        for symbol, times in self.timeDict.items():
-            if symbol == d.vtSymbol:
-                isSymbol = True
-            for time in times:
-                start = datetime.strptime(time[0],"%H:%M")
-                end = datetime.strptime(time[1],"%H:%M")
-                time1 = datetime.strptime(d.time,"%H:%M:%S.%f").replace(second=0,microsecond=0)
-                if time1 > start and time1 <=end or time1 == datetime.strptime("00:00","%H:%M"):
-                    isTime = True
-        if isSymbol and isTime:
-                return True
+        """检查tick是否处于该合约的交易时段内（包含时段开始的那一分钟）"""
+        bitmap = self.tickSessionDict.get(d.vtSymbol)
+        if bitmap is None:
+            return False
+        return bool(bitmap[getMinuteOfDay(d.time)])
 
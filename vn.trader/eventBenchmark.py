@@ -0,0 +1,141 @@
+# encoding: UTF-8
+
+'''
+事件引擎吞吐量测试脚本。
+
+用合成的VtTickData生成指定数量的EVENT_TICK事件，分别交给原先的单队列
+处理循环和EventEngine2（逐个处理以及批量处理模式）回放，统计每秒处理的
+事件数量。
+
+用法：python eventBenchmark.py [事件数量] [批量大小]
+'''
+
+import sys
+from collections import defaultdict
+from Queue import Queue, Empty
+from threading import Thread, Event as ThreadingEvent
+from time import time
+
+from eventEngine import EventEngine2, Event
+from eventType import EVENT_TICK
+from vtGateway import VtTickData
+
+
+########################################################################
+class LegacyEventLoop(object):
+    """原先EventEngine2的处理循环（单队列、每个事件查询字典并生成列表）"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.queue = Queue()
+        self.active = False
+        self.thread = Thread(target=self.run)
+        self.handlers = defaultdict(list)
+
+    # ----------------------------------------------------------------------
+    def run(self):
+        """处理循环"""
+        while self.active == True:
+            try:
+                event = self.queue.get(block=True, timeout=1)
+                self.process(event)
+            except Empty:
+                pass
+
+    # ----------------------------------------------------------------------
+    def process(self, event):
+        """处理事件"""
+        if event.type_ in self.handlers:
+            [handler(event) for handler in self.handlers[event.type_]]
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """启动"""
+        self.active = True
+        self.thread.start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        """停止"""
+        self.active = False
+        self.thread.join()
+
+    # ----------------------------------------------------------------------
+    def register(self, type_, handler):
+        """注册处理函数"""
+        self.handlers[type_].append(handler)
+
+    # ----------------------------------------------------------------------
+    def put(self, event):
+        """存入事件"""
+        self.queue.put(event)
+
+
+# ----------------------------------------------------------------------
+def generateEvents(count):
+    """生成合成的tick事件列表"""
+    tick = VtTickData()
+    tick.symbol = 'IF1706'
+    tick.exchange = 'CFFEX'
+    tick.vtSymbol = 'IF1706'
+    tick.date = '20170510'
+    tick.time = '09:30:00.5'
+    tick.lastPrice = 3400.0
+
+    l = []
+    for i in xrange(count):
+        event = Event(type_=EVENT_TICK)
+        event.dict_['data'] = tick
+        l.append(event)
+    return l
+
+
+# ----------------------------------------------------------------------
+def runEngine(engine, events):
+    """把所有事件放入引擎后启动，返回处理全部事件所用的秒数"""
+    finished = ThreadingEvent()
+    total = len(events)
+    counter = [0]
+
+    def onTick(event):
+        counter[0] += 1
+        if counter[0] == total:
+            finished.set()
+
+    engine.register(EVENT_TICK, onTick)
+
+    for event in events:
+        engine.put(event)
+
+    start = time()
+    engine.start()
+    finished.wait()
+    cost = time() - start
+    engine.stop()
+    return cost
+
+
+# ----------------------------------------------------------------------
+def benchmark(count=1000000, batchSize=100):
+    """对比不同处理循环的吞吐量"""
+    events = generateEvents(count)
+
+    engineList = [(u'原单队列循环', LegacyEventLoop()),
+                  (u'EventEngine2逐个处理', EventEngine2()),
+                  (u'EventEngine2批量处理(%s)' % batchSize, EventEngine2(batchSize))]
+
+    baseline = None
+    for name, engine in engineList:
+        cost = runEngine(engine, events)
+        rate = count / cost
+        if baseline is None:
+            baseline = rate
+        print u'%s：%s个事件，耗时%.2f秒，每秒%.0f个事件，相对原循环%.2f倍' % (name, count, cost,
+                                                                        rate, rate / baseline)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    batchSize = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    benchmark(count, batchSize)
@@ -2,9 +2,10 @@
 
 # 系统模块
 from Queue import Queue, Empty
-from threading import Thread
+from threading import Thread, Condition, Lock
+import time
 from time import sleep
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 
 # 第三方模块
 from PyQt4.QtCore import QTimer
@@ -13,6 +14,20 @@ from PyQt4.QtCore import QTimer
 from eventType import *
 
 
+# 事件通道（优先级从高到低）
+EVENT_LANE_TRADING = 0      # 交易相关：委托、成交
+EVENT_LANE_MARKET = 1       # 行情相关：tick
+EVENT_LANE_DEFAULT = 2      # 其他：计时器、日志、持仓、账户等
+EVENT_LANE_COUNT = 3
+
+EVENT_LANE_NAME = ['trading', 'market', 'default']
+
+# 事件类型前缀和通道的映射，未匹配的事件类型归入EVENT_LANE_DEFAULT
+EVENT_LANE_PREFIX = [(EVENT_ORDER, EVENT_LANE_TRADING),
+                     (EVENT_TRADE, EVENT_LANE_TRADING),
+                     (EVENT_TICK, EVENT_LANE_MARKET)]
+
+
 ########################################################################
 class EventEngine(object):
     """
@@ -160,13 +175,43 @@ class EventEngine(object):
 class EventEngine2(object):
     """
     计时器使用python线程的事件驱动引擎
+
+    事件按照类型划分到不同优先级的通道（lane）中：
+    EVENT_LANE_TRADING：委托、成交等交易相关事件，优先级最高
+    EVENT_LANE_MARKET：行情相关事件
+    EVENT_LANE_DEFAULT：计时器、日志、持仓、账户等其他事件，优先级最低
+
+    处理线程每次总是从优先级最高的非空通道中取出事件，同一通道内
+    保持先进先出的顺序，因此突发的日志事件不会延误委托和成交回报。
+
+    通过registerConflated注册的处理函数采用合并推送：每个key（默认为
+    vtSymbol）只保留最新的一个事件，处理函数来不及处理时过期的事件会被
+    直接丢弃，适用于GUI监控等慢速消费者；通过register注册的处理函数
+    仍然会收到每一个事件。
+
+    batchSize为每次唤醒时从同一通道中最多取出的事件数量，默认为1
+    即逐个处理；设为更大的值时进入高吞吐模式，批量处理可以减少加锁
+    次数，但高优先级事件最多需要等待一个批次处理完成。
     """
 
     # ----------------------------------------------------------------------
-    def __init__(self):
+    def __init__(self, batchSize=1):
         """初始化事件引擎"""
-        # 事件队列
-        self.__queue = Queue()
+        # 每次唤醒时批量处理的最大事件数量
+        self.__batchSize = max(int(batchSize), 1)
+
+        # 事件通道，每个通道是一个双端队列，保存(入队时间, 事件)元组
+        self.__lanes = [deque() for i in range(EVENT_LANE_COUNT)]
+
+        # 通道条件变量，处理线程空闲等待时由put通知
+        self.__condition = Condition()
+        self.__waiting = False
+
+        # 事件类型到通道的映射缓存，首次出现时按照前缀规则解析
+        self.__laneDict = {}
+
+        # 通道统计数据，仅在处理线程中更新
+        self.__laneStats = [LaneStats() for i in range(EVENT_LANE_COUNT)]
 
         # 事件引擎开关
         self.__active = False
@@ -183,27 +228,57 @@ class EventEngine2(object):
         # 其中每个键对应的值是一个列表，列表中保存了对该事件进行监听的函数功能
         self.__handlers = defaultdict(list)
 
+        # 处理函数元组的缓存，仅在注册和注销时重建，处理事件时直接读取
+        self.__handlerCache = {}
+
+        # 合并推送的订阅，key为事件类型，value为ConflatedHandler对象的元组
+        self.__conflatedDict = {}
+
     # ----------------------------------------------------------------------
     def __run(self):
         """引擎运行"""
+        laneList = list(enumerate(self.__lanes))
+        laneStats = self.__laneStats
+        condition = self.__condition
+        batchSize = self.__batchSize
+
         while self.__active == True:
-            try:
-                event = self.__queue.get(block=True, timeout=1)  # 获取事件的阻塞时间设为1秒
+            # 从优先级最高的非空通道中取出一批事件，deque的popleft是线程安全的，
+            # 只有处理线程会取出事件，因此非空检查之后的取出无需加锁
+            for lane, q in laneList:
+                if q:
+                    break
+            else:
+                self.__wait()
+                continue
+
+            if batchSize == 1:
+                batch = (q.popleft(),)
+            else:
+                batch = [q.popleft() for i in range(min(len(q), batchSize))]
+
+            stats = laneStats[lane]
+            for putTime, event in batch:
+                stats.update(time.time() - putTime)
                 self.__process(event)
-            except Empty:
-                pass
+
+    # ----------------------------------------------------------------------
+    def __wait(self):
+        """所有通道为空时阻塞等待，由put或stop唤醒"""
+        with self.__condition:
+            self.__waiting = True
+            while self.__active and not any(self.__lanes):
+                self.__condition.wait()
+            self.__waiting = False
 
     # ----------------------------------------------------------------------
     def __process(self, event):
         """处理事件"""
-        # 检查是否存在对该事件进行监听的处理函数
-        if event.type_ in self.__handlers:
-            # 若存在，则按顺序将事件传递给处理函数执行
-            [handler(event) for handler in self.__handlers[event.type_]]
-
-            # 以上语句为Python列表解析方式的写法，对应的常规循环写法为：
-            # for handler in self.__handlers[event.type_]:
-            # handler(event)
+        # 从缓存中获取该事件的处理函数元组，若存在则按顺序传递给处理函数执行
+        handlers = self.__handlerCache.get(event.type_)
+        if handlers:
+            for handler in handlers:
+                handler(event)
 
     # ----------------------------------------------------------------------
     def __runTimer(self):
@@ -234,8 +309,10 @@ class EventEngine2(object):
     # ----------------------------------------------------------------------
     def stop(self):
         """停止引擎"""
-        # 将引擎设为停止
-        self.__active = False
+        # 将引擎设为停止，并唤醒处理线程
+        with self.__condition:
+            self.__active = False
+            self.__condition.notify()
 
         # 停止计时器
         self.__timerActive = False
@@ -254,6 +331,9 @@ class EventEngine2(object):
         if handler not in handlerList:
             handlerList.append(handler)
 
+        # 重建该事件类型的处理函数缓存
+        self.__handlerCache[type_] = tuple(handlerList)
+
     # ----------------------------------------------------------------------
     def unregister(self, type_, handler):
         """注销事件处理函数监听"""
@@ -267,12 +347,209 @@ class EventEngine2(object):
         # 如果函数列表为空，则从引擎中移除该事件类型
         if not handlerList:
             del self.__handlers[type_]
+            self.__handlerCache.pop(type_, None)
+        else:
+            self.__handlerCache[type_] = tuple(handlerList)
+
+    # ----------------------------------------------------------------------
+    def registerConflated(self, type_, handler, keyFunc=None):
+        """
+        注册合并推送的事件处理函数
+        keyFunc用于从事件中获取合并的key，默认使用事件数据的vtSymbol
+        """
+        conflatedTuple = self.__conflatedDict.get(type_, ())
+        for conflated in conflatedTuple:
+            if conflated.handler == handler:
+                return
 
-            # ----------------------------------------------------------------------
+        conflated = ConflatedHandler(handler, keyFunc or getConflateKey)
 
+        # 合并后的推送通过一个私有的事件类型触发，和原事件处于同一通道
+        self.setEventLane(conflated.flushType, self.getEventLane(type_))
+        self.register(conflated.flushType, conflated.flush)
+
+        self.__conflatedDict[type_] = conflatedTuple + (conflated,)
+
+    # ----------------------------------------------------------------------
+    def unregisterConflated(self, type_, handler):
+        """注销合并推送的事件处理函数"""
+        conflatedTuple = self.__conflatedDict.get(type_, ())
+        for conflated in conflatedTuple:
+            if conflated.handler == handler:
+                self.unregister(conflated.flushType, conflated.flush)
+                self.__laneDict.pop(conflated.flushType, None)
+
+                conflatedTuple = tuple(c for c in conflatedTuple if c is not conflated)
+                if conflatedTuple:
+                    self.__conflatedDict[type_] = conflatedTuple
+                else:
+                    del self.__conflatedDict[type_]
+                break
+
+    # ----------------------------------------------------------------------
     def put(self, event):
         """向事件队列中存入事件"""
-        self.__queue.put(event)
+        conflatedTuple = self.__conflatedDict.get(event.type_)
+        if conflatedTuple:
+            # 更新合并推送的最新事件，若尚无待处理的推送则存入触发事件
+            for conflated in conflatedTuple:
+                if conflated.update(event):
+                    self.__put(Event(type_=conflated.flushType))
+
+            # 没有普通处理函数时无需再存入原事件
+            if event.type_ not in self.__handlerCache:
+                return
+
+        self.__put(event)
+
+    # ----------------------------------------------------------------------
+    def __put(self, event):
+        """向事件所在通道存入事件"""
+        lane = self.getEventLane(event.type_)
+
+        q = self.__lanes[lane]
+        q.append((time.time(), event))
+
+        stats = self.__laneStats[lane]
+        if len(q) > stats.maxDepth:
+            stats.maxDepth = len(q)
+
+        # 只有处理线程在等待时才需要加锁唤醒
+        if self.__waiting:
+            with self.__condition:
+                self.__condition.notify()
+
+    # ----------------------------------------------------------------------
+    def getEventLane(self, type_):
+        """获取事件类型对应的通道"""
+        try:
+            return self.__laneDict[type_]
+        except KeyError:
+            lane = EVENT_LANE_DEFAULT
+            for prefix, l in EVENT_LANE_PREFIX:
+                if type_.startswith(prefix):
+                    lane = l
+                    break
+            self.__laneDict[type_] = lane
+            return lane
+
+    # ----------------------------------------------------------------------
+    def setEventLane(self, type_, lane):
+        """手动设置某个事件类型所在的通道"""
+        if lane not in (EVENT_LANE_TRADING, EVENT_LANE_MARKET, EVENT_LANE_DEFAULT):
+            raise ValueError(u'事件通道不存在：%s' % lane)
+        self.__laneDict[type_] = lane
+
+    # ----------------------------------------------------------------------
+    def getLaneStats(self):
+        """获取各通道的队列深度和等待时间统计"""
+        l = []
+        for lane, name in enumerate(EVENT_LANE_NAME):
+            stats = self.__laneStats[lane]
+            d = OrderedDict()
+            d['lane'] = name
+            d['depth'] = len(self.__lanes[lane])
+            d['maxDepth'] = stats.maxDepth
+            d['count'] = stats.count
+            d['avgWait'] = stats.totalWait / stats.count if stats.count else 0.0
+            d['maxWait'] = stats.maxWait
+            l.append(d)
+        return l
+
+    # ----------------------------------------------------------------------
+    def getConflatedStats(self):
+        """获取合并推送的统计数据（收到和实际推送的事件数量）"""
+        l = []
+        for type_, conflatedTuple in self.__conflatedDict.items():
+            for conflated in conflatedTuple:
+                d = OrderedDict()
+                d['type'] = type_
+                d['handler'] = conflated.handler
+                d['received'] = conflated.received
+                d['delivered'] = conflated.delivered
+                l.append(d)
+        return l
+
+    # ----------------------------------------------------------------------
+    def resetLaneStats(self):
+        """清空通道统计数据"""
+        self.__laneStats = [LaneStats() for i in range(EVENT_LANE_COUNT)]
+
+
+########################################################################
+class LaneStats(object):
+    """事件通道的统计数据"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.count = 0  # 已处理事件数量
+        self.totalWait = 0.0  # 累计等待时间（秒）
+        self.maxWait = 0.0  # 最大等待时间（秒）
+        self.maxDepth = 0  # 最大队列深度
+
+    # ----------------------------------------------------------------------
+    def update(self, wait):
+        """更新一个事件的等待时间"""
+        self.count += 1
+        self.totalWait += wait
+        if wait > self.maxWait:
+            self.maxWait = wait
+
+
+########################################################################
+class ConflatedHandler(object):
+    """
+    合并推送的处理函数包装
+    每个key只缓存最新的一个事件，推送时一次性把缓存的事件交给处理函数
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, handler, keyFunc):
+        """Constructor"""
+        self.handler = handler  # 实际的处理函数
+        self.keyFunc = keyFunc  # 获取合并key的函数
+
+        self.flushType = EVENT_CONFLATED_FLUSH + str(id(self))  # 触发推送的私有事件类型
+
+        self.__lock = Lock()
+        self.__latestDict = OrderedDict()  # key为合并key，value为最新的事件
+        self.__pending = False  # 是否已经存入了触发事件
+
+        self.received = 0  # 收到的事件数量
+        self.delivered = 0  # 实际推送的事件数量
+
+    # ----------------------------------------------------------------------
+    def update(self, event):
+        """缓存最新事件，返回是否需要存入新的触发事件"""
+        key = self.keyFunc(event)
+
+        with self.__lock:
+            self.received += 1
+            self.__latestDict[key] = event
+
+            if self.__pending:
+                return False
+            self.__pending = True
+            return True
+
+    # ----------------------------------------------------------------------
+    def flush(self, event):
+        """推送缓存的最新事件"""
+        with self.__lock:
+            latestDict = self.__latestDict
+            self.__latestDict = OrderedDict()
+            self.__pending = False
+
+        self.delivered += len(latestDict)
+        for e in latestDict.values():
+            self.handler(e)
+
+
+# ----------------------------------------------------------------------
+def getConflateKey(event):
+    """默认的合并key，使用事件数据的vtSymbol，没有时使用事件类型"""
+    return getattr(event.dict_.get('data'), 'vtSymbol', event.type_)
 
 
 ########################################################################
@@ -14,6 +14,7 @@
 # 系统相关
 EVENT_TIMER = 'eTimer'                  # 计时器事件，每隔1秒发送一次
 EVENT_LOG = 'eLog'                      # 日志事件，全局通用
+EVENT_CONFLATED_FLUSH = 'eConflatedFlush.'  # 合并推送的触发事件，后接订阅编号，由事件引擎内部使用
 
 # Gateway相关
 EVENT_TICK = 'eTick.'                   # TICK行情事件，可后接具体的vtSymbol
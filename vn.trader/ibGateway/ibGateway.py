@@ -105,6 +105,19 @@ accountKeyMap['AvailableFunds'] = 'available'
 accountKeyMap['MaintMarginReq'] = 'margin'
 
 
+########################################################################
+class IbTickData(VtTickData):
+    """IB接口的Tick数据，额外保存合约类型（VtTickData使用__slots__，无法动态增加属性）"""
+    __slots__ = ('m_secType',)
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        super(IbTickData, self).__init__()
+        
+        self.m_secType = EMPTY_STRING           # IB合约类型
+
+
 ########################################################################
 class IbGateway(VtGateway):
     """IB接口"""
@@ -197,12 +210,12 @@ class IbGateway(VtGateway):
         self.connection.reqContractDetails(self.tickerId, contract)
         
         # 创建Tick对象并保存到字典中
-        tick = VtTickData()
+        tick = IbTickData()
         tick.symbol = subscribeReq.symbol
         tick.exchange = subscribeReq.exchange
         tick.vtSymbol = '.'.join([tick.symbol, tick.exchange])
         tick.gatewayName = self.gatewayName
-        tick.__setattr__('m_secType', productClassMap.get(subscribeReq.productClass, ''))
+        tick.m_secType = productClassMap.get(subscribeReq.productClass, '')
         self.tickDict[self.tickerId] = tick
     
     #----------------------------------------------------------------------
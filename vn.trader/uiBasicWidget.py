@@ -4,6 +4,7 @@ import json
 import os
 import csv
 from collections import OrderedDict
+from threading import Lock
 import numpy as np
 import pyqtgraph as pg
 from pymongo import MongoClient
@@ -36,6 +37,55 @@ def loadFont():
 BASIC_FONT = loadFont()
 
 
+########################################################################
+class ConflatedSignal(QtCore.QObject):
+    """
+    GUI线程中的合并推送
+    事件引擎线程调用put缓存每个key（默认为vtSymbol）的最新事件，Qt事件队列中最多只有
+    一个待处理的信号，GUI线程处理信号时再把缓存的事件逐个交给handler，GUI刷新跟不上
+    行情时过期的事件直接丢弃
+    """
+    signal = QtCore.pyqtSignal()
+
+    #----------------------------------------------------------------------
+    def __init__(self, handler, parent=None, keyFunc=getConflateKey):
+        """Constructor，需要在GUI线程中创建"""
+        super(ConflatedSignal, self).__init__(parent)
+        
+        self.handler = handler  # GUI线程中的处理函数
+        self.keyFunc = keyFunc  # 获取合并key的函数
+        
+        self.lock = Lock()
+        self.latestDict = OrderedDict()  # key为合并key，value为最新的事件
+        self.pending = False             # 是否已经发出了尚未处理的信号
+        
+        self.signal.connect(self.flush)
+        
+    #----------------------------------------------------------------------
+    def put(self, event):
+        """缓存最新事件（在事件引擎线程中调用），尚无待处理的信号时发出信号"""
+        key = self.keyFunc(event)
+        
+        with self.lock:
+            self.latestDict[key] = event
+            if self.pending:
+                return
+            self.pending = True
+            
+        self.signal.emit()
+        
+    #----------------------------------------------------------------------
+    def flush(self):
+        """推送缓存的最新事件（在GUI线程中调用）"""
+        with self.lock:
+            latestDict = self.latestDict
+            self.latestDict = OrderedDict()
+            self.pending = False
+            
+        for event in latestDict.values():
+            self.handler(event)
+
+
 ########################################################################
 class BasicCell(QtGui.QTableWidgetItem):
     """基础的单元格"""
@@ -226,6 +276,9 @@ class BasicMonitor(QtGui.QTableWidget):
         # 默认不允许根据表头进行排序，需要的组件可以开启
         self.sorting = False
         
+        # 默认逐个接收事件，行情类组件可以开启合并推送，只刷新每个合约的最新数据
+        self.conflated = False
+        
         # 初始化右键菜单
         self.initMenu()
         
@@ -281,8 +334,12 @@ class BasicMonitor(QtGui.QTableWidget):
     #----------------------------------------------------------------------
     def registerEvent(self):
         """注册GUI更新相关的事件监听"""
-        self.signal.connect(self.updateEvent)
-        self.eventEngine.register(self.eventType, self.signal.emit)
+        if self.conflated:
+            self.conflatedSignal = ConflatedSignal(self.updateEvent, self)
+            self.eventEngine.register(self.eventType, self.conflatedSignal.put)
+        else:
+            self.signal.connect(self.updateEvent)
+            self.eventEngine.register(self.eventType, self.signal.emit)
         
     #----------------------------------------------------------------------
     def updateEvent(self, event):
@@ -361,6 +418,11 @@ class BasicMonitor(QtGui.QTableWidget):
         """设置是否允许根据表头排序"""
         self.sorting = sorting
 
+    #----------------------------------------------------------------------
+    def setConflated(self, conflated):
+        """设置是否使用合并推送（只接收每个key的最新事件）"""
+        self.conflated = conflated
+
     #-----------------------------------------------------------------------
     def clearRows(self):
         """清空表格"""
@@ -458,6 +520,9 @@ class MarketMonitor(BasicMonitor):
         self.setSorting(True)
 
         self.setSaveData(True)
+
+        # 行情刷新只需要最新的tick
+        self.setConflated(True)
         
         # 初始化表格
         self.initTable()
@@ -977,8 +1042,8 @@ class TradingWidget(QtGui.QFrame):
         self.labelReturn.setText('')
 
         # 重新注册事件监听
-        self.eventEngine.unregister(EVENT_TICK + self.symbol, self.signal.emit)
-        self.eventEngine.register(EVENT_TICK + vtSymbol, self.signal.emit)
+        self.eventEngine.unregister(EVENT_TICK + self.symbol, self.conflatedSignal.put)
+        self.eventEngine.register(EVENT_TICK + vtSymbol, self.conflatedSignal.put)
 
         # 订阅合约
         req = VtSubscribeReq()
@@ -1034,8 +1099,8 @@ class TradingWidget(QtGui.QFrame):
 
     #----------------------------------------------------------------------
     def connectSignal(self):
-        """连接Signal"""
-        self.signal.connect(self.updateTick)
+        """连接Signal，行情显示只需要最新的tick，在GUI线程中合并推送"""
+        self.conflatedSignal = ConflatedSignal(self.updateTick, self)
 
     #----------------------------------------------------------------------
     def sendOrder(self):
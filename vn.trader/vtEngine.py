@@ -9,7 +9,7 @@ from pymongo.errors import ConnectionFailure
 
 from eventEngine import *
 from vtGateway import *
-from vtFunction import loadMongoSetting
+from vtFunction import loadMongoSetting, loadCtaShardSetting
 
 from ctaAlgo.ctaEngine import CtaEngine
 from dataRecorder.drEngine import DrEngine
@@ -39,7 +39,13 @@ class MainEngine(object):
         self.initGateway()
 
         # 扩展模块
-        self.ctaEngine = CtaEngine(self, self.eventEngine)
+        # ctaShardCount大于0时，CTA策略分片运行在多个工作进程中
+        self.ctaShardCount = loadCtaShardSetting()
+        if self.ctaShardCount:
+            from ctaAlgo.ctaShard import ShardedCtaEngine
+            self.ctaEngine = ShardedCtaEngine(self, self.eventEngine, self.ctaShardCount)
+        else:
+            self.ctaEngine = CtaEngine(self, self.eventEngine)
         self.drEngine = DrEngine(self, self.eventEngine)
         self.rmEngine = RmEngine(self, self.eventEngine)
         
@@ -206,6 +212,10 @@ class MainEngine(object):
         for gateway in self.gatewayDict.values():        
             gateway.close()
         
+        # 停止CTA工作进程
+        if self.ctaShardCount:
+            self.ctaEngine.stop()
+
         # 停止事件引擎
         self.eventEngine.stop()
         
@@ -47,6 +47,38 @@ def loadMongoSetting():
         
     return host, port, logging
 
+#----------------------------------------------------------------------
+def loadCtaShardSetting():
+    """载入CTA策略分片运行的工作进程数量，0表示在主进程中运行"""
+    fileName = 'VT_setting.json'
+    path = os.path.abspath(os.path.dirname(__file__))
+    fileName = os.path.join(path, fileName)
+    try:
+        f = file(fileName)
+        setting = json.load(f)
+        shardCount = int(setting.get('ctaShardCount', 0))
+    except:
+        shardCount = 0
+
+    return shardCount
+
+#----------------------------------------------------------------------
+def loadHistoryCacheSetting():
+    """载入本地历史数据缓存的目录，为空表示不使用缓存，相对路径以vn.trader目录为起点"""
+    fileName = 'VT_setting.json'
+    path = os.path.abspath(os.path.dirname(__file__))
+    fileName = os.path.join(path, fileName)
+    try:
+        f = file(fileName)
+        setting = json.load(f)
+        cacheDir = setting.get('historyCacheDir', '')
+    except:
+        cacheDir = ''
+
+    if cacheDir and not os.path.isabs(cacheDir):
+        cacheDir = os.path.join(path, cacheDir)
+    return cacheDir
+
 #----------------------------------------------------------------------
 def todayDate():
     """获取当前本机电脑时间的日期"""
@@ -177,13 +177,105 @@ class VtBaseData(object):
         
         
 ########################################################################
-class VtTickData(VtBaseData):
-    """Tick行情数据类"""
+class VtSlotsData(object):
+    """
+    使用__slots__保存字段的数据类基类，用于tick和K线这类大量创建的对象
+    
+    对象不再包含__dict__，内存占用约为普通对象的一半，同时保留了以下兼容：
+    1. 读取obj.__dict__返回字段字典（用于插入数据库）
+    2. 设置obj.__dict__ = d时从字典中读取同名字段（用于从数据库载入），
+       字典中不属于该类的键（如MongoDB的_id）会被忽略
+    3. 支持copy、deepcopy和pickle
+    """
+    __slots__ = ()
+
+    #----------------------------------------------------------------------
+    @classmethod
+    def getFieldList(cls):
+        """获取该类的全部字段名（包括父类中定义的字段）"""
+        try:
+            return SLOTS_FIELD_DICT[cls]
+        except KeyError:
+            l = []
+            for c in reversed(cls.__mro__):
+                for name in c.__dict__.get('__slots__', ()):
+                    if name not in l:
+                        l.append(name)
+            fieldList = tuple(l)
+            SLOTS_FIELD_DICT[cls] = fieldList
+            SLOTS_FIELD_SET_DICT[cls] = frozenset(fieldList)
+            return fieldList
+
+    #----------------------------------------------------------------------
+    def toDict(self, fieldList=None):
+        """转换为字典，fieldList可以指定只输出部分字段"""
+        if fieldList is None:
+            fieldList = self.getFieldList()
+        return dict([(name, getattr(self, name, None)) for name in fieldList])
+
+    #----------------------------------------------------------------------
+    def fromDict(self, d):
+        """从字典中读取同名字段"""
+        cls = self.__class__
+        try:
+            fieldSet = SLOTS_FIELD_SET_DICT[cls]
+        except KeyError:
+            cls.getFieldList()
+            fieldSet = SLOTS_FIELD_SET_DICT[cls]
+        
+        for key, value in d.iteritems():
+            if key in fieldSet:
+                setattr(self, key, value)
+
+    #----------------------------------------------------------------------
+    def copyFrom(self, data, fieldList=None):
+        """从另一个数据对象复制同名字段，fieldList默认为本类的全部字段"""
+        if fieldList is None:
+            fieldList = self.getFieldList()
+        for name in fieldList:
+            setattr(self, name, getattr(data, name))
+
+    # 兼容原先直接读写__dict__的代码
+    __dict__ = property(toDict, fromDict)
+
+    #----------------------------------------------------------------------
+    def __getstate__(self):
+        """pickle和copy时保存的状态"""
+        return self.toDict()
+
+    #----------------------------------------------------------------------
+    def __setstate__(self, state):
+        """pickle和copy时恢复状态"""
+        self.fromDict(state)
+
+
+# VtSlotsData子类的字段缓存，key为类，value为字段名元组和集合
+SLOTS_FIELD_DICT = {}
+SLOTS_FIELD_SET_DICT = {}
+        
+        
+########################################################################
+class VtTickData(VtSlotsData):
+    """
+    Tick行情数据类
+    
+    使用__slots__以减少内存占用，CTA引擎和行情记录引擎直接使用该对象，
+    不再复制为CtaTickData和DrTickData
+    """
+    __slots__ = ('gatewayName', 'rawData',
+                 'symbol', 'exchange', 'vtSymbol',
+                 'lastPrice', 'lastVolume', 'volume', 'openInterest', 'time', 'date', 'datetime',
+                 'openPrice', 'highPrice', 'lowPrice', 'preClosePrice', 'upperLimit', 'lowerLimit',
+                 'bidPrice1', 'bidPrice2', 'bidPrice3', 'bidPrice4', 'bidPrice5',
+                 'askPrice1', 'askPrice2', 'askPrice3', 'askPrice4', 'askPrice5',
+                 'bidVolume1', 'bidVolume2', 'bidVolume3', 'bidVolume4', 'bidVolume5',
+                 'askVolume1', 'askVolume2', 'askVolume3', 'askVolume4', 'askVolume5')
 
     #----------------------------------------------------------------------
     def __init__(self):
         """Constructor"""
-        super(VtTickData, self).__init__()
+        self.gatewayName = EMPTY_STRING         # Gateway名称        
+        self.rawData = None                     # 原始数据
         
         # 代码相关
         self.symbol = EMPTY_STRING              # 合约代码
@@ -197,6 +289,7 @@ class VtTickData(VtBaseData):
         self.openInterest = EMPTY_INT           # 持仓量
         self.time = EMPTY_STRING                # 时间 11:20:56.5
         self.date = EMPTY_STRING                # 日期 20151009
+        self.datetime = None                    # python的datetime时间对象，由CTA引擎或行情记录引擎在首次使用时解析
         
         # 常规行情
         self.openPrice = EMPTY_FLOAT            # 今日开盘价
@@ -0,0 +1,290 @@
+# encoding: UTF-8
+
+"""
+包含tick时间解析和交易时段判断的函数，供CTA引擎和行情记录引擎共享使用
+
+1. parseTickDatetime用于代替datetime.strptime解析tick的日期和时间字符串，
+   对CTP的HH:MM:SS.f格式直接按位置切分解析，并按秒缓存解析结果
+2. compileSession将DR_setting.json中配置的交易时段编译为一天1440分钟的位图，
+   判断某个时间是否处于交易时段只需要一次下标访问
+3. SessionTable将品种的交易时段预先计算为按分钟下标访问的表格（Tick属于哪一分钟、
+   K线在哪一分钟结束），K线合成不再需要在代码中写死10:15、11:30、15:00等时间
+"""
+
+import re
+from datetime import datetime, timedelta
+
+MINUTES_PER_DAY = 1440              # 一天的分钟数
+TICK_TIME_CACHE_SIZE = 10000        # 按秒缓存的datetime数量上限，超过后清空重建
+TRADING_DAY_START = 20 * 60         # 交易日开始的分钟数，20点之后的夜盘属于下一个交易日
+
+# 国内期货品种的交易时段，时间为[开始, 结束)，结束时间小于开始时间表示跨越午夜
+DAY_SESSION = [['09:00', '10:15'], ['10:30', '11:30'], ['13:30', '15:00']]
+PRODUCT_SESSION_DICT = {}
+
+for product in ['AU', 'AG']:
+    PRODUCT_SESSION_DICT[product] = [['21:00', '02:30']] + DAY_SESSION
+for product in ['CU', 'AL', 'ZN', 'PB', 'NI', 'SN']:
+    PRODUCT_SESSION_DICT[product] = [['21:00', '01:00']] + DAY_SESSION
+for product in ['RB', 'HC', 'BU', 'RU']:
+    PRODUCT_SESSION_DICT[product] = [['21:00', '23:00']] + DAY_SESSION
+for product in ['A', 'B', 'M', 'Y', 'P', 'J', 'JM', 'I',                # 大商所
+                'SR', 'CF', 'RM', 'MA', 'TA', 'ZC', 'FG', 'OI']:        # 郑商所
+    PRODUCT_SESSION_DICT[product] = [['21:00', '23:30']] + DAY_SESSION
+for product in ['FU', 'WR', 'L', 'V', 'PP', 'C', 'CS', 'JD', 'BB', 'FB',
+                'WH', 'PM', 'RI', 'LR', 'JR', 'SF', 'SM']:
+    PRODUCT_SESSION_DICT[product] = DAY_SESSION
+for product in ['IF', 'IH', 'IC']:
+    PRODUCT_SESSION_DICT[product] = [['09:30', '11:30'], ['13:00', '15:00']]
+for product in ['T', 'TF']:
+    PRODUCT_SESSION_DICT[product] = [['09:15', '11:30'], ['13:00', '15:15']]
+
+# 未知品种使用全天连续的交易时段，不过滤任何数据
+FULL_DAY_SESSION = [['00:00', '00:00']]
+
+# 按秒缓存的解析结果，key为(date, time的HH:MM:SS部分)，value为datetime对象
+tickTimeCache = {}
+
+
+#----------------------------------------------------------------------
+def parseTickDatetime(date, time):
+    """
+    解析tick的日期和时间字符串，返回datetime对象
+    date格式为YYYYMMDD，time格式为HH:MM:SS或者HH:MM:SS.f（小数部分最多6位）
+    无法按快速路径解析的格式交给datetime.strptime处理
+    """
+    key = (date, time[:8])
+    try:
+        dt = tickTimeCache[key]
+    except KeyError:
+        try:
+            dt = datetime(int(date[0:4]), int(date[4:6]), int(date[6:8]),
+                          int(time[0:2]), int(time[3:5]), int(time[6:8]))
+        except ValueError:
+            return datetime.strptime(' '.join([date, time]), '%Y%m%d %H:%M:%S.%f')
+
+        if len(tickTimeCache) >= TICK_TIME_CACHE_SIZE:
+            tickTimeCache.clear()
+        tickTimeCache[key] = dt
+
+    # 秒以下的部分
+    fraction = time[9:]
+    if fraction:
+        try:
+            microsecond = int(fraction[:6]) * 10 ** (6 - len(fraction[:6]))
+        except ValueError:
+            return datetime.strptime(' '.join([date, time]), '%Y%m%d %H:%M:%S.%f')
+        if microsecond:
+            dt = dt.replace(microsecond=microsecond)
+
+    return dt
+
+
+#----------------------------------------------------------------------
+def getMinuteOfDay(time):
+    """获取HH:MM或者HH:MM:SS.f格式的时间字符串对应一天中的第几分钟"""
+    return int(time[0:2]) * 60 + int(time[3:5])
+
+
+#----------------------------------------------------------------------
+def compileSession(timeList, includeStart=True, includeMidnight=False):
+    """
+    将交易时段列表编译为分钟位图
+
+    timeList为[[开始时间, 结束时间], ...]，时间格式为HH:MM，结束时间小于开始时间
+    表示跨越午夜的时段。结束时间所在的分钟总是包含在时段内，includeStart控制
+    开始时间所在的分钟是否包含在时段内，includeMidnight控制00:00是否总是包含在内。
+
+    返回长度为1440的bytearray，某一分钟处于时段内则对应位置为1
+    """
+    bitmap = bytearray(MINUTES_PER_DAY)
+
+    for startTime, endTime in timeList:
+        start = getMinuteOfDay(startTime)
+        end = getMinuteOfDay(endTime)
+
+        if start <= end:
+            minuteList = range(start, end+1)
+        else:
+            minuteList = range(start, MINUTES_PER_DAY) + range(0, end+1)
+
+        if not includeStart:
+            minuteList = minuteList[1:]
+
+        for minute in minuteList:
+            bitmap[minute] = 1
+
+    if includeMidnight:
+        bitmap[0] = 1
+
+    return bitmap
+
+
+#----------------------------------------------------------------------
+def getTradingDay(dt):
+    """获取时间所属的交易日（date对象），不考虑节假日"""
+    if dt.hour * 60 + dt.minute >= TRADING_DAY_START:
+        dt += timedelta(days=1)
+
+    # 周五夜盘（包括周六凌晨）属于下周一
+    weekday = dt.weekday()
+    if weekday >= 5:
+        dt += timedelta(days=7 - weekday)
+    return dt.date()
+
+
+#----------------------------------------------------------------------
+def getProductCode(symbol):
+    """获取合约代码对应的品种代码（大写），如rb1701.SHFE为RB"""
+    match = re.match('[A-Za-z]+', symbol)
+    if match:
+        return match.group().upper()
+    return ''
+
+
+#----------------------------------------------------------------------
+def compileTradingMinute(timeList):
+    """
+    将[开始, 结束)的交易时段列表编译为交易分钟的位图（以开始的分钟表示一分钟），
+    兼容DR_setting.json中用23:59和00:00表示跨越午夜的写法
+    """
+    bitmap = bytearray(MINUTES_PER_DAY)
+    for startTime, endTime in timeList:
+        start = getMinuteOfDay(startTime)
+        end = getMinuteOfDay(endTime)
+        if end == MINUTES_PER_DAY - 1:
+            end = MINUTES_PER_DAY
+        if end <= start:
+            end += MINUTES_PER_DAY
+        for minute in range(start, end):
+            bitmap[minute % MINUTES_PER_DAY] = 1
+    return bitmap
+
+
+########################################################################
+class SessionTable(object):
+    """
+    品种交易时段的分钟表格
+
+    表格的下标为一天中的第几分钟，分钟K线以开始的分钟表示（如9:00表示9:00-9:01），
+    交易时段[09:00, 10:15)的交易分钟为9:00至10:14：
+    1. tickOffsetList：该分钟的Tick属于哪一分钟的K线（相对偏移），交易分钟为0，
+       时段结束的那一分钟（收盘Tick，如10:15）为-1，时段开始前的一分钟（集合竞价，
+       如20:59）为1，其他为None（非交易时段的数据）
+    2. getWindow：按周期预先计算每一分钟所属的K线窗口序号和K线结束的分钟，
+       同一个交易日内按交易时段的先后排列（从20点开始），N分钟K线在每个连续时段内
+       按交易分钟数划分，在时段结束时截断
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, timeList):
+        """Constructor，timeList为[[开始时间, 结束时间], ...]"""
+        self.trading = trading = compileTradingMinute(timeList)
+
+        # 按交易日内的先后顺序划分连续的交易时段
+        self.segmentList = []
+        previous = False
+        for i in range(MINUTES_PER_DAY):
+            minute = (TRADING_DAY_START + i) % MINUTES_PER_DAY
+            if trading[minute]:
+                if not previous:
+                    self.segmentList.append([])
+                self.segmentList[-1].append(minute)
+            previous = trading[minute]
+
+        self.tickOffsetList = [None] * MINUTES_PER_DAY
+        for segment in self.segmentList:
+            for minute in segment:
+                self.tickOffsetList[minute] = 0
+        for segment in self.segmentList:
+            close = (segment[-1] + 1) % MINUTES_PER_DAY
+            if not trading[close]:
+                self.tickOffsetList[close] = -1
+        for segment in self.segmentList:
+            auction = (segment[0] - 1) % MINUTES_PER_DAY
+            if self.tickOffsetList[auction] is None:
+                self.tickOffsetList[auction] = 1
+
+        self.windowDict = {}
+
+    #----------------------------------------------------------------------
+    def isTrading(self, minute):
+        """该分钟是否为交易分钟"""
+        return bool(self.trading[minute])
+
+    #----------------------------------------------------------------------
+    def getWindow(self, period):
+        """
+        获取周期的K线窗口，返回(窗口序号列表, K线结束分钟的bytearray)，结果会被缓存
+        period为分钟数、'daily'（每个交易日一根K线）或者K线结束时间的元组（如('10:45', '15:00')）
+        非交易分钟的窗口序号和之前最近的交易分钟相同
+        """
+        try:
+            return self.windowDict[period]
+        except KeyError:
+            pass
+
+        endSet = set()
+        if isinstance(period, tuple):
+            for endTime in period:
+                # 结束时间之前最近的交易分钟
+                minute = getMinuteOfDay(endTime) - 1
+                for i in range(MINUTES_PER_DAY):
+                    if self.trading[(minute - i) % MINUTES_PER_DAY]:
+                        endSet.add((minute - i) % MINUTES_PER_DAY)
+                        break
+
+        idList = [0] * MINUTES_PER_DAY
+        endList = bytearray(MINUTES_PER_DAY)
+        windowId = 0
+        for segment in self.segmentList:
+            for i, minute in enumerate(segment):
+                idList[minute] = windowId
+                if isinstance(period, tuple):
+                    end = minute in endSet
+                elif isinstance(period, int):
+                    end = (i + 1) % period == 0 or i == len(segment) - 1
+                else:
+                    end = False
+                if end:
+                    endList[minute] = 1
+                    windowId += 1
+
+        # 交易日的最后一分钟总是结束K线
+        if self.segmentList:
+            endList[self.segmentList[-1][-1]] = 1
+
+        # 非交易分钟沿用之前最近的交易分钟的窗口
+        lastId = 0
+        for i in range(MINUTES_PER_DAY):
+            minute = (TRADING_DAY_START + i) % MINUTES_PER_DAY
+            if self.trading[minute]:
+                lastId = idList[minute]
+            else:
+                idList[minute] = lastId
+
+        window = (idList, endList)
+        self.windowDict[period] = window
+        return window
+
+
+# 交易时段表格的缓存，key为交易分钟位图的字符串
+sessionTableDict = {}
+
+
+#----------------------------------------------------------------------
+def getSessionTable(symbol, timeList=None):
+    """
+    获取合约的交易时段表格，timeList为None时使用品种的默认交易时段，
+    未知品种使用全天连续的交易时段，相同交易时段的合约共享同一个表格
+    """
+    if timeList is None:
+        timeList = PRODUCT_SESSION_DICT.get(getProductCode(symbol), FULL_DAY_SESSION)
+
+    key = str(compileTradingMinute(timeList))
+    try:
+        return sessionTableDict[key]
+    except KeyError:
+        table = SessionTable(timeList)
+        sessionTableDict[key] = table
+        return table
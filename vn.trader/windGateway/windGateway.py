@@ -160,12 +160,11 @@ class WindGateway(VtGateway):
         # 采用遍历的形式读取数值
         fields = data.Fields
         values = data.Data
-        d = tick.__dict__
         for n, field in enumerate(fields):
             field = field.lower()
             key = self.wsqParamMap[field]
             value = values[n][0]
-            d[key] = value
+            setattr(tick, key, value)
         
         newtick = copy(tick)
         self.onTick(newtick)